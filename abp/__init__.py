@@ -0,0 +1 @@
+default_app_config = 'abp.apps.AbpConfig'
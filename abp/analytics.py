@@ -0,0 +1,377 @@
+"""
+Módulo contendo o snapshot colunar do histórico de batalhas e as agregações
+vetorizadas calculadas sobre ele.
+O snapshot é gravado em ABP_SNAPSHOT_DIR pelo comando snapshot_battles: um
+arquivo .npy por coluna (ver COLUMNS), com o tipo e o papel do líder e a
+liga de cada batalha, e um meta.json com a quantidade de linhas, o
+vocabulário dos tipos e a marca d'água (o ID da última batalha gravada).
+Os snapshots incrementais anexam às colunas apenas as batalhas com ID acima
+da marca d'água, e as batalhas mais recentes que SETTLE_SECONDS são deixadas
+para o snapshot seguinte: uma batalha ainda não confirmada pode ter um ID
+menor que o de uma batalha já confirmada. O snapshot apenas anexa batalhas;
+batalhas removidas ou alteradas depois de gravadas só são atualizadas por
+um snapshot completo.
+A leitura (ver Snapshot) mapeia as colunas na memória sem copiá-las. O
+meta.json é trocado atomicamente apenas após a gravação das colunas, e as
+linhas além da contagem do meta.json são ignoradas: um snapshot
+interrompido não é visto pelos leitores.
+"""
+import fcntl
+import json
+import os
+import struct
+from contextlib import contextmanager
+from datetime import timedelta
+from uuid import uuid4
+import numpy as np
+from django.conf import settings
+from django.db.models import BooleanField, Case, F, Value, When
+from django.utils import timezone
+from abp.models import Battle, Leader
+
+
+# Colunas do snapshot. Os IDs nulos (ex: a liga removida) são gravados como
+# -1; leader_type e leader_role são índices dos vocabulários do meta.json.
+COLUMNS = {
+    'id': np.dtype('<i8'),
+    'battle_datetime': np.dtype('<M8[s]'),
+    'trainer_id': np.dtype('<i4'),
+    'leader_id': np.dtype('<i4'),
+    'league_id': np.dtype('<i4'),
+    'score_id': np.dtype('<i4'),
+    'trainer_won': np.dtype('?'),
+    'leader_type': np.dtype('<i2'),
+    'leader_role': np.dtype('<i1'),
+}
+
+ROLES = [role for role, _ in Leader.ROLES]
+
+# Batalhas lidas do banco de dados por vez
+CHUNK_SIZE = 10000
+
+# Idade mínima (em segundos) das batalhas gravadas pelo snapshot
+SETTLE_SECONDS = 60
+
+# Tamanho fixo do cabeçalho dos arquivos .npy: o cabeçalho é reescrito com a
+# nova quantidade de linhas a cada snapshot incremental
+HEADER_SIZE = 128
+
+META_FILE = 'meta.json'
+LOCK_FILE = 'snapshot.lock'
+
+
+def snapshot_dir():
+    return settings.ABP_SNAPSHOT_DIR
+
+
+def read_meta(path):
+    """
+    Retorna o meta.json do snapshot, ou None se não houver snapshot.
+    """
+    try:
+        with open(os.path.join(path, META_FILE)) as meta_file:
+            return json.load(meta_file)
+    except FileNotFoundError:
+        return None
+
+
+def write_meta(path, meta):
+    temporary = os.path.join(path, f'{META_FILE}.tmp')
+    with open(temporary, 'w') as meta_file:
+        json.dump(meta, meta_file)
+        meta_file.flush()
+        os.fsync(meta_file.fileno())
+    os.replace(temporary, os.path.join(path, META_FILE))
+
+
+def write_header(column_file, dtype, rows):
+    """
+    Escreve o cabeçalho .npy (versão 1.0) da coluna, com HEADER_SIZE bytes.
+    """
+    header = repr({
+        'descr': np.lib.format.dtype_to_descr(dtype),
+        'fortran_order': False,
+        'shape': (rows,),
+    })
+    header = header.ljust(HEADER_SIZE - 11) + '\n'
+    column_file.seek(0)
+    column_file.write(
+        b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) +
+        header.encode('latin1')
+    )
+
+
+@contextmanager
+def snapshot_lock(path):
+    """
+    Impede a execução simultânea de dois snapshots no mesmo diretório.
+    """
+    with open(os.path.join(path, LOCK_FILE), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def battle_rows(watermark, until, chunk_size):
+    """
+    Lê as batalhas com ID acima da marca d'água registradas antes de `until`,
+    em ordem de ID.
+    """
+    return Battle.objects.filter(
+        pk__gt=watermark,
+        battle_datetime__lt=until
+    ).annotate(
+        trainer_won=Case(
+            When(winner_name=F('trainer__discord_id'), then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField()
+        )
+    ).order_by('pk').values_list(
+        'pk',
+        'battle_datetime',
+        'trainer_id',
+        'leader_id',
+        'league_id',
+        'score_id',
+        'trainer_won',
+        'leader__pokemon_type',
+        'leader__role',
+    ).iterator(chunk_size=chunk_size)
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def encode(values, vocabulary):
+    """
+    Converte os valores em índices do vocabulário, incluindo os valores
+    novos no fim do vocabulário.
+    """
+    indexes = {value: index for index, value in enumerate(vocabulary)}
+    codes = []
+    for value in values:
+        if value not in indexes:
+            indexes[value] = len(vocabulary)
+            vocabulary.append(value)
+        codes.append(indexes[value])
+    return codes
+
+
+def chunk_arrays(chunk, pokemon_types):
+    ids, datetimes, trainers, leaders, leagues, scores, won, types, roles = zip(*chunk)
+
+    def nullable(values):
+        return [-1 if value is None else value for value in values]
+
+    return {
+        'id': np.array(ids, dtype=COLUMNS['id']),
+        'battle_datetime': np.array(
+            # datetime64 não aceita datetimes com timezone
+            [int(moment.timestamp()) for moment in datetimes],
+            dtype='<i8'
+        ).astype(COLUMNS['battle_datetime']),
+        'trainer_id': np.array(nullable(trainers), dtype=COLUMNS['trainer_id']),
+        'leader_id': np.array(nullable(leaders), dtype=COLUMNS['leader_id']),
+        'league_id': np.array(nullable(leagues), dtype=COLUMNS['league_id']),
+        'score_id': np.array(nullable(scores), dtype=COLUMNS['score_id']),
+        'trainer_won': np.array(won, dtype=COLUMNS['trainer_won']),
+        'leader_type': np.array(
+            encode([value or '' for value in types], pokemon_types),
+            dtype=COLUMNS['leader_type']
+        ),
+        'leader_role': np.array(
+            [ROLES.index(role) if role in ROLES else -1 for role in roles],
+            dtype=COLUMNS['leader_role']
+        ),
+    }
+
+
+def snapshot_battles(path=None, full=False, settle=SETTLE_SECONDS,
+                     chunk_size=CHUNK_SIZE):
+    """
+    Grava no snapshot as batalhas registradas desde o snapshot anterior, ou
+    todas as batalhas em um novo snapshot se `full` for verdadeiro ou se
+    ainda não houver snapshot.
+    return : <int> quantidade de batalhas gravadas
+    """
+    path = path or snapshot_dir()
+    os.makedirs(path, exist_ok=True)
+
+    with snapshot_lock(path):
+        meta = read_meta(path)
+        previous = None
+        if meta is None or full:
+            # Um novo snapshot é gravado em outro diretório, e os leitores do
+            # snapshot anterior continuam lendo os arquivos antigos
+            previous = meta and meta['generation']
+            meta = {
+                'generation': uuid4().hex,
+                'rows': 0,
+                'watermark': 0,
+                'pokemon_types': [],
+                'roles': ROLES,
+            }
+        directory = os.path.join(path, meta['generation'])
+        os.makedirs(directory, exist_ok=True)
+
+        files = {}
+        try:
+            for column, dtype in COLUMNS.items():
+                column_path = os.path.join(directory, f'{column}.npy')
+                files[column] = open(
+                    column_path,
+                    'r+b' if os.path.exists(column_path) else 'w+b'
+                )
+                # Linhas de um snapshot interrompido são sobrescritas
+                files[column].seek(HEADER_SIZE + meta['rows'] * dtype.itemsize)
+
+            rows = meta['rows']
+            until = timezone.now() - timedelta(seconds=settle)
+            watermark = meta['watermark']
+            for chunk in chunked(battle_rows(watermark, until, chunk_size), chunk_size):
+                arrays = chunk_arrays(chunk, meta['pokemon_types'])
+                for column, array in arrays.items():
+                    files[column].write(array.tobytes())
+                rows += len(chunk)
+                watermark = chunk[-1][0]
+
+            for column, dtype in COLUMNS.items():
+                write_header(files[column], dtype, rows)
+                files[column].flush()
+                os.fsync(files[column].fileno())
+        finally:
+            for column_file in files.values():
+                column_file.close()
+
+        written = rows - meta['rows']
+        meta.update(
+            rows=rows,
+            watermark=watermark,
+            updated_at=timezone.now().isoformat()
+        )
+        write_meta(path, meta)
+
+        if previous:
+            for column in COLUMNS:
+                os.remove(os.path.join(path, previous, f'{column}.npy'))
+            os.rmdir(os.path.join(path, previous))
+
+    return written
+
+
+class Snapshot:
+    """
+    Leitura do snapshot das batalhas, com as colunas mapeadas na memória.
+    """
+    def __init__(self, path=None):
+        path = path or snapshot_dir()
+        meta = read_meta(path)
+        if meta is None:
+            raise Exception('There is no battle snapshot.')
+
+        self.rows = meta['rows']
+        self.watermark = meta['watermark']
+        self.pokemon_types = meta['pokemon_types']
+        self.roles = meta['roles']
+        directory = os.path.join(path, meta['generation'])
+        # As colunas são mapeadas na abertura: um snapshot completo gravado
+        # depois remove os arquivos, mas os mapeamentos continuam válidos
+        self.columns = {
+            column: self.map_column(directory, column, dtype)
+            for column, dtype in COLUMNS.items()
+        }
+
+    def map_column(self, directory, column, dtype):
+        if not self.rows:
+            # Arquivos sem linhas não podem ser mapeados
+            return np.empty(0, dtype=dtype)
+        array = np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='r')
+        return array[:self.rows]
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def mask(self, league=None, since=None, until=None):
+        """
+        Seleciona as batalhas de uma liga (ID numérico) e de um intervalo de
+        datas (`since` inclusivo e `until` exclusivo, datetimes).
+        return : <np.ndarray> de bool
+        """
+        selected = np.ones(self.rows, dtype=bool)
+        if league is not None:
+            selected &= self['league_id'] == league
+        if since is not None:
+            selected &= self['battle_datetime'] >= to_datetime64(since)
+        if until is not None:
+            selected &= self['battle_datetime'] < to_datetime64(until)
+        return selected
+
+    def keys(self, by):
+        """
+        Retorna a chave de agrupamento de cada batalha e a função que
+        converte as chaves nos rótulos do resultado.
+        """
+        if by == 'pokemon_type':
+            return self['leader_type'], lambda code: self.pokemon_types[code]
+        if by == 'role':
+            return self['leader_role'], lambda code: self.roles[code] if code >= 0 else None
+        if by == 'month':
+            return (
+                self['battle_datetime'].astype('M8[M]'),
+                lambda month: str(month)
+            )
+        if by in ('leader', 'trainer', 'league'):
+            return self[f'{by}_id'], lambda pk: int(pk) if pk >= 0 else None
+        raise Exception(f'Unknown aggregation: {by}')
+
+    def win_rates(self, by, **filters):
+        """
+        Agrega as batalhas pela chave fornecida (pokemon_type, role, month,
+        leader, trainer ou league), filtradas como em `mask`.
+        return : <list> de <dict> com as chaves key, battles, trainer_wins,
+                 leader_wins e leader_win_rate, ordenada pela chave (a
+                 chave nula por último)
+        """
+        keys, label = self.keys(by)
+        selected = self.mask(**filters)
+        keys = keys[selected]
+        won = self['trainer_won'][selected]
+
+        groups, inverse = np.unique(keys, return_inverse=True)
+        battles = np.bincount(inverse, minlength=len(groups))
+        trainer_wins = np.bincount(
+            inverse,
+            weights=won,
+            minlength=len(groups)
+        ).astype(np.int64)
+
+        results = [
+            {
+                'key': label(group),
+                'battles': int(total),
+                'trainer_wins': int(wins),
+                'leader_wins': int(total - wins),
+                'leader_win_rate': float((total - wins) / total),
+            }
+            for group, total, wins in zip(groups, battles, trainer_wins)
+        ]
+        # Os tipos são ordenados pelo nome, e não pela ordem do vocabulário
+        results.sort(key=lambda result: (result['key'] is None, result['key']))
+        return results
+
+
+def to_datetime64(moment):
+    return np.datetime64(int(moment.timestamp()), 's')
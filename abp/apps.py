@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class AbpConfig(AppConfig):
     name = 'abp'
+
+    def ready(self):
+        from abp.bus import connect_signals
+        connect_signals(self)
@@ -0,0 +1,347 @@
+"""
+Módulo contendo a escrita do registro de batalhas.
+"""
+from collections import defaultdict, namedtuple
+from math import ceil
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from abp.models import Battle, League, Trainer, Score, Leader
+from abp.ratings import rate_battle
+from abp.resolvers import resolve_standby
+from abp.rollups import record_battles
+from abp.standings import update_standing
+from abp.utils import get_exp, lv_update
+
+
+# Registro de uma batalha a ser registrada em lote.
+# league é o ID numérico da liga; os demais campos são discord_ids.
+BattleRecord = namedtuple('BattleRecord', 'league trainer leader winner')
+
+
+def update_percentages(player):
+    """
+    Atualiza a porcentagem de vitórias/derrotas do treinador/líder.
+    """
+    player.win_percentage = (player.total_wins / player.battle_counter) * 100
+    player.loose_percentage = (player.total_losses / player.battle_counter) * 100
+
+
+def register_battle(score, trainer, leader, winner):
+    """
+    Registra uma batalha entre o treinador e o líder no score fornecido.
+    Toda a escrita ocorre em uma única transação. Os contadores são
+    incrementados com expressões F(), o que trava as linhas do score, do
+    treinador e do líder (sempre nesta ordem) até o commit; os valores
+    derivados (exp, lv e porcentagens) são calculados a partir das linhas já
+    travadas, portanto registros concorrentes não perdem atualizações.
+    param : score : <Score>
+    param : trainer : <Trainer>
+    param : leader : <Leader>
+    param : winner : <str> discord_id do vencedor
+    return : <Battle>
+    """
+    trainer_won = winner == trainer.discord_id
+
+    with transaction.atomic():
+        Score.objects.filter(pk=score.pk).update(
+            wins=F('wins') + int(trainer_won),
+            losses=F('losses') + int(not trainer_won),
+        )
+        score.refresh_from_db(
+            fields=['wins', 'losses', 'last_battle_at', 'last_battle_lost']
+        )
+
+        # Verifica se o treinador está de molho
+        if resolve_standby(score):
+            raise Exception(
+                'This trainer is in standby in this league and cant battle.'
+            )
+
+        # incrementa o contrador de batalhas dos lutadores
+        Trainer.objects.filter(pk=trainer.pk).update(
+            battle_counter=F('battle_counter') + 1,
+            total_wins=F('total_wins') + int(trainer_won),
+            total_losses=F('total_losses') + int(not trainer_won),
+        )
+        Leader.objects.filter(pk=leader.pk).update(
+            battle_counter=F('battle_counter') + 1,
+            total_wins=F('total_wins') + int(not trainer_won),
+            total_losses=F('total_losses') + int(trainer_won),
+        )
+        trainer.refresh_from_db()
+        leader.refresh_from_db()
+
+        # calcula o total de experência que a batalha fornecerá
+        exp = get_exp(trainer.lv, leader.lv)
+        if trainer_won:
+            trainer.exp += exp
+            leader.exp += ceil(exp/4)
+        else:
+            trainer.exp += ceil(exp/4)
+            leader.exp += exp
+        rate_battle(trainer, leader, trainer_won)
+
+        for player in (trainer, leader):
+            lv_update(player)
+            update_percentages(player)
+            player.save(update_fields=[
+                'exp', 'lv', 'next_lv', 'win_percentage', 'loose_percentage',
+                'rating'
+            ])
+
+        # Registra a batalha no score do treinador
+        battle = Battle.objects.create(
+            leader=leader,
+            trainer=trainer,
+            league_id=score.league_id,
+            score=score,
+            winner_name=winner
+        )
+
+        score.last_battle_at = battle.battle_datetime
+        score.last_battle_lost = not trainer_won
+        score.save(update_fields=['last_battle_at', 'last_battle_lost'])
+
+        record_battles([(
+            score.league_id,
+            trainer.pk,
+            leader.pk,
+            battle.battle_datetime,
+            trainer_won
+        )])
+        update_standing(score)
+
+    return battle
+
+
+def increment_counters(model, deltas, fields):
+    """
+    Incrementa com expressões F() os contadores das linhas fornecidas.
+    As linhas com os mesmos incrementos são atualizadas em um único UPDATE.
+    param : model : <Model>
+    param : deltas : <dict> pk -> incrementos, na ordem de `fields`
+    param : fields : <tuple> nomes dos campos incrementados
+    """
+    groups = defaultdict(list)
+    for pk, increments in deltas.items():
+        groups[tuple(increments)].append(pk)
+
+    for increments, pks in groups.items():
+        model.objects.filter(pk__in=pks).update(**{
+            field: F(field) + increment
+            for field, increment in zip(fields, increments)
+        })
+
+
+def bulk_create_battles(battles):
+    """
+    Insere as batalhas em lote, preenchendo o ID de cada uma.
+    Somente o postgres retorna os IDs de um insert em lote. No sqlite, que
+    trava o banco para escrita, os IDs de cada insert multi-linha são
+    consecutivos e são recuperados a partir do último ID inserido. Nos demais
+    bancos (ex: mysql com innodb_autoinc_lock_mode=2) os IDs são crescentes,
+    mas não necessariamente consecutivos: como os scores das batalhas estão
+    travados pela transação, as batalhas dos scores com IDs acima do maior ID
+    anterior são as inseridas, na ordem dos IDs.
+    """
+    if connection.features.can_return_ids_from_bulk_insert:
+        return Battle.objects.bulk_create(battles)
+
+    if connection.vendor != 'sqlite':
+        scores = {battle.score_id for battle in battles}
+        previous = Battle.objects.filter(score_id__in=scores).aggregate(
+            last=Max('pk')
+        )['last'] or 0
+        Battle.objects.bulk_create(battles)
+        pks = list(Battle.objects.filter(
+            score_id__in=scores,
+            pk__gt=previous
+        ).order_by('pk').values_list('pk', flat=True))
+        if len(pks) != len(battles):
+            raise Exception('Could not read the IDs of the registered battles.')
+        for battle, pk in zip(battles, pks):
+            battle.pk = pk
+        return battles
+
+    fields = [f for f in Battle._meta.concrete_fields if not f.primary_key]
+    batch_size = max(connection.ops.bulk_batch_size(fields, battles), 1)
+    for start in range(0, len(battles), batch_size):
+        chunk = battles[start:start + batch_size]
+        Battle.objects.bulk_create(chunk)
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT last_insert_rowid()')
+            first_id = cursor.fetchone()[0] - len(chunk) + 1
+
+        for offset, battle in enumerate(chunk):
+            battle.pk = first_id + offset
+
+    return battles
+
+
+def register_battles(records, standings=True):
+    """
+    Registra em lote as batalhas fornecidas, na ordem em que aparecem.
+    Todos os registros são validados contra mapas pré-carregados de ligas,
+    treinadores, líderes e scores; se algum for inválido nenhuma batalha é
+    registrada. As regras de standby são aplicadas na ordem das batalhas e os
+    contadores, exp e lv de cada jogador são atualizados uma única vez, em uma
+    única transação.
+    param : records : <list> de BattleRecord ou tuplas equivalentes
+    param : standings : <bool> atualiza os rankings das ligas; cargas em massa
+                        podem desativar a atualização e recriar os rankings
+                        ao final (ver rebuild_standings)
+    return : <list> Battle
+    """
+    records = [BattleRecord(*record) for record in records]
+    leagues = League.objects.in_bulk({int(r.league) for r in records})
+    trainers = Trainer.objects.in_bulk(
+        {r.trainer for r in records},
+        field_name='discord_id'
+    )
+    leaders = Leader.objects.in_bulk(
+        {r.leader for r in records},
+        field_name='discord_id'
+    )
+    scores = {
+        (score.trainer_id, score.league_id): score.pk
+        for score in Score.objects.filter(
+            trainer__in=list(trainers.values()),
+            league__in=list(leagues.values())
+        ).only('pk', 'trainer_id', 'league_id')
+    }
+
+    errors = []
+    battles = []
+    for index, record in enumerate(records):
+        league = leagues.get(int(record.league))
+        trainer = trainers.get(record.trainer)
+        leader = leaders.get(record.leader)
+        if not league:
+            errors.append(f'battle {index}: Sorry, this league does not exist.')
+        elif not trainer:
+            errors.append(f'battle {index}: Trainer was not found on database!')
+        elif not leader:
+            errors.append(f'battle {index}: Leader was not found on database!')
+        elif (trainer.pk, league.pk) not in scores:
+            errors.append(
+                f'battle {index}: This trainer doesnt seems to be registered '
+                'on the given league!'
+            )
+        elif record.winner not in (trainer.discord_id, leader.discord_id):
+            errors.append(
+                f'battle {index}: The winner must be the given leader or trainer.'
+            )
+        else:
+            battles.append((
+                scores[(trainer.pk, league.pk)],
+                trainer.pk,
+                leader.pk,
+                record.winner == trainer.discord_id
+            ))
+
+    if errors:
+        raise Exception(' '.join(errors))
+
+    score_deltas = defaultdict(lambda: [0, 0])
+    trainer_deltas = defaultdict(lambda: [0, 0, 0])
+    leader_deltas = defaultdict(lambda: [0, 0, 0])
+    for score_id, trainer_id, leader_id, trainer_won in battles:
+        score_deltas[score_id][0 if trainer_won else 1] += 1
+        trainer_deltas[trainer_id][0] += 1
+        trainer_deltas[trainer_id][1 if trainer_won else 2] += 1
+        leader_deltas[leader_id][0] += 1
+        leader_deltas[leader_id][2 if trainer_won else 1] += 1
+
+    counters = ('battle_counter', 'total_wins', 'total_losses')
+    with transaction.atomic():
+        # As linhas dos scores, treinadores e líderes são travadas (nesta
+        # ordem e por ordem de pk) até o commit. No sqlite o primeiro
+        # incremento já trava o banco para escrita.
+        if connection.features.has_select_for_update:
+            for model, deltas in ((Score, score_deltas),
+                                  (Trainer, trainer_deltas),
+                                  (Leader, leader_deltas)):
+                list(model.objects.select_for_update().filter(
+                    pk__in=list(deltas)
+                ).order_by('pk').values_list('pk', flat=True))
+
+        increment_counters(Score, score_deltas, ('wins', 'losses'))
+        increment_counters(Trainer, trainer_deltas, counters)
+        increment_counters(Leader, leader_deltas, counters)
+        locked_scores = Score.objects.in_bulk(list(score_deltas))
+        locked_trainers = Trainer.objects.in_bulk(list(trainer_deltas))
+        locked_leaders = Leader.objects.in_bulk(list(leader_deltas))
+
+        created = []
+        for index, (score_id, trainer_id, leader_id, trainer_won) in enumerate(battles):
+            score = locked_scores[score_id]
+            trainer = locked_trainers[trainer_id]
+            leader = locked_leaders[leader_id]
+
+            # Verifica se o treinador está de molho
+            if resolve_standby(score):
+                errors.append(
+                    f'battle {index}: This trainer is in standby in this '
+                    'league and cant battle.'
+                )
+                continue
+
+            exp = get_exp(trainer.lv, leader.lv)
+            if trainer_won:
+                trainer.exp += exp
+                leader.exp += ceil(exp/4)
+            else:
+                trainer.exp += ceil(exp/4)
+                leader.exp += exp
+            lv_update(trainer)
+            lv_update(leader)
+            rate_battle(trainer, leader, trainer_won)
+
+            battle = Battle(
+                leader=leader,
+                trainer=trainer,
+                league_id=score.league_id,
+                score=score,
+                winner_name=records[index].winner
+            )
+            created.append((score, battle))
+            # O horário definitivo é atribuído após a inserção da batalha
+            score.last_battle_at = timezone.now()
+            score.last_battle_lost = not trainer_won
+
+        if errors:
+            raise Exception(' '.join(errors))
+
+        bulk_create_battles([battle for _, battle in created])
+
+        for player in (*locked_trainers.values(), *locked_leaders.values()):
+            update_percentages(player)
+            player.save(update_fields=[
+                'exp', 'lv', 'next_lv', 'win_percentage', 'loose_percentage',
+                'rating'
+            ])
+
+        for score, battle in created:
+            score.last_battle_at = battle.battle_datetime
+        for score in locked_scores.values():
+            score.save(update_fields=['last_battle_at', 'last_battle_lost'])
+
+        record_battles([
+            (
+                battle.league_id,
+                battle.trainer_id,
+                battle.leader_id,
+                battle.battle_datetime,
+                battle.winner_name == battle.trainer.discord_id
+            )
+            for _, battle in created
+        ])
+
+        # As ligas são travadas por ordem de pk
+        if standings:
+            for score in sorted(locked_scores.values(), key=lambda s: s.league_id):
+                update_standing(score)
+
+    return [battle for _, battle in created]
@@ -0,0 +1,272 @@
+"""
+Módulo contendo o catálogo de operações GraphQL do benchmark e a execução
+das operações, com a medição da latência e da quantidade de queries SQL de
+cada uma.
+"""
+from collections import namedtuple
+from time import perf_counter
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from graphql_relay import to_global_id
+from abp.loaders import Loaders
+from abp.models import League, Trainer, Leader, Score, Battle
+from abp.resolvers import standby_filter
+
+
+# Operação do benchmark: `variables` recebe o conjunto de dados (ver
+# benchmark_data) e retorna as variáveis da operação. Mutações são executadas
+# em uma transação desfeita ao final, para que o banco não seja alterado.
+Operation = namedtuple('Operation', 'name query variables mutation')
+
+
+SCOREBOARD = '''
+    query Scoreboard($league: ID!) {
+        leagueStandings(league: $league, first: 25) {
+            totalCount
+            edges {
+                node {
+                    rank
+                    wins
+                    losses
+                    badgeCount
+                    winRatio
+                    trainer { discordId name lv }
+                }
+            }
+        }
+    }
+'''
+
+TRAINER_PROFILE = '''
+    query TrainerProfile($discordId: String, $trainerId: ID) {
+        trainers(discordId_Icontains: $discordId, first: 1) {
+            edges {
+                node {
+                    discordId
+                    name
+                    lv
+                    exp
+                    nextLv
+                    battleCounter
+                    winPercentage
+                    leagues { totalCount edges { node { reference } } }
+                    scores {
+                        edges {
+                            node {
+                                wins
+                                losses
+                                standby
+                                badges
+                                league { reference }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+        battles(trainer_Id_In: [$trainerId], first: 10, orderBy: DATETIME_DESC) {
+            edges {
+                node {
+                    battleDatetime
+                    winner
+                    leader { discordId pokemonType }
+                }
+            }
+        }
+    }
+'''
+
+LEAGUE_LISTING = '''
+    query LeagueListing {
+        leagues(first: 20) {
+            totalCount
+            edges {
+                node {
+                    reference
+                    startDate
+                    endDate
+                    champion { discordId }
+                    gymLeaders { edges { node { discordId pokemonType } } }
+                    eliteFour { edges { node { discordId pokemonType } } }
+                    competitors(first: 10) {
+                        totalCount
+                        edges { node { discordId lv } }
+                    }
+                }
+            }
+        }
+    }
+'''
+
+BATTLE_REGISTER = '''
+    mutation BattleRegister($input: BattleRegisterInput!) {
+        battleRegister(input: $input) {
+            battle { battleDatetime winner }
+        }
+    }
+'''
+
+
+def battle_register_variables(data):
+    return {
+        'input': {
+            'league': data['league'],
+            'trainer': data['challenger'],
+            'leader': data['leader'],
+            'winner': data['challenger'],
+        }
+    }
+
+
+CATALOGUE = [
+    Operation(
+        'scoreboard',
+        SCOREBOARD,
+        lambda data: {'league': data['league']},
+        False
+    ),
+    Operation(
+        'trainer_profile',
+        TRAINER_PROFILE,
+        lambda data: {'discordId': data['trainer'], 'trainerId': data['trainer_id']},
+        False
+    ),
+    Operation('league_listing', LEAGUE_LISTING, lambda data: {}, False),
+    Operation('battle_register', BATTLE_REGISTER, battle_register_variables, True),
+]
+
+
+def benchmark_data():
+    """
+    Escolhe no banco de dados os objetos usados pelas operações: a liga com
+    mais competidores, o treinador com mais batalhas e um treinador fora do
+    standby, com um líder da liga, para o registro de batalhas.
+    return : <dict>
+    """
+    league = League.objects.annotate(
+        total=Count('competitors')
+    ).order_by('-total', 'pk').first()
+    trainer = Trainer.objects.order_by('-battle_counter', 'pk').first()
+    if league is None or trainer is None:
+        raise Exception(
+            'The database has no leagues or trainers, run seed_bench_data first.'
+        )
+
+    challenger = Score.objects.filter(
+        league=league,
+        trainer__isnull=False
+    ).exclude(standby_filter()).select_related('trainer').order_by('pk').first()
+    leader = (
+        league.gym_leaders.order_by('pk').first() or
+        Leader.objects.order_by('pk').first()
+    )
+
+    return {
+        'league': to_global_id('LeagueType', league.pk),
+        'trainer': trainer.discord_id,
+        'trainer_id': to_global_id('TrainerType', trainer.pk),
+        'challenger': challenger.trainer.discord_id if challenger else None,
+        'leader': leader.discord_id if leader else None,
+    }
+
+
+def dataset_size():
+    """
+    Retorna a quantidade de linhas de cada tabela medida pelo benchmark.
+    """
+    return {
+        model._meta.model_name: model.objects.count()
+        for model in (League, Trainer, Leader, Score, Battle)
+    }
+
+
+def execute(schema, operation, variables):
+    """
+    Executa uma operação como uma requisição do endpoint GraphQL, com seus
+    próprios loaders.
+    return : <ExecutionResult>
+    """
+    request = RequestFactory().post('/graphql/')
+    request.loaders = Loaders()
+    if not operation.mutation:
+        return schema.execute(
+            operation.query,
+            variables=variables,
+            context_value=request
+        )
+
+    with transaction.atomic():
+        result = schema.execute(
+            operation.query,
+            variables=variables,
+            context_value=request
+        )
+        transaction.set_rollback(True)
+
+    return result
+
+
+def measure(schema, operation, variables, iterations, warmup):
+    """
+    Executa a operação `warmup + iterations` vezes e retorna os percentis da
+    latência (em milissegundos) e as quantidades de queries SQL das
+    iterações medidas.
+    return : <dict>
+    """
+    latencies, queries = [], []
+    for iteration in range(warmup + iterations):
+        with CaptureQueriesContext(connection) as captured:
+            start = perf_counter()
+            result = execute(schema, operation, variables)
+            elapsed = perf_counter() - start
+
+        if result.errors:
+            raise Exception(
+                f'{operation.name}: {"; ".join(str(e) for e in result.errors)}'
+            )
+        if iteration >= warmup:
+            latencies.append(elapsed * 1000)
+            # O SAVEPOINT/ROLLBACK das mutações não é contado
+            queries.append(len([
+                query for query in captured.captured_queries
+                if 'SAVEPOINT' not in query['sql']
+            ]))
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'iterations': iterations,
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(np.mean(latencies)), 3),
+        'queries': int(np.median(queries)),
+        'max_queries': max(queries),
+    }
+
+
+def run_benchmark(schema, iterations=50, warmup=5, operations=None):
+    """
+    Executa o catálogo de operações (ou apenas as operações com os nomes
+    fornecidos) e retorna o relatório do benchmark.
+    return : <dict>
+    """
+    data = benchmark_data()
+    catalogue = [
+        operation for operation in CATALOGUE
+        if operations is None or operation.name in operations
+    ]
+
+    report = {'dataset': dataset_size(), 'operations': {}}
+    for operation in catalogue:
+        report['operations'][operation.name] = measure(
+            schema,
+            operation,
+            operation.variables(data),
+            iterations,
+            warmup
+        )
+
+    return report
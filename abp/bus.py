@@ -0,0 +1,348 @@
+"""
+Módulo contendo o barramento de invalidação entre os workers.
+Cada worker do gunicorn mantém caches no próprio processo; uma escrita
+confirmada em um worker publica um evento com as tags dos models alterados
+(o model_name, ex: `league`), e os demais workers aplicam o evento em seus
+caches pelos handlers registrados com `subscribe`.
+Os eventos são publicados pelos signals post_save, post_delete e
+m2m_changed dos models do abp e pelas invalidações explícitas das mutações
+(ver abp.cache), agrupados por transação e enviados apenas após o commit;
+as tags publicadas durante uma requisição GraphQL (ver batch) são enviadas
+em um único evento ao fim da requisição.
+O transporte é definido por ABP_INVALIDATION_BUS:
+    postgres: NOTIFY/LISTEN do PostgreSQL, entregue assim que a transação
+              do NOTIFY é confirmada;
+    table: eventos gravados na tabela InvalidationEvent e consultados pelos
+           workers a cada ABP_INVALIDATION_POLL_INTERVAL segundos;
+    auto: postgres se o banco de dados for PostgreSQL, senão table;
+    vazio: apenas os handlers do próprio processo recebem os eventos.
+Os workers recebem os eventos por uma thread iniciada com `start` (ver
+bill/gunicorn.conf.py). Apenas os processos que iniciaram o subscriber
+publicam os eventos para os demais: os comandos, os testes e os servidores
+de um único processo apenas entregam os eventos aos próprios handlers.
+"""
+import json
+import logging
+import os
+import select
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from uuid import uuid4
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'abp_invalidation'
+
+# Intervalo (em segundos) entre as tentativas de reconexão do subscriber
+RETRY_INTERVAL = 5
+
+# Os eventos mais antigos que a retenção são removidos a cada
+# CLEANUP_EVERY eventos publicados
+RETENTION = timedelta(hours=1)
+CLEANUP_EVERY = 100
+
+# Ids abaixo do último evento lido que são consultados novamente: ids
+# atribuídos antes podem ser confirmados depois do último evento lido
+POLL_OVERLAP = 100
+
+# Identificador do processo, ver origin()
+INSTANCE = uuid4().hex
+
+handlers = []
+local = threading.local()
+
+# Transporte dos eventos publicados pelo processo, definido por start
+publisher = None
+
+
+def origin():
+    """
+    Retorna o identificador do processo atual. O pid é incluído pois os
+    workers criados por fork compartilham o INSTANCE do processo pai.
+    """
+    return f'{INSTANCE}:{os.getpid()}'
+
+
+def subscribe(handler):
+    """
+    Registra um handler dos eventos: handler(tags, local), onde `local`
+    indica se o evento foi publicado pelo próprio processo.
+    Pode ser usado como decorator.
+    """
+    handlers.append(handler)
+    return handler
+
+
+def dispatch(tags, is_local):
+    for handler in handlers:
+        try:
+            handler(tags, is_local)
+        except Exception:
+            logger.exception('Invalidation handler %r failed', handler)
+
+
+def scheduled():
+    """
+    Verifica se o envio dos eventos pendentes está agendado na transação
+    atual. Os callbacks de uma transação desfeita são descartados.
+    """
+    return any(hook[1] is flush for hook in connection.run_on_commit)
+
+
+@contextmanager
+def batch():
+    """
+    Agrupa as tags publicadas no bloco, incluindo as das transações
+    confirmadas no bloco, em um único evento enviado ao fim do bloco.
+    """
+    if getattr(local, 'batch', None) is not None:
+        yield
+        return
+
+    local.batch = set()
+    try:
+        yield
+    finally:
+        tags, local.batch = frozenset(local.batch), None
+        send(tags)
+
+
+def deliver(tags):
+    """
+    Envia as tags, ou as acumula no batch atual.
+    """
+    if getattr(local, 'batch', None) is not None:
+        local.batch.update(tags)
+    else:
+        send(frozenset(tags))
+
+
+def publish(*tags):
+    """
+    Publica a invalidação das tags. Dentro de uma transação, as tags são
+    acumuladas e enviadas em um único evento após o commit.
+    """
+    if not connection.in_atomic_block:
+        deliver(tags)
+        return
+
+    if not scheduled():
+        local.tags = set()
+        transaction.on_commit(flush)
+    local.tags.update(tags)
+
+
+def flush():
+    tags, local.tags = frozenset(local.tags), set()
+    deliver(tags)
+
+
+def send(tags):
+    """
+    Entrega as tags aos handlers do processo e aos demais workers.
+    """
+    if not tags:
+        return
+
+    dispatch(tags, True)
+    if publisher is None:
+        return
+    try:
+        publisher.publish(tags)
+    except Exception:
+        # A escrita já foi confirmada, a falha não é propagada à requisição
+        logger.exception('Could not publish the invalidation of %s', tags)
+
+
+class TableTransport:
+    """
+    Transporte pela tabela InvalidationEvent, para os bancos de dados sem
+    NOTIFY/LISTEN.
+    """
+    def __init__(self):
+        self.last = None
+        self.seen = set()
+
+    def publish(self, tags):
+        from abp.models import InvalidationEvent
+
+        event = InvalidationEvent.objects.create(
+            origin=origin(),
+            tags=','.join(sorted(tags))
+        )
+        if event.pk % CLEANUP_EVERY == 0:
+            InvalidationEvent.objects.filter(
+                created_at__lt=timezone.now() - RETENTION
+            ).delete()
+
+    def poll(self):
+        """
+        Retorna as tags dos eventos dos outros processos publicados desde a
+        consulta anterior. A primeira consulta apenas marca o último evento.
+        return : <list> de <frozenset>
+        """
+        from abp.models import InvalidationEvent
+
+        if self.last is None:
+            self.last = InvalidationEvent.objects.aggregate(
+                last=Max('pk')
+            )['last'] or 0
+            return []
+
+        events = InvalidationEvent.objects.filter(
+            pk__gt=self.last - POLL_OVERLAP
+        ).order_by('pk').values_list('pk', 'origin', 'tags')
+
+        received = []
+        for pk, event_origin, tags in events:
+            if pk in self.seen:
+                continue
+            self.seen.add(pk)
+            self.last = max(self.last, pk)
+            if event_origin != origin():
+                received.append(frozenset(tags.split(',')))
+
+        self.seen = {pk for pk in self.seen if pk > self.last - POLL_OVERLAP}
+        return received
+
+    def listen(self, callback, stop):
+        interval = getattr(settings, 'ABP_INVALIDATION_POLL_INTERVAL', 0.05)
+        try:
+            while not stop.is_set():
+                for tags in self.poll():
+                    callback(tags)
+                stop.wait(interval)
+        finally:
+            connection.close()
+
+
+class PostgresTransport:
+    """
+    Transporte por NOTIFY/LISTEN, com uma conexão dedicada do subscriber.
+    """
+    def publish(self, tags):
+        payload = json.dumps({'origin': origin(), 'tags': sorted(tags)})
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, payload])
+
+    def listen(self, callback, stop):
+        wrapper = connections['default']
+        listener = wrapper.get_new_connection(wrapper.get_connection_params())
+        listener.autocommit = True
+        try:
+            with listener.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+
+            while not stop.is_set():
+                if select.select([listener], [], [], 1) == ([], [], []):
+                    continue
+                listener.poll()
+                while listener.notifies:
+                    event = json.loads(listener.notifies.pop(0).payload)
+                    if event['origin'] != origin():
+                        callback(frozenset(event['tags']))
+        finally:
+            listener.close()
+
+
+TRANSPORTS = {
+    'postgres': PostgresTransport,
+    'table': TableTransport,
+}
+
+
+def get_transport():
+    """
+    Retorna o transporte definido por ABP_INVALIDATION_BUS, ou None.
+    """
+    name = getattr(settings, 'ABP_INVALIDATION_BUS', 'auto')
+    if not name:
+        return None
+    if name == 'auto':
+        name = 'postgres' if connection.vendor == 'postgresql' else 'table'
+    if name not in TRANSPORTS:
+        raise Exception(f'Unknown invalidation bus transport: {name}')
+
+    return TRANSPORTS[name]()
+
+
+class Subscriber(threading.Thread):
+    """
+    Thread que recebe os eventos dos outros workers e os entrega aos
+    handlers do processo, reconectando em caso de falha.
+    """
+    def __init__(self, transport):
+        super().__init__(name='abp-invalidation-bus', daemon=True)
+        self.transport = transport
+        self.stop = threading.Event()
+
+    def receive(self, tags):
+        dispatch(tags, False)
+
+    def run(self):
+        while not self.stop.is_set():
+            try:
+                self.transport.listen(self.receive, self.stop)
+            except Exception:
+                logger.exception('Invalidation bus subscriber failed')
+                self.stop.wait(RETRY_INTERVAL)
+
+
+subscriber = None
+
+
+def start():
+    """
+    Inicia o subscriber do processo e a publicação dos eventos, se houver
+    um transporte configurado.
+    return : <Subscriber> ou None
+    """
+    global subscriber, publisher
+    if subscriber is not None and subscriber.is_alive():
+        return subscriber
+
+    transport = get_transport()
+    if transport is None:
+        return None
+
+    publisher = get_transport()
+    subscriber = Subscriber(transport)
+    subscriber.start()
+    return subscriber
+
+
+def stop():
+    if subscriber is not None:
+        subscriber.stop.set()
+        subscriber.join()
+
+
+def model_saved(sender, **kwargs):
+    publish(sender._meta.model_name)
+
+
+def m2m_changed_handler(sender, instance, action, model, **kwargs):
+    # Os dois lados da relação são alterados (ex: League.competitors e
+    # Trainer.leagues)
+    if action.startswith('post_'):
+        publish(type(instance)._meta.model_name, model._meta.model_name)
+
+
+def connect_signals(app_config):
+    """
+    Conecta os signals dos models do app. Os eventos não geram eventos.
+    """
+    for model in app_config.get_models():
+        if model._meta.model_name == 'invalidationevent':
+            continue
+        post_save.connect(model_saved, sender=model)
+        post_delete.connect(model_saved, sender=model)
+        for field in model._meta.local_many_to_many:
+            m2m_changed.connect(m2m_changed_handler, sender=field.remote_field.through)
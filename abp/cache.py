@@ -0,0 +1,243 @@
+"""
+Módulo contendo o cache de respostas das queries GraphQL.
+As respostas são armazenadas no cache do Django definido por
+ABP_RESPONSE_CACHE, indexadas pelo documento normalizado, pelas variáveis e
+pelo nome da operação. Cada resposta depende das tags dos models consultados
+pelo documento (ex: uma query de `trainers { scores }` depende das tags
+trainer e score), obtidas a partir dos tipos GraphQL selecionados.
+Cada tag possui uma versão armazenada no próprio cache; as mutações
+invalidam as tags dos models que alteram trocando suas versões, e as
+respostas gravadas com versões antigas deixam de ser usadas.
+As invalidações também são publicadas no barramento de invalidação (ver
+abp.bus): um cache que não é compartilhado pelos workers, como o
+LocMemCache, é invalidado em todos os workers.
+Com réplicas de leitura, os clientes que leem do banco principal após uma
+mutação não usam o cache, e as respostas lidas de uma réplica não são
+armazenadas enquanto a replicação pode estar atrasada em relação à última
+invalidação das suas tags (as versões guardam o horário da invalidação).
+"""
+import json
+from hashlib import sha256
+from threading import Timer
+from time import time
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from graphql.language.printer import print_ast
+from graphql.language.visitor import TypeInfoVisitor, Visitor, visit
+from graphql.type.definition import get_named_type
+from graphql.utils.type_info import TypeInfo
+from abp.bus import publish, subscribe
+from abp.routers import replicas, sticky_seconds
+
+
+LEAGUE = 'league'
+TRAINER = 'trainer'
+LEADER = 'leader'
+SCORE = 'score'
+BATTLE = 'battle'
+BADGE = 'badge'
+STANDING = 'standing'
+LEADER_STATS = 'leaderdailystats'
+HEAD_TO_HEAD = 'headtohead'
+ALL_TAGS = frozenset((
+    LEAGUE, TRAINER, LEADER, SCORE, BATTLE, BADGE, STANDING, LEADER_STATS,
+    HEAD_TO_HEAD
+))
+
+# Tags dos tipos GraphQL: as respostas que selecionam um tipo dependem das
+# tags dele. O `node` pode retornar qualquer tipo.
+TYPE_TAGS = {
+    'LeagueType': {LEAGUE},
+    'LeagueConnection': {LEAGUE},
+    'TrainerType': {TRAINER},
+    'TrainerConnection': {TRAINER},
+    'LeaderType': {LEADER},
+    'LeaderConnection': {LEADER},
+    'ScoreType': {SCORE},
+    'ScoreConnection': {SCORE},
+    'BattleType': {BATTLE},
+    'BattleConnection': {BATTLE},
+    'StandingType': {STANDING},
+    'StandingConnection': {STANDING},
+    'PlayerSearchResult': {TRAINER, LEADER},
+    'PlayerType': {TRAINER, LEADER},
+    # As estatísticas agrupam pelo tipo e papel atuais dos líderes
+    'LeaderStatsType': {LEADER_STATS, LEADER, LEAGUE},
+    'TypeMatchupStatsType': {LEADER_STATS, LEADER, LEAGUE},
+    # Os retrospectos são removidos com o treinador, o líder ou a liga
+    'HeadToHeadType': {HEAD_TO_HEAD, TRAINER, LEADER, LEAGUE},
+    'HeadToHeadConnection': {HEAD_TO_HEAD, TRAINER, LEADER, LEAGUE},
+    'Node': ALL_TAGS,
+}
+
+# Tags dos campos escalares que consultam outros models
+FIELD_TAGS = {
+    ('Query', 'badges'): {BADGE},
+    ('ScoreType', 'badges'): {BADGE},
+}
+
+TAG_KEY = 'abp:tag:{}'
+RESPONSE_KEY = 'abp:response:{}'
+
+
+class TagCollector(Visitor):
+    """
+    Coleta as tags dos campos selecionados em um documento.
+    """
+    def __init__(self, type_info):
+        self.type_info = type_info
+        self.tags = set()
+
+    def enter_Field(self, node, *args):
+        field_type = self.type_info.get_type()
+        if field_type is not None:
+            self.tags |= TYPE_TAGS.get(get_named_type(field_type).name, set())
+
+        parent_type = self.type_info.get_parent_type()
+        if parent_type is not None:
+            self.tags |= FIELD_TAGS.get((parent_type.name, node.name.value), set())
+
+
+def document_tags(schema, document_ast):
+    """
+    Retorna as tags das quais as respostas de um documento dependem.
+    return : <frozenset>
+    """
+    type_info = TypeInfo(schema)
+    collector = TagCollector(type_info)
+    visit(document_ast, TypeInfoVisitor(type_info, collector))
+    return frozenset(collector.tags)
+
+
+def get_cache():
+    """
+    Retorna o cache das respostas, ou None se o cache estiver desativado.
+    """
+    alias = getattr(settings, 'ABP_RESPONSE_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def new_version(moment=None):
+    """
+    Nova versão de uma tag, prefixada pelo horário da invalidação.
+    """
+    return f'{time() if moment is None else moment}:{uuid4().hex}'
+
+
+def version_time(version):
+    try:
+        return float(version.split(':', 1)[0])
+    except ValueError:
+        return 0
+
+
+class CacheEntry:
+    """
+    Resposta em cache de uma query, com as versões das tags lidas antes da
+    execução da query.
+    """
+    def __init__(self, cache, key, versions, data):
+        self.cache = cache
+        self.key = key
+        self.versions = versions
+        self.data = data
+
+    def invalidated_within(self, seconds):
+        """
+        Verifica se alguma das tags da resposta foi invalidada nos últimos
+        segundos fornecidos.
+        """
+        moment = time() - seconds
+        return any(version_time(v) > moment for v in self.versions.values())
+
+    def store(self, data):
+        self.cache.set(
+            self.key,
+            {'versions': self.versions, 'data': data},
+            getattr(settings, 'ABP_RESPONSE_CACHE_TIMEOUT', 300)
+        )
+
+
+def lookup(document, variables, operation_name):
+    """
+    Busca a resposta de uma query no cache. A resposta e as versões das tags
+    do documento são lidas com uma única consulta ao cache.
+    param : document : <CachedDocument> (ver abp.documents)
+    return : <CacheEntry> ou None, se a operação não puder ser armazenada
+    """
+    cache = get_cache()
+    if cache is None or document.errors or document.introspection:
+        return None
+    if document.get_operation_type(operation_name) != 'query':
+        return None
+
+    # As tags e o documento normalizado são calculados uma vez por documento
+    if document.tags is None:
+        document.tags = document_tags(document.schema, document.document_ast)
+        document.normalized = print_ast(document.document_ast)
+
+    payload = json.dumps(
+        [document.normalized, variables or {}, operation_name],
+        sort_keys=True,
+        default=str
+    )
+    key = RESPONSE_KEY.format(sha256(payload.encode('utf-8')).hexdigest())
+    tag_keys = {tag: TAG_KEY.format(tag) for tag in document.tags}
+    values = cache.get_many([key, *tag_keys.values()])
+
+    # Tags sem versão (novas ou removidas do cache) recebem uma nova versão,
+    # sem horário de invalidação
+    missing = {
+        tag_key: new_version(0) for tag_key in tag_keys.values()
+        if tag_key not in values
+    }
+    if missing:
+        cache.set_many(missing, None)
+        values.update(missing)
+
+    versions = {tag: values[tag_key] for tag, tag_key in tag_keys.items()}
+    entry = values.get(key)
+    data = None
+    if entry is not None and entry['versions'] == versions:
+        data = entry['data']
+
+    return CacheEntry(cache, key, versions, data)
+
+
+def bump(cache, tags):
+    cache.set_many({TAG_KEY.format(tag): new_version() for tag in tags}, None)
+
+
+def invalidate(*tags):
+    """
+    Invalida as respostas que dependem das tags fornecidas.
+    As versões são trocadas imediatamente e novamente após o commit da
+    transação atual, quando a invalidação é publicada no barramento: uma
+    resposta calculada por outra requisição antes do commit, com os dados
+    antigos, não é usada.
+    """
+    cache = get_cache()
+    if cache is not None:
+        bump(cache, tags)
+    publish(*tags)
+
+
+@subscribe
+def apply_invalidation(tags, local):
+    """
+    Troca as versões das tags invalidadas. As invalidações dos outros
+    workers só precisam ser aplicadas em caches do próprio processo.
+    """
+    cache = get_cache()
+    if cache is None or not (local or isinstance(cache, LocMemCache)):
+        return
+
+    bump(cache, tags & ALL_TAGS)
+    if local and replicas():
+        # Respostas lidas de uma réplica ainda sem o commit são descartadas
+        # após o atraso tolerado da replicação
+        timer = Timer(sticky_seconds(), bump, (cache, tags & ALL_TAGS))
+        timer.daemon = True
+        timer.start()
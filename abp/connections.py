@@ -0,0 +1,202 @@
+"""
+Módulo contendo os campos de conexão relay que paginam querysets no banco
+de dados.
+"""
+import json
+from datetime import datetime
+from functools import partial
+import graphene
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from graphene.utils.thenables import maybe_thenable
+from graphql_relay.connection.arrayconnection import connection_from_list_slice
+from graphql_relay.utils import base64, unbase64
+
+
+# Prefixo dos cursores das conexões paginadas por keyset
+KEYSET_PREFIX = 'keyset:'
+
+# Argumentos de paginação relay
+PAGINATION_ARGS = ('first', 'last', 'after', 'before')
+
+
+def is_paginated(kwargs):
+    """
+    Verifica se algum argumento de paginação foi fornecido ao resolver.
+    """
+    return any(kwargs.get(arg) is not None for arg in PAGINATION_ARGS)
+
+
+class CountableConnection(graphene.relay.Connection):
+    """
+    Conexão relay com o total de itens, independente da página.
+    Para querysets o total é obtido com um COUNT(*), apenas quando pedido.
+    """
+    total_count = graphene.Int(description='Total number of items.')
+
+    class Meta:
+        abstract = True
+
+    def resolve_total_count(self, info, **kwargs):
+        length = getattr(self, 'length', None)
+        if length is not None:
+            return length
+        if isinstance(self.iterable, QuerySet):
+            return self.iterable.count()
+        return len(self.iterable)
+
+
+class QuerySetConnectionField(graphene.relay.ConnectionField):
+    """
+    Connection field que aplica a paginação (first/last/after/before)
+    diretamente no banco de dados quando o resolver retorna um queryset: o
+    total é obtido com um COUNT(*) e apenas a página pedida é carregada,
+    com LIMIT/OFFSET. Outros iteráveis são paginados normalmente.
+    """
+    @classmethod
+    def resolve_connection(cls, connection_type, args, resolved):
+        if not isinstance(resolved, QuerySet):
+            return super().resolve_connection(connection_type, args, resolved)
+
+        total = resolved.count()
+        connection = connection_from_list_slice(
+            resolved,
+            args,
+            connection_type=connection_type,
+            edge_type=connection_type.Edge,
+            pageinfo_type=graphene.relay.PageInfo,
+            slice_start=0,
+            list_length=total,
+            list_slice_length=total,
+        )
+        connection.iterable = resolved
+        connection.length = total
+        return connection
+
+
+class KeysetConnectionField(graphene.relay.ConnectionField):
+    """
+    Connection field paginado por keyset: os cursores guardam os valores das
+    colunas de ordenação da última linha, e as páginas seguintes são obtidas
+    com um filtro `(coluna, id) > (valor, id)`. O custo de qualquer página é
+    o mesmo da primeira e inserções concorrentes não duplicam nem pulam
+    linhas entre as páginas.
+    O resolver deve retornar um queryset; a ordenação é definida pelo
+    argumento `order_by`, cujo valor é um campo do model (prefixado com `-`
+    para ordem decrescente). O ID é sempre usado como desempate.
+    """
+    def __init__(self, type, order_by, *args, **kwargs):
+        kwargs.setdefault('order_by', order_by)
+        super().__init__(type, *args, **kwargs)
+
+    def connection_resolver(self, resolver, connection_type, root, info, **args):
+        resolved = resolver(root, info, **args)
+        if isinstance(connection_type, graphene.NonNull):
+            connection_type = connection_type.of_type
+
+        on_resolve = partial(self.resolve_keyset, connection_type, args)
+        return maybe_thenable(resolved, on_resolve)
+
+    @staticmethod
+    def ordering_keys(order_by):
+        """
+        Retorna as colunas de ordenação e se a ordem é decrescente.
+        """
+        field = order_by.lstrip('-')
+        keys = (field,) if field == 'id' else (field, 'id')
+        return keys, order_by.startswith('-')
+
+    @staticmethod
+    def encode_cursor(obj, keys):
+        values = [getattr(obj, key) for key in keys]
+        values = [
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in values
+        ]
+        return base64(KEYSET_PREFIX + json.dumps(values))
+
+    @staticmethod
+    def decode_cursor(cursor, model, keys):
+        try:
+            decoded = unbase64(cursor)
+            # Cursores de outras conexões (ex: arrayconnection:) são rejeitados
+            if not decoded.startswith(KEYSET_PREFIX):
+                raise ValueError(cursor)
+            values = json.loads(decoded[len(KEYSET_PREFIX):])
+            return [
+                model._meta.get_field(key).to_python(value)
+                for key, value in zip(keys, values)
+            ]
+        except Exception:
+            raise Exception('Invalid cursor.')
+
+    @staticmethod
+    def keyset_filter(keys, values, descending):
+        """
+        Filtro das linhas posteriores aos valores fornecidos, na ordem dada.
+        """
+        lookup = 'lt' if descending else 'gt'
+        condition = Q()
+        for index, key in enumerate(keys):
+            equals = dict(zip(keys[:index], values[:index]))
+            condition |= Q(**equals, **{f'{key}__{lookup}': values[index]})
+
+        return condition
+
+    def resolve_keyset(self, connection_type, args, queryset):
+        keys, descending = self.ordering_keys(args['order_by'])
+        model = queryset.model
+        unfiltered = queryset
+        after, before = args.get('after'), args.get('before')
+        first, last = args.get('first'), args.get('last')
+        for size in (first, last):
+            if size is not None and size < 0:
+                raise Exception('The page size must be a positive number.')
+
+        if after:
+            values = self.decode_cursor(after, model, keys)
+            queryset = queryset.filter(self.keyset_filter(keys, values, descending))
+        if before:
+            values = self.decode_cursor(before, model, keys)
+            queryset = queryset.filter(
+                self.keyset_filter(keys, values, not descending)
+            )
+
+        # Com apenas `last`, a página é lida de trás para frente
+        backwards = last is not None and first is None
+        reverse = descending != backwards
+        queryset = queryset.order_by(
+            *[f'-{key}' if reverse else key for key in keys]
+        )
+
+        limit = last if backwards else first
+        if limit is None:
+            rows = list(queryset)
+        else:
+            rows = list(queryset[:limit + 1])
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+
+        has_previous_page = has_more if backwards else bool(after)
+        has_next_page = bool(before) if backwards else has_more
+        if first is not None and last is not None and len(rows) > last:
+            rows = rows[len(rows) - last:]
+            has_previous_page = True
+
+        edges = [
+            connection_type.Edge(node=row, cursor=self.encode_cursor(row, keys))
+            for row in rows
+        ]
+        connection = connection_type(
+            edges=edges,
+            page_info=graphene.relay.PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_previous_page,
+                has_next_page=has_next_page,
+            )
+        )
+        connection.iterable = unfiltered
+        return connection
@@ -0,0 +1,229 @@
+"""
+Módulo contendo o cache de documentos GraphQL e as persisted queries.
+Os documentos são mantidos em um cache LRU indexado pelo sha256 da query:
+cada query é analisada e validada contra o schema apenas na primeira vez em
+que é recebida pelo processo. O resultado das queries de introspecção
+(usadas pelo GraphiQL) também é mantido no documento.
+Os clientes podem enviar apenas o sha256 de uma query já conhecida, no
+protocolo de automatic persisted queries:
+    {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": "..."}}}
+O modo é definido por ABP_PERSISTED_QUERIES:
+    automatic: queries completas são aceitas e passam a poder ser enviadas
+               apenas pelo hash;
+    whitelist: apenas as queries registradas (ver PersistedQuery e o
+               comando register_queries) são aceitas;
+    off: apenas queries completas são aceitas.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from graphql.backend.base import GraphQLBackend, GraphQLDocument
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+from graphql.language.parser import parse
+from graphql.validation import validate
+from abp.bus import subscribe
+from abp.models import PersistedQuery
+
+
+AUTOMATIC = 'automatic'
+WHITELIST = 'whitelist'
+OFF = 'off'
+
+
+class PersistedQueryError(Exception):
+    """
+    Erro de uma requisição com persisted query.
+    """
+    def __init__(self, message, status=200):
+        super().__init__(message)
+        self.status = status
+
+
+def query_hash(query):
+    """
+    Retorna o sha256 (hexadecimal) de uma query.
+    """
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def is_introspection(document_ast):
+    """
+    Verifica se o documento contém apenas queries de introspecção.
+    """
+    operations = [
+        definition for definition in document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition)
+    ]
+    return bool(operations) and all(
+        operation.operation == 'query' and all(
+            isinstance(selection, ast.Field) and
+            selection.name.value.startswith('__')
+            for selection in operation.selection_set.selections
+        )
+        for operation in operations
+    )
+
+
+class CachedDocument(GraphQLDocument):
+    """
+    Documento já validado: as execuções seguintes não validam o documento
+    novamente. Os erros de validação também são mantidos.
+    """
+    def __init__(self, schema, document_string, document_ast, errors):
+        super().__init__(schema, document_string, document_ast, self.execute)
+        self.errors = errors
+        self.introspection = not errors and is_introspection(document_ast)
+        # Resultados da introspecção, por nome da operação
+        self.introspection_results = {}
+        # Calculados pelo cache de respostas (ver abp.cache)
+        self.tags = None
+        self.normalized = None
+
+    def execute(self, *args, **kwargs):
+        if self.errors:
+            return ExecutionResult(errors=self.errors, invalid=True)
+
+        # O resultado da introspecção depende apenas do schema
+        cacheable = self.introspection and not kwargs.get('variables')
+        operation_name = kwargs.get('operation_name')
+        if cacheable and operation_name in self.introspection_results:
+            return self.introspection_results[operation_name]
+
+        result = execute(self.schema, self.document_ast, *args, **kwargs)
+        if cacheable and not result.errors:
+            self.introspection_results[operation_name] = result
+        return result
+
+
+class CachedDocumentBackend(GraphQLBackend):
+    """
+    Backend GraphQL que mantém os documentos analisados e validados em um
+    cache LRU de até ABP_DOCUMENT_CACHE_SIZE documentos, indexado pelo
+    sha256 da query.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, schema, sha256):
+        # Deve ser chamado com o lock adquirido
+        document = self.documents.get(sha256)
+        if document is None or document.schema is not schema:
+            return None
+        self.documents.move_to_end(sha256)
+        return document
+
+    def get(self, schema, sha256):
+        """
+        Retorna o documento em cache da query com o hash fornecido, ou None.
+        """
+        with self.lock:
+            return self.cached(schema, sha256)
+
+    def document_from_string(self, schema, document_string):
+        sha256 = query_hash(document_string)
+        with self.lock:
+            document = self.cached(schema, sha256)
+            if document is not None:
+                self.hits += 1
+                return document
+            self.misses += 1
+
+        document_ast = parse(document_string)
+        document = CachedDocument(
+            schema,
+            document_string,
+            document_ast,
+            validate(schema, document_ast)
+        )
+
+        size = getattr(settings, 'ABP_DOCUMENT_CACHE_SIZE', 500)
+        with self.lock:
+            self.documents[sha256] = document
+            while len(self.documents) > size:
+                self.documents.popitem(last=False)
+
+        return document
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+            self.hits = self.misses = 0
+
+
+# Backend compartilhado pelas requisições do processo
+document_backend = CachedDocumentBackend()
+
+# Queries registradas já consultadas pelo processo: sha256 -> query
+registered_queries = {}
+
+
+def registered_query(sha256):
+    """
+    Retorna a query registrada com o hash fornecido, ou None.
+    """
+    query = registered_queries.get(sha256)
+    if query is None:
+        persisted = PersistedQuery.objects.filter(sha256=sha256).first()
+        if persisted is None:
+            return None
+        query = registered_queries[sha256] = persisted.query
+
+    return query
+
+
+@subscribe
+def forget_registered_queries(tags, local):
+    """
+    Descarta as queries registradas consultadas quando a whitelist é
+    alterada, inclusive por outro worker.
+    """
+    if PersistedQuery._meta.model_name in tags:
+        registered_queries.clear()
+
+
+def register_query(query, name=''):
+    """
+    Registra uma query na whitelist de persisted queries.
+    return : <PersistedQuery>
+    """
+    persisted, _ = PersistedQuery.objects.update_or_create(
+        sha256=query_hash(query),
+        defaults={'query': query, 'name': name}
+    )
+    registered_queries[persisted.sha256] = query
+    return persisted
+
+
+def resolve_persisted_query(schema, query, extensions):
+    """
+    Retorna a query a ser executada, a partir da query e das extensões
+    enviadas pelo cliente, conforme o modo de persisted queries.
+    param : query : <str> ou None
+    param : extensions : <dict> ou None
+    return : <str>
+    """
+    mode = getattr(settings, 'ABP_PERSISTED_QUERIES', AUTOMATIC)
+    persisted = (extensions or {}).get('persistedQuery')
+    if persisted and mode == OFF:
+        raise PersistedQueryError('PersistedQueryNotSupported')
+
+    sha256 = persisted.get('sha256Hash') if persisted else None
+    if sha256 and not query:
+        document = None
+        if mode == AUTOMATIC:
+            document = document_backend.get(schema, sha256)
+        query = document.document_string if document else registered_query(sha256)
+        if query is None:
+            raise PersistedQueryError('PersistedQueryNotFound')
+    elif sha256 and query_hash(query) != sha256:
+        raise PersistedQueryError('provided sha does not match query', 400)
+
+    if mode == WHITELIST and query and registered_query(query_hash(query)) is None:
+        raise PersistedQueryError('This query is not registered.', 400)
+
+    return query
@@ -0,0 +1,205 @@
+"""
+Módulo contendo a exportação em streaming das tabelas para ferramentas de
+análise, em NDJSON (um objeto JSON por linha) ou CSV, opcionalmente
+compactada com gzip.
+As linhas são lidas em lotes de CHUNK_SIZE linhas ordenadas pelo ID, cada
+lote filtrado pelo último ID do lote anterior (paginação por keyset), e
+convertidas em blocos de bytes conforme são lidas: a memória usada não
+depende do tamanho da tabela em nenhum banco de dados (o MySQL, por
+exemplo, não usa cursores do lado do servidor com QuerySet.iterator).
+As exportações podem ser filtradas pela liga e por um intervalo de datas
+(`since` inclusivo e `until` exclusivo) e são lidas das réplicas quando
+houver réplicas configuradas (ver abp.routers).
+Disponíveis pelo endpoint /exports/<nome>/ (ver abp.views.export) e pelos
+comandos export_battles, export_scores, export_trainers e export_leaders.
+"""
+import csv
+import json
+import zlib
+from datetime import date, datetime, time
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from abp.models import Battle, League, Leader, Score, Trainer
+from abp.routers import choose_replica, reading_from
+from abp.utils import validate_global_id
+
+
+# Linhas lidas do banco de dados por consulta
+CHUNK_SIZE = 2000
+
+# Tamanho aproximado (em bytes) dos blocos enviados
+BLOCK_SIZE = 64 * 1024
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def league_participants(league_id):
+    return (
+        Q(league_gym_leaders=league_id) |
+        Q(league_elite_four=league_id) |
+        Q(league_champion=league_id)
+    )
+
+
+# Models exportados: model, campo de data do filtro por intervalo e filtro
+# pela liga
+EXPORTS = {
+    'battles': (Battle, 'battle_datetime', lambda league: Q(league=league)),
+    'scores': (Score, 'last_battle_at', lambda league: Q(league=league)),
+    'trainers': (
+        Trainer,
+        'join_date',
+        lambda league: Q(league_competitors=league)
+    ),
+    'leaders': (Leader, 'join_date', league_participants),
+}
+
+
+def parse_bound(value):
+    """
+    Converte um limite do intervalo de datas (data ou data e hora ISO 8601)
+    em um datetime. Datas são consideradas a partir da meia-noite.
+    return : <datetime>
+    """
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = day and datetime.combine(day, time())
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise Exception(f'Invalid date: {value}')
+
+    if settings.USE_TZ and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def serialize(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+class Echo:
+    """
+    Arquivo que retorna o texto escrito, para o csv.writer.
+    """
+    def write(self, value):
+        return value
+
+
+class Export:
+    """
+    Exportação de uma tabela. Iterar a exportação produz os blocos de bytes
+    do arquivo; `rows` conta as linhas exportadas.
+    param : name : <str> battles, scores, trainers ou leaders
+    param : league : <str> ID global da liga
+    param : since, until : <str> datas ISO 8601
+    param : format : <str> ndjson ou csv
+    param : compress : <bool> compacta o arquivo com gzip
+    """
+    def __init__(self, name, league=None, since=None, until=None,
+                 format='ndjson', compress=False, chunk_size=CHUNK_SIZE):
+        if name not in EXPORTS:
+            raise Exception(f'Unknown export: {name}')
+        if format not in FORMATS:
+            raise Exception(f'Unknown export format: {format}')
+
+        self.name = name
+        self.model, date_field, league_filter = EXPORTS[name]
+        self.format = format
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.rows = 0
+
+        self.filters = Q()
+        if league:
+            league_id = validate_global_id(league, 'LeagueType')
+            if not League.objects.filter(pk=league_id).exists():
+                raise Exception('League not found!')
+            self.filters &= league_filter(league_id)
+        if since:
+            self.filters &= Q(**{f'{date_field}__gte': parse_bound(since)})
+        if until:
+            self.filters &= Q(**{f'{date_field}__lt': parse_bound(until)})
+
+        # As ForeignKeys são exportadas pelo ID (ex: trainer_id)
+        self.columns = [field.attname for field in self.model._meta.concrete_fields]
+
+    @property
+    def filename(self):
+        return f'{self.name}.{self.format}{".gz" if self.compress else ""}'
+
+    @property
+    def content_type(self):
+        return 'application/gzip' if self.compress else FORMATS[self.format]
+
+    def queryset(self):
+        queryset = self.model.objects.filter(self.filters)
+        if self.name == 'leaders':
+            # Um líder pode participar da liga com mais de um papel
+            queryset = queryset.distinct()
+        return queryset.order_by('pk').values_list(*self.columns)
+
+    def records(self):
+        alias = choose_replica()
+        pk_index = self.columns.index(self.model._meta.pk.attname)
+        queryset = self.queryset()
+        last = None
+        while True:
+            chunk = queryset if last is None else queryset.filter(pk__gt=last)
+            with reading_from(alias):
+                rows = list(chunk[:self.chunk_size])
+            for row in rows:
+                self.rows += 1
+                yield row
+            if len(rows) < self.chunk_size:
+                return
+            last = rows[-1][pk_index]
+
+    def lines(self):
+        if self.format == 'csv':
+            writer = csv.writer(Echo())
+            yield writer.writerow(self.columns)
+            for row in self.records():
+                yield writer.writerow([serialize(value) for value in row])
+        else:
+            for row in self.records():
+                yield json.dumps(
+                    dict(zip(self.columns, map(serialize, row)))
+                ) + '\n'
+
+    def blocks(self):
+        """
+        Agrupa as linhas em blocos de aproximadamente BLOCK_SIZE bytes.
+        """
+        block, size = [], 0
+        for line in self.lines():
+            data = line.encode('utf-8')
+            block.append(data)
+            size += len(data)
+            if size >= BLOCK_SIZE:
+                yield b''.join(block)
+                block, size = [], 0
+        if block:
+            yield b''.join(block)
+
+    def __iter__(self):
+        if not self.compress:
+            yield from self.blocks()
+            return
+
+        # wbits 31: formato gzip
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for block in self.blocks():
+            data = compressor.compress(block)
+            if data:
+                yield data
+        yield compressor.flush()
@@ -0,0 +1,195 @@
+"""
+Módulo contendo a instrumentação SQL das operações GraphQL.
+Cada requisição ao endpoint GraphQL registra a quantidade de statements SQL,
+o tempo total gasto no banco de dados e os statements repetidos (padrão
+N+1), sem depender do DEBUG nem de `connection.queries`. As métricas podem
+ser retornadas no campo `extensions` da resposta e são agregadas por nome de
+operação em uma janela das últimas requisições.
+Os nomes das operações são enviados pelos clientes: apenas os primeiros
+MAX_OPERATION_NAMES nomes distintos são registrados, e as demais operações
+são agregadas em `other` (ver OperationNames).
+"""
+import re
+import threading
+from collections import Counter, defaultdict, deque
+from time import perf_counter
+import numpy as np
+from django.conf import settings
+
+
+# Tamanho máximo do SQL dos statements repetidos exibidos nas métricas
+SQL_PREVIEW_LENGTH = 200
+
+# Nome da primeira operação nomeada de um documento GraphQL
+OPERATION_NAME = re.compile(r'^\s*(?:query|mutation|subscription)\s+(\w+)')
+
+# Nomes de operação válidos (os nomes do GraphQL, com até 100 caracteres)
+VALID_NAME = re.compile(r'^[_A-Za-z][_0-9A-Za-z]{0,99}$')
+
+ANONYMOUS_OPERATION = 'anonymous'
+OTHER_OPERATION = 'other'
+
+# Quantidade máxima de nomes de operação distintos registrados
+MAX_OPERATION_NAMES = 200
+
+
+class QueryRecorder:
+    """
+    Wrapper de execução de queries (ver connection.execute_wrapper) que
+    contabiliza os statements executados.
+    Os statements são agrupados pelo SQL com os placeholders, portanto a
+    mesma consulta com parâmetros diferentes é considerada repetida.
+    """
+    def __init__(self):
+        self.statements = 0
+        self.duration = 0
+        self.sql = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - start
+            self.statements += 1
+            self.sql[sql] += 1
+
+    @property
+    def duplicates(self):
+        return self.statements - len(self.sql)
+
+    def metrics(self):
+        """
+        Retorna as métricas SQL registradas.
+        return : <dict>
+        """
+        return {
+            'statements': self.statements,
+            'duration_ms': round(self.duration * 1000, 3),
+            'duplicates': self.duplicates,
+            'duplicated': [
+                {'sql': sql[:SQL_PREVIEW_LENGTH], 'count': count}
+                for sql, count in self.sql.most_common()
+                if count > 1
+            ],
+        }
+
+
+class OperationNames:
+    """
+    Conjunto limitado dos nomes de operação: os nomes inválidos e os nomes
+    novos após os primeiros `limit` nomes distintos são convertidos em
+    `other`, de modo que os clientes não possam criar agregados sem limite.
+    """
+    def __init__(self, limit=MAX_OPERATION_NAMES):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.names = set()
+
+    def normalize(self, name):
+        if name in (ANONYMOUS_OPERATION, OTHER_OPERATION):
+            return name
+        if not VALID_NAME.match(name or ''):
+            return OTHER_OPERATION
+
+        with self.lock:
+            if name not in self.names:
+                if len(self.names) >= self.limit:
+                    return OTHER_OPERATION
+                self.names.add(name)
+        return name
+
+    def clear(self):
+        with self.lock:
+            self.names.clear()
+
+
+class OperationStats:
+    """
+    Agregados das métricas SQL por nome de operação, calculados sobre as
+    últimas `window` requisições de cada operação.
+    """
+    def __init__(self, window=None, max_operations=MAX_OPERATION_NAMES):
+        self.window = window
+        self.names = OperationNames(max_operations)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.samples = defaultdict(self.new_window)
+
+    def new_window(self):
+        window = self.window or getattr(settings, 'ABP_SQL_METRICS_WINDOW', 1000)
+        return deque(maxlen=window)
+
+    def add(self, operation_name, recorder, duration):
+        """
+        Registra as métricas de uma requisição.
+        param : operation_name : <str>
+        param : recorder : <QueryRecorder>
+        param : duration : <float> duração total da requisição, em segundos
+        """
+        sample = (recorder.statements, recorder.duration, recorder.duplicates, duration)
+        operation_name = self.names.normalize(operation_name)
+        with self.lock:
+            self.requests[operation_name] += 1
+            self.samples[operation_name].append(sample)
+
+    def snapshot(self):
+        """
+        Retorna os agregados de cada operação.
+        return : <dict>
+        """
+        with self.lock:
+            samples = {name: list(window) for name, window in self.samples.items()}
+            requests = dict(self.requests)
+
+        stats = {}
+        for name, window in samples.items():
+            statements, db_time, duplicates, duration = np.array(window).T
+            stats[name] = {
+                'requests': requests[name],
+                'window': len(window),
+                'statements_mean': round(float(statements.mean()), 3),
+                'statements_max': int(statements.max()),
+                'duplicates_mean': round(float(duplicates.mean()), 3),
+                'db_ms_mean': round(float(db_time.mean()) * 1000, 3),
+                'db_ms_p95': round(float(np.percentile(db_time, 95)) * 1000, 3),
+                'duration_ms_p50': round(float(np.percentile(duration, 50)) * 1000, 3),
+                'duration_ms_p95': round(float(np.percentile(duration, 95)) * 1000, 3),
+            }
+
+        return stats
+
+    def reset(self):
+        self.names.clear()
+        with self.lock:
+            self.requests.clear()
+            self.samples.clear()
+
+
+# Agregados do processo
+operation_stats = OperationStats()
+
+
+def get_operation_name(query, name=None):
+    """
+    Retorna o nome da operação: o operationName da requisição, o nome da
+    primeira operação do documento ou `anonymous`.
+    """
+    if name:
+        return name
+
+    match = OPERATION_NAME.match(query or '')
+    return match.group(1) if match else ANONYMOUS_OPERATION
+
+
+def metrics_requested(request):
+    """
+    Verifica se as métricas SQL devem ser retornadas na resposta: sempre,
+    se ABP_SQL_METRICS estiver ativo, ou quando a requisição envia o
+    cabeçalho `X-SQL-Metrics`.
+    """
+    if getattr(settings, 'ABP_SQL_METRICS', False):
+        return True
+
+    header = request.META.get('HTTP_X_SQL_METRICS', '')
+    return header.lower() in ('1', 'true', 'yes')
@@ -0,0 +1,115 @@
+"""
+Módulo contendo os DataLoaders utilizados pelos resolvers GraphQL.
+Os loaders agrupam as consultas de relacionamentos feitas durante uma mesma
+requisição em uma única query `IN (...)` por relacionamento.
+"""
+from collections import defaultdict
+from promise import Promise
+from promise.dataloader import DataLoader
+from abp.models import League, Trainer, Leader, Score, Battle
+
+
+class ModelLoader(DataLoader):
+    """
+    Carrega instâncias de um model a partir de suas chaves primárias.
+    """
+    def __init__(self, model, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+
+    def batch_load_fn(self, keys):
+        objects = self.model.objects.in_bulk(keys)
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+class ManyToManyLoader(DataLoader):
+    """
+    Carrega os objetos relacionados de um campo ManyToMany a partir das
+    chaves primárias das instâncias de origem, ordenados por pk.
+    param : field : <ManyToManyField> ex: League.gym_leaders.field
+    param : reverse : <bool> carrega o relacionamento no sentido inverso
+                      ex: as ligas de cada treinador em League.competitors
+    """
+    def __init__(self, field, reverse=False, **kwargs):
+        super().__init__(**kwargs)
+        self.through = field.remote_field.through
+        self.source = field.m2m_field_name()
+        self.target = field.m2m_reverse_field_name()
+        if reverse:
+            self.source, self.target = self.target, self.source
+
+    def batch_load_fn(self, keys):
+        rows = self.through.objects.filter(
+            **{f'{self.source}_id__in': keys}
+        ).select_related(self.target).order_by(f'{self.target}_id')
+
+        related = defaultdict(list)
+        for row in rows:
+            related[getattr(row, f'{self.source}_id')].append(
+                getattr(row, self.target)
+            )
+
+        return Promise.resolve([related[key] for key in keys])
+
+
+class ForeignKeyLoader(DataLoader):
+    """
+    Carrega as instâncias de um model que apontam, por uma ForeignKey, para as
+    chaves primárias fornecidas, ordenadas por pk.
+    param : model : <Model> ex: Score
+    param : field_name : <str> nome da ForeignKey ex: 'trainer'
+    """
+    def __init__(self, model, field_name, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+        self.field_name = field_name
+
+    def batch_load_fn(self, keys):
+        rows = self.model.objects.filter(
+            **{f'{self.field_name}_id__in': keys}
+        ).order_by('pk')
+
+        related = defaultdict(list)
+        for row in rows:
+            related[getattr(row, f'{self.field_name}_id')].append(row)
+
+        return Promise.resolve([related[key] for key in keys])
+
+
+class Loaders:
+    """
+    Conjunto de loaders de uma requisição.
+    Uma nova instância deve ser criada a cada requisição para que o cache dos
+    loaders não seja compartilhado entre requisições.
+    """
+    def __init__(self):
+        self.league = ModelLoader(League)
+        self.trainer = ModelLoader(Trainer)
+        self.leader = ModelLoader(Leader)
+        self.league_gym_leaders = ManyToManyLoader(League.gym_leaders.field)
+        self.league_elite_four = ManyToManyLoader(League.elite_four.field)
+        self.league_competitors = ManyToManyLoader(League.competitors.field)
+        self.trainer_leagues = ManyToManyLoader(
+            League.competitors.field,
+            reverse=True
+        )
+        self.trainer_scores = ForeignKeyLoader(Score, 'trainer')
+        self.score_battles = ForeignKeyLoader(Battle, 'score')
+        self.score_badges = ManyToManyLoader(Score.badges.field)
+
+
+def get_loaders(info):
+    """
+    Retorna os loaders anexados ao contexto da requisição.
+    Caso o contexto ainda não possua loaders (ex: schema executado
+    diretamente), um novo conjunto é criado e anexado a ele.
+    """
+    loaders = getattr(info.context, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        try:
+            info.context.loaders = loaders
+        except AttributeError:
+            pass
+
+    return loaders
@@ -0,0 +1,74 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from abp.exports import CHUNK_SIZE, FORMATS, Export
+
+
+class ExportCommand(BaseCommand):
+    """
+    Base of the export_* commands: streams the `export` table (see
+    abp.exports) to a file or to the standard output.
+    """
+    export = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='File path, or - to write to the standard output.'
+        )
+        parser.add_argument(
+            '--format',
+            choices=sorted(FORMATS),
+            default='ndjson',
+            help='Export format.'
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Compresses the export with gzip.'
+        )
+        parser.add_argument('--league', help='League global ID.')
+        parser.add_argument(
+            '--since',
+            help='ISO 8601 date or datetime of the first rows (inclusive).'
+        )
+        parser.add_argument(
+            '--until',
+            help='ISO 8601 date or datetime of the last rows (exclusive).'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Rows fetched from the database at a time.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            table = Export(
+                self.export,
+                league=options['league'],
+                since=options['since'],
+                until=options['until'],
+                format=options['format'],
+                compress=options['gzip'],
+                chunk_size=options['chunk_size']
+            )
+        except Exception as ex:
+            raise CommandError(ex)
+
+        if options['output'] == '-':
+            self.write(table, sys.stdout.buffer)
+        else:
+            with open(options['output'], 'wb') as output:
+                self.write(table, output)
+
+        # A saída padrão pode conter a própria exportação
+        self.stderr.write(
+            self.style.SUCCESS(f'{table.rows} {self.export} exported.')
+        )
+
+    def write(self, table, output):
+        for block in table:
+            output.write(block)
+        output.flush()
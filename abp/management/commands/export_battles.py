@@ -0,0 +1,9 @@
+from abp.management.base import ExportCommand
+
+
+class Command(ExportCommand):
+    help = (
+        'Exports the battles as NDJSON or CSV. --since and --until filter '
+        'by the battle date.'
+    )
+    export = 'battles'
@@ -0,0 +1,10 @@
+from abp.management.base import ExportCommand
+
+
+class Command(ExportCommand):
+    help = (
+        'Exports the leaders as NDJSON or CSV. --league filters the gym '
+        'leaders, elite four and champion of the league; --since and --until '
+        'filter by the join date.'
+    )
+    export = 'leaders'
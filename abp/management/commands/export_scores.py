@@ -0,0 +1,9 @@
+from abp.management.base import ExportCommand
+
+
+class Command(ExportCommand):
+    help = (
+        'Exports the scores as NDJSON or CSV. --since and --until filter by '
+        'the date of the last battle.'
+    )
+    export = 'scores'
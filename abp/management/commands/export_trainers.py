@@ -0,0 +1,9 @@
+from abp.management.base import ExportCommand
+
+
+class Command(ExportCommand):
+    help = (
+        'Exports the trainers as NDJSON or CSV. --league filters the league '
+        'competitors; --since and --until filter by the join date.'
+    )
+    export = 'trainers'
@@ -0,0 +1,59 @@
+import csv
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from abp.battles import register_battles
+from abp.utils import validate_global_id
+
+
+class Command(BaseCommand):
+    help = (
+        'Registers the battles of a CSV file with the columns '
+        'league,trainer,leader,winner, in the file order. league is the '
+        'league global ID; trainer, leader and winner are discord ids.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='CSV file path, or - to read from the standard input.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Battles registered per transaction.'
+        )
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            records = self.read_records(sys.stdin)
+        else:
+            with open(options['path'], newline='') as csv_file:
+                records = self.read_records(csv_file)
+
+        batch_size = options['batch_size']
+        for start in range(0, len(records), batch_size):
+            try:
+                register_battles(records[start:start + batch_size])
+            except Exception as ex:
+                raise CommandError(
+                    f'Battles {start} to {start + batch_size - 1} were not '
+                    f'registered: {ex}'
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(f'{len(records)} battles registered.')
+        )
+
+    def read_records(self, csv_file):
+        records = []
+        for row in csv.DictReader(csv_file):
+            try:
+                league_id = validate_global_id(row['league'], 'LeagueType')
+            except Exception as ex:
+                raise CommandError(f'Line {len(records) + 2}: {ex}')
+            records.append(
+                (league_id, row['trainer'], row['leader'], row['winner'])
+            )
+
+        return records
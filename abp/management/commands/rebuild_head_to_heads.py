@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from abp.cache import invalidate
+from abp.rollups import rebuild_head_to_heads
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the trainer versus leader records from the battles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--league',
+            type=int,
+            action='append',
+            dest='leagues',
+            help='Numeric ID of a league to rebuild. Defaults to all leagues.'
+        )
+
+    def handle(self, *args, **options):
+        total = rebuild_head_to_heads(options['leagues'])
+        invalidate('headtohead')
+        self.stdout.write(self.style.SUCCESS(f'{total} head-to-heads rebuilt.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from abp.cache import invalidate
+from abp.rollups import rebuild_leader_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily leader stats from the battles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--league',
+            type=int,
+            action='append',
+            dest='leagues',
+            help='Numeric ID of a league to rebuild. Defaults to all leagues.'
+        )
+
+    def handle(self, *args, **options):
+        total = rebuild_leader_stats(options['leagues'])
+        invalidate('leaderdailystats')
+        self.stdout.write(self.style.SUCCESS(f'{total} leader stats rebuilt.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from abp.cache import invalidate
+from abp.standings import rebuild_standings
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the league standings from the scores.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--league',
+            type=int,
+            action='append',
+            dest='leagues',
+            help='Numeric ID of a league to rebuild. Defaults to all leagues.'
+        )
+
+    def handle(self, *args, **options):
+        total = rebuild_standings(options['leagues'])
+        invalidate('standing')
+        self.stdout.write(self.style.SUCCESS(f'{total} standings rebuilt.'))
@@ -0,0 +1,59 @@
+from collections import defaultdict
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from abp.cache import invalidate
+from abp.models import Trainer, Leader
+from abp.utils import levels_for_exp
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the lv and next_lv of every trainer and leader from '
+        'their exp, using the current level formula.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Maximum number of players updated per UPDATE statement.'
+        )
+
+    def handle(self, *args, **options):
+        for model in (Trainer, Leader):
+            updated = self.recompute(model, options['chunk_size'])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'{updated} {model._meta.verbose_name_plural} updated.'
+                )
+            )
+        invalidate('trainer', 'leader')
+
+    def recompute(self, model, chunk_size):
+        rows = np.array(
+            list(model.objects.values_list('id', 'exp', 'lv', 'next_lv')),
+            dtype=np.int64
+        ).reshape(-1, 4)
+        ids, exps, lvs, next_lvs = rows.T
+        new_lvs, new_next_lvs = levels_for_exp(exps)
+        changed = (new_lvs != lvs) | (new_next_lvs != next_lvs)
+
+        # Agrupa os jogadores que terminam no mesmo lv: um UPDATE por lv
+        groups = defaultdict(list)
+        for pk, lv, next_lv in zip(
+            ids[changed].tolist(),
+            new_lvs[changed].tolist(),
+            new_next_lvs[changed].tolist()
+        ):
+            groups[(lv, next_lv)].append(pk)
+
+        with transaction.atomic():
+            for (lv, next_lv), pks in groups.items():
+                for start in range(0, len(pks), chunk_size):
+                    model.objects.filter(
+                        pk__in=pks[start:start + chunk_size]
+                    ).update(lv=lv, next_lv=next_lv)
+
+        return int(changed.sum())
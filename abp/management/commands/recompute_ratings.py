@@ -0,0 +1,46 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from abp.cache import invalidate
+from abp.ratings import INITIAL_RATING, recompute_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the rating of every trainer and leader by replaying the '
+        'battles in chronological order.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--k',
+            type=float,
+            default=None,
+            help='K factor of the replay. Defaults to the ABP_RATING_K setting.'
+        )
+        parser.add_argument(
+            '--initial',
+            type=float,
+            default=INITIAL_RATING,
+            help='Rating of the players before their first battle.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Reports the replay log loss without saving the ratings.'
+        )
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        result = recompute_ratings(
+            k=options['k'],
+            initial=options['initial'],
+            write=not options['dry_run']
+        )
+        elapsed = perf_counter() - start
+        if not options['dry_run']:
+            invalidate('trainer', 'leader')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.battles} battles replayed in {elapsed:.2f}s '
+            f'(log loss {result.log_loss:.4f}).'
+        ))
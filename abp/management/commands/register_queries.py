@@ -0,0 +1,36 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from graphql import GraphQLError
+from graphql.language.parser import parse
+from graphql.validation import validate
+from abp.documents import register_query
+from bill.schema import schema
+
+
+class Command(BaseCommand):
+    help = (
+        'Registers GraphQL queries on the persisted queries whitelist and '
+        'prints their sha256, which the clients can send instead of the '
+        'query. Each file must contain one GraphQL document.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='.graphql files.')
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            with open(path) as query_file:
+                query = query_file.read()
+
+            try:
+                errors = validate(schema, parse(query))
+            except GraphQLError as ex:
+                errors = [ex]
+            if errors:
+                raise CommandError(
+                    f'{path}: {"; ".join(str(error) for error in errors)}'
+                )
+
+            name = os.path.splitext(os.path.basename(path))[0]
+            persisted = register_query(query, name=name[:100])
+            self.stdout.write(f'{persisted.sha256} {path}')
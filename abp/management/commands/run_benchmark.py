@@ -0,0 +1,50 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from abp.benchmark import CATALOGUE, run_benchmark
+from bill.schema import schema
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the GraphQL benchmark catalogue (scoreboard, trainer profile, '
+        'league listing and battle register) against the current database '
+        'and reports the latency percentiles and SQL query counts of each '
+        'operation as JSON. Mutations are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=5,
+            help='Executions discarded before measuring each operation.'
+        )
+        parser.add_argument(
+            '--operation',
+            action='append',
+            choices=[operation.name for operation in CATALOGUE],
+            help='Runs only the given operation. Can be repeated.'
+        )
+        parser.add_argument(
+            '--output',
+            help='Writes the report to the given file instead of the stdout.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            report = run_benchmark(
+                schema,
+                iterations=options['iterations'],
+                warmup=options['warmup'],
+                operations=options['operation']
+            )
+        except Exception as ex:
+            raise CommandError(ex)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
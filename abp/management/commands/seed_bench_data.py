@@ -0,0 +1,278 @@
+import random
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from math import ceil
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from abp.battles import register_battles
+from abp.cache import invalidate
+from abp.models import (League, Trainer, Leader, Score, Battle, Badge,
+                        Standing)
+from abp.resolvers import STANDBY_DAYS
+from abp.rollups import rebuild_head_to_heads, rebuild_leader_stats
+from abp.schema import PokemonTypes
+from abp.standings import rebuild_standings
+
+
+# Prefixo dos dados gerados, usado para identificar um banco já populado
+PREFIX = 'bench'
+
+
+class Command(BaseCommand):
+    help = (
+        'Populates the database with a synthetic dataset of leagues, '
+        'trainers, leaders, scores, badges and battles for benchmarking. '
+        'The same seed and volumes always generate the same dataset (except '
+        'for the creation timestamps).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--leagues', type=int, default=5)
+        parser.add_argument('--trainers', type=int, default=500)
+        parser.add_argument('--leaders', type=int, default=60)
+        parser.add_argument('--badges', type=int, default=40)
+        parser.add_argument('--battles', type=int, default=20000)
+        parser.add_argument(
+            '--leagues-per-trainer',
+            type=int,
+            default=2,
+            help='Maximum number of leagues each trainer competes in.'
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=90,
+            help='The battles are spread over the last given days.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Battles registered per transaction.'
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Deletes every league, player, score, badge and battle first.'
+        )
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.clear()
+        elif League.objects.filter(reference__startswith=PREFIX).exists():
+            raise CommandError(
+                'The database already has benchmark data, use --clear to '
+                'replace it.'
+            )
+
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            leagues = self.create_leagues(rng, options['leagues'])
+            trainers = self.create_players(Trainer, options['trainers'])
+            leaders = self.create_leaders(rng, options['leaders'])
+            Badge.objects.bulk_create([
+                Badge(reference=f'{PREFIX.title()} Badge {i}')
+                for i in range(options['badges'])
+            ])
+            badges = list(Badge.objects.filter(
+                reference__startswith=f'{PREFIX.title()} Badge '
+            ).order_by('pk'))
+            league_leaders = self.assign_leaders(rng, leagues, leaders)
+            scores = self.create_scores(
+                rng,
+                leagues,
+                trainers,
+                options['leagues_per_trainer']
+            )
+            self.give_badges(rng, scores, badges)
+
+        battles = self.register_battles(rng, scores, league_leaders, options)
+        rebuild_standings()
+        # Os agregados são registrados com o horário da inserção das batalhas
+        rebuild_leader_stats()
+        rebuild_head_to_heads()
+        invalidate(
+            'league', 'trainer', 'leader', 'score', 'battle', 'badge', 'standing',
+            'leaderdailystats', 'headtohead'
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(leagues)} leagues, {len(trainers)} trainers, '
+            f'{len(leaders)} leaders, {len(scores)} scores, {len(badges)} '
+            f'badges and {battles} battles created.'
+        ))
+
+    def clear(self):
+        with transaction.atomic():
+            for model in (Standing, Score, Battle, League, Trainer, Leader, Badge):
+                model.objects.all().delete()
+
+    def create_leagues(self, rng, total):
+        leagues = []
+        for i in range(total):
+            start_date = date(2019, 1, 1) + timedelta(days=rng.randrange(365))
+            leagues.append(League.objects.create(
+                reference=f'{PREFIX} league {i}',
+                start_date=start_date,
+                end_date=start_date + timedelta(days=rng.randrange(30, 120)),
+                description=f'Benchmark league {i}',
+            ))
+
+        return leagues
+
+    def create_players(self, model, total, **fields):
+        name = model._meta.model_name
+        model.objects.bulk_create([
+            model(discord_id=f'{PREFIX}-{name}-{i}', **fields)
+            for i in range(total)
+        ])
+        # Os IDs são recuperados por uma consulta, pois apenas o postgres os
+        # retorna no bulk_create
+        return list(
+            model.objects.filter(
+                discord_id__startswith=f'{PREFIX}-{name}-'
+            ).order_by('pk')
+        )
+
+    def create_leaders(self, rng, total):
+        types = [pokemon_type.value for pokemon_type in PokemonTypes._meta.enum]
+        leaders = self.create_players(Leader, total, role='Gym Leader')
+        for leader in leaders:
+            leader.pokemon_type = rng.choice(types)
+
+        # Um UPDATE por tipo
+        for pokemon_type in set(leader.pokemon_type for leader in leaders):
+            Leader.objects.filter(pk__in=[
+                leader.pk for leader in leaders
+                if leader.pokemon_type == pokemon_type
+            ]).update(pokemon_type=pokemon_type)
+
+        return leaders
+
+    def assign_leaders(self, rng, leagues, leaders):
+        """
+        Distribui os líderes entre as ligas: 8 líderes de ginásio, 4 elite
+        four e um campeão por liga, quando houver líderes suficientes.
+        """
+        league_leaders = {}
+        for league in leagues:
+            pool = rng.sample(leaders, min(len(leaders), 13))
+            gym_leaders, elite_four, champion = pool[:8], pool[8:12], pool[12:]
+            league.gym_leaders.add(*gym_leaders)
+            league.elite_four.add(*elite_four)
+            if champion:
+                league.champion = champion[0]
+                league.save(update_fields=['champion'])
+            league_leaders[league.pk] = pool
+
+        return league_leaders
+
+    def create_scores(self, rng, leagues, trainers, leagues_per_trainer):
+        scores = []
+        for trainer in trainers:
+            total = rng.randint(1, min(leagues_per_trainer, len(leagues)))
+            for league in rng.sample(leagues, total):
+                scores.append(Score(league=league, trainer=trainer))
+
+        Score.objects.bulk_create(scores)
+        scores = list(Score.objects.filter(
+            league__in=leagues
+        ).select_related('league', 'trainer').order_by('pk'))
+
+        Competitors = League.competitors.through
+        Competitors.objects.bulk_create([
+            Competitors(league_id=score.league_id, trainer_id=score.trainer_id)
+            for score in scores
+        ])
+        self.update_counter(
+            'leagues_counter',
+            Counter(score.trainer_id for score in scores)
+        )
+
+        return scores
+
+    def update_counter(self, field, counters):
+        """
+        Atualiza um contador dos treinadores, com um UPDATE por valor.
+        """
+        groups = defaultdict(list)
+        for trainer_id, value in counters.items():
+            groups[value].append(trainer_id)
+        for value, trainer_ids in groups.items():
+            Trainer.objects.filter(pk__in=trainer_ids).update(**{field: value})
+
+    def give_badges(self, rng, scores, badges):
+        if not badges:
+            return
+
+        ScoreBadges = Score.badges.through
+        rows = []
+        for score in scores:
+            for badge in rng.sample(badges, rng.randint(0, min(len(badges), 8))):
+                rows.append(ScoreBadges(score_id=score.pk, badge_id=badge.pk))
+        ScoreBadges.objects.bulk_create(rows)
+
+        trainers = {score.pk: score.trainer_id for score in scores}
+        self.update_counter(
+            'badge_counter',
+            Counter(trainers[row.score_id] for row in rows)
+        )
+
+    def register_battles(self, rng, scores, league_leaders, options):
+        """
+        Sorteia e registra as batalhas em lotes, pelo fluxo de escrita da API.
+        Cada lote representa um instante dos últimos `days` dias: após o
+        registro, as batalhas e os scores do lote recebem esse horário, de
+        modo que o standby de um treinador que perdeu expira nos lotes
+        seguintes, como ocorreria com batalhas reais.
+        return : <int> quantidade de batalhas
+        """
+        total, batch_size = options['battles'], options['batch_size']
+        now = timezone.now()
+        standby_start = now - timedelta(days=STANDBY_DAYS)
+        available = [score for score in scores if league_leaders[score.league_id]]
+        in_standby = set()
+        batches = ceil(total / batch_size)
+
+        created = 0
+        for number in range(batches):
+            when = now - timedelta(days=options['days']) * (1 - number / batches)
+            if when <= standby_start:
+                in_standby.clear()
+
+            records, battle_scores = [], set()
+            size = min(batch_size, total - created)
+            candidates = [s for s in available if s.pk not in in_standby]
+            while candidates and len(records) < size:
+                index = rng.randrange(len(candidates))
+                score = candidates[index]
+                trainer = score.trainer.discord_id
+                leader = rng.choice(league_leaders[score.league_id]).discord_id
+                trainer_won = rng.random() < 0.6
+                records.append((
+                    score.league_id,
+                    trainer,
+                    leader,
+                    trainer if trainer_won else leader
+                ))
+                battle_scores.add(score.pk)
+
+                # O treinador que perde fica de molho na liga
+                if not trainer_won:
+                    in_standby.add(score.pk)
+                    candidates[index] = candidates[-1]
+                    candidates.pop()
+
+            if not records:
+                break
+
+            battles = register_battles(records, standings=False)
+            Battle.objects.filter(
+                pk__in=[battle.pk for battle in battles]
+            ).update(battle_datetime=when)
+            Score.objects.filter(pk__in=battle_scores).update(last_battle_at=when)
+            created += len(battles)
+
+        return created
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from abp.analytics import CHUNK_SIZE, SETTLE_SECONDS, snapshot_battles
+
+
+class Command(BaseCommand):
+    help = (
+        'Appends the battles registered since the last snapshot to the '
+        'columnar battle snapshot on ABP_SNAPSHOT_DIR (see abp.analytics).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rewrites the snapshot with all the battles.'
+        )
+        parser.add_argument(
+            '--path',
+            help='Snapshot directory. Defaults to ABP_SNAPSHOT_DIR.'
+        )
+        parser.add_argument(
+            '--settle',
+            type=float,
+            default=SETTLE_SECONDS,
+            help='Battles newer than these seconds are left to the next snapshot.'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Battles fetched from the database at a time.'
+        )
+
+    def handle(self, *args, **options):
+        total = snapshot_battles(
+            options['path'],
+            full=options['full'],
+            settle=options['settle'],
+            chunk_size=options['chunk_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f'{total} battles added to the snapshot.'))
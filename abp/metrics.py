@@ -0,0 +1,136 @@
+"""
+Módulo contendo as métricas Prometheus do endpoint GraphQL.
+O middleware ResolverMetricsMiddleware mede a latência dos resolvers dos
+campos raiz (Query e Mutation) por operação; o ABPGraphQLView contabiliza as
+requisições e os erros de cada operação.
+Quando a variável de ambiente `prometheus_multiproc_dir` está definida (ver
+bill/gunicorn.conf.py), cada worker do gunicorn grava suas métricas em
+arquivos desse diretório e o endpoint /metrics agrega os arquivos de todos
+os workers.
+O label `operation` usa os nomes de operação limitados por OperationNames
+(ver abp.instrumentation): os nomes inválidos e os excedentes são
+registrados como `other`.
+"""
+import os
+from time import perf_counter
+from django.http import HttpResponse
+from promise import Promise, is_thenable
+from prometheus_client import (CollectorRegistry, Counter, Histogram,
+                               REGISTRY, CONTENT_TYPE_LATEST, generate_latest,
+                               multiprocess)
+from abp.instrumentation import ANONYMOUS_OPERATION, OperationNames
+
+
+# Tipos raiz cujos resolvers são medidos
+ROOT_TYPES = ('Query', 'Mutation')
+
+# Limites (em segundos) dos buckets dos histogramas de latência
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+RESOLVER_LATENCY = Histogram(
+    'abp_graphql_resolver_duration_seconds',
+    'Latency of the Query and Mutation field resolvers.',
+    ['operation', 'field'],
+    buckets=LATENCY_BUCKETS
+)
+RESOLVER_ERRORS = Counter(
+    'abp_graphql_resolver_errors_total',
+    'Query and Mutation field resolvers that raised an error.',
+    ['operation', 'field']
+)
+REQUEST_LATENCY = Histogram(
+    'abp_graphql_request_duration_seconds',
+    'Latency of the GraphQL operations, from parsing to execution.',
+    ['operation'],
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_ERRORS = Counter(
+    'abp_graphql_request_errors_total',
+    'GraphQL operations answered with errors.',
+    ['operation']
+)
+
+
+# Nomes de operação usados nos labels
+operation_labels = OperationNames()
+
+
+def info_operation_name(info):
+    """
+    Retorna o label da operação em execução, ou `anonymous`.
+    """
+    name = info.operation.name
+    return operation_labels.normalize(name.value if name else ANONYMOUS_OPERATION)
+
+
+class ResolverMetricsMiddleware:
+    """
+    Middleware graphene que mede a latência dos resolvers dos campos raiz,
+    por operação e campo (ex: `Query.leagues`). Os demais campos são
+    resolvidos sem medição. Resolvers que retornam promises são medidos até
+    a resolução da promise.
+    """
+    def resolve(self, next, root, info, **args):
+        if info.parent_type.name not in ROOT_TYPES:
+            return next(root, info, **args)
+
+        labels = (
+            info_operation_name(info),
+            f'{info.parent_type.name}.{info.field_name}'
+        )
+        start = perf_counter()
+
+        def observe(value):
+            RESOLVER_LATENCY.labels(*labels).observe(perf_counter() - start)
+            return value
+
+        def fail(error):
+            observe(None)
+            RESOLVER_ERRORS.labels(*labels).inc()
+            raise error
+
+        try:
+            result = next(root, info, **args)
+        except Exception:
+            observe(None)
+            RESOLVER_ERRORS.labels(*labels).inc()
+            raise
+
+        if is_thenable(result):
+            return Promise.resolve(result).then(observe, fail)
+        return observe(result)
+
+
+def observe_request(operation, duration, failed):
+    """
+    Registra a execução de uma operação GraphQL.
+    """
+    operation = operation_labels.normalize(operation)
+    REQUEST_LATENCY.labels(operation).observe(duration)
+    if failed:
+        REQUEST_ERRORS.labels(operation).inc()
+
+
+def metrics_registry():
+    """
+    Retorna o registry com as métricas do processo ou, no modo
+    multiprocesso, com as métricas agregadas de todos os workers.
+    """
+    if 'prometheus_multiproc_dir' not in os.environ:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics(request):
+    """
+    Serves the metrics in the Prometheus text format.
+    """
+    return HttpResponse(
+        generate_latest(metrics_registry()),
+        content_type=CONTENT_TYPE_LATEST
+    )
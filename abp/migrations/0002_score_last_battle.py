@@ -0,0 +1,42 @@
+# Generated by Django 2.1.10 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+def backfill_last_battle(apps, schema_editor):
+    """
+    Preenche os dados da última batalha de cada score a partir das batalhas
+    já registradas.
+    """
+    Score = apps.get_model('abp', 'Score')
+    for score in Score.objects.all().iterator():
+        last_battle = score.battles.select_related('trainer').order_by('pk').last()
+        if not last_battle:
+            continue
+        score.last_battle_at = last_battle.battle_datetime
+        score.last_battle_lost = (
+            last_battle.trainer is None or
+            last_battle.winner_name != last_battle.trainer.discord_id
+        )
+        score.save(update_fields=['last_battle_at', 'last_battle_lost'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='score',
+            name='last_battle_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='score',
+            name='last_battle_lost',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_last_battle, migrations.RunPython.noop),
+    ]
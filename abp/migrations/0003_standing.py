@@ -0,0 +1,79 @@
+# Generated by Django 2.1.10 on 2026-10-18 17:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_standings(apps, schema_editor):
+    """
+    Cria os standings de todos os scores já existentes.
+    """
+    Score = apps.get_model('abp', 'Score')
+    Standing = apps.get_model('abp', 'Standing')
+    scores = Score.objects.filter(
+        league__isnull=False,
+        trainer__isnull=False
+    ).annotate(
+        badge_count=models.Count('badges')
+    ).order_by('league_id', '-wins', 'losses', '-badge_count')
+
+    standings = []
+    previous = None
+    for score in scores:
+        key = (score.league_id, score.wins, score.losses, score.badge_count)
+        if not previous or previous[0] != score.league_id:
+            position = 0
+        position += 1
+        if key != previous:
+            rank = position
+        previous = key
+        total = score.wins + score.losses
+        standings.append(Standing(
+            league_id=score.league_id,
+            trainer_id=score.trainer_id,
+            score_id=score.id,
+            rank=rank,
+            wins=score.wins,
+            losses=score.losses,
+            badge_count=score.badge_count,
+            win_ratio=score.wins / total if total else 0,
+        ))
+
+    Standing.objects.bulk_create(standings)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abp', '0002_score_last_battle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Standing',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.IntegerField(default=1)),
+                ('wins', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('badge_count', models.IntegerField(default=0)),
+                ('win_ratio', models.FloatField(default=0)),
+                ('league', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='standings', to='abp.League')),
+                ('score', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='standing', to='abp.Score')),
+                ('trainer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='standings', to='abp.Trainer')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='standing',
+            index=models.Index(fields=['league', 'rank'], name='abp_standin_league__88038b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='standing',
+            index=models.Index(fields=['league', 'trainer'], name='abp_standin_league__414d93_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='standing',
+            index=models.Index(fields=['league', '-wins', 'losses', '-badge_count'], name='abp_standin_league__ff7ff4_idx'),
+        ),
+        migrations.RunPython(build_standings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.10 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abp', '0003_standing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='battle',
+            index=models.Index(fields=['battle_datetime', 'id'], name='abp_battle_battle__a477e1_idx'),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 2.1.10 on 2026-10-18 18:24
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def rank_standings(Standing, league_id):
+    """
+    Recalcula as posições do ranking de uma liga (ver abp.standings).
+    """
+    standings = sorted(
+        Standing.objects.filter(league_id=league_id),
+        key=lambda s: (-s.wins, s.losses, -s.badge_count)
+    )
+    previous_key = None
+    for position, standing in enumerate(standings, start=1):
+        key = (-standing.wins, standing.losses, -standing.badge_count)
+        if key != previous_key:
+            rank, previous_key = position, key
+        if standing.rank != rank:
+            standing.rank = rank
+            standing.save(update_fields=['rank'])
+
+
+def merge_duplicate_scores(apps, schema_editor):
+    """
+    Une os scores repetidos de um treinador em uma liga no score mais
+    antigo, somando vitórias e derrotas e mantendo as batalhas e insígnias.
+    """
+    Score = apps.get_model('abp', 'Score')
+    Standing = apps.get_model('abp', 'Standing')
+    duplicates = Score.objects.filter(
+        trainer__isnull=False,
+        league__isnull=False
+    ).values('trainer_id', 'league_id').annotate(
+        total=Count('id'),
+        kept=Min('id')
+    ).filter(total__gt=1)
+
+    leagues = set()
+    for duplicate in duplicates:
+        kept = Score.objects.get(pk=duplicate['kept'])
+        others = Score.objects.filter(
+            trainer_id=duplicate['trainer_id'],
+            league_id=duplicate['league_id']
+        ).exclude(pk=kept.pk)
+
+        for score in others:
+            kept.wins += score.wins
+            kept.losses += score.losses
+            kept.battles.add(*score.battles.all())
+            kept.badges.add(*score.badges.all())
+            if score.last_battle_at and (
+                kept.last_battle_at is None or
+                score.last_battle_at > kept.last_battle_at
+            ):
+                kept.last_battle_at = score.last_battle_at
+                kept.last_battle_lost = score.last_battle_lost
+        kept.save()
+        # Os standings dos scores removidos são removidos em cascata
+        others.delete()
+
+        total = kept.wins + kept.losses
+        Standing.objects.filter(score=kept).update(
+            wins=kept.wins,
+            losses=kept.losses,
+            badge_count=kept.badges.count(),
+            win_ratio=kept.wins / total if total else 0
+        )
+        leagues.add(kept.league_id)
+
+    for league_id in leagues:
+        rank_standings(Standing, league_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abp', '0006_invalidationevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_scores, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='score',
+            unique_together={('trainer', 'league')},
+        ),
+        migrations.AddIndex(
+            model_name='battle',
+            index=models.Index(fields=['trainer', 'battle_datetime', 'id'], name='abp_battle_trainer_b015d9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='battle',
+            index=models.Index(fields=['leader', 'battle_datetime', 'id'], name='abp_battle_leader__4360e6_idx'),
+        ),
+    ]
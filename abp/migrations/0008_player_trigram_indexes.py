@@ -0,0 +1,43 @@
+# Generated by Django 2.1.10 on 2026-10-18 18:40
+
+from django.db import migrations
+
+
+# Índices GIN de trigramas da busca de jogadores (ver abp.search), criados
+# apenas no PostgreSQL
+TRIGRAM_INDEXES = [
+    (table, column, f'{table}_{column}_trgm')
+    for table in ('abp_trainer', 'abp_leader')
+    for column in ('name', 'discord_id')
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column, name in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'USING gin ({column} gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    for _, _, name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abp', '0007_score_unique_battle_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
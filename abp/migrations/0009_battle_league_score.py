@@ -0,0 +1,26 @@
+# Generated by Django 2.1.10 on 2026-10-18 18:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abp', '0008_player_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='battle',
+            name='league',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='battles', to='abp.League'),
+        ),
+        # O nome reverso `battles` é usado pelo ManyToMany Score.battles até
+        # a migração 0011
+        migrations.AddField(
+            model_name='battle',
+            name='score',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='abp.Score'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 2.1.10 on 2026-10-18 18:55
+
+from django.db import migrations, transaction
+from django.db.models import Max, Min
+
+
+# Quantidade de batalhas atualizadas por transação
+CHUNK_SIZE = 5000
+
+
+def backfill_battles(apps, schema_editor):
+    """
+    Preenche a liga e o score das batalhas a partir do ManyToMany
+    Score.battles, em transações de CHUNK_SIZE batalhas. Apenas as batalhas
+    ainda sem score são atualizadas: se a migração for interrompida, a
+    execução seguinte continua da primeira batalha sem score.
+    """
+    Battle = apps.get_model('abp', 'Battle')
+    ScoreBattles = apps.get_model('abp', 'Score_battles')
+    database = schema_editor.connection.alias
+
+    pending = Battle.objects.using(database).filter(score__isnull=True)
+    bounds = pending.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return
+
+    for start in range(bounds['first'], bounds['last'] + 1, CHUNK_SIZE):
+        rows = ScoreBattles.objects.using(database).filter(
+            battle_id__gte=start,
+            battle_id__lt=start + CHUNK_SIZE,
+            battle__score__isnull=True
+        ).order_by('battle_id', 'score_id').values_list(
+            'battle_id', 'score_id', 'score__league_id'
+        )
+
+        # Uma batalha relacionada a mais de um score fica com o primeiro
+        groups = {}
+        seen = set()
+        for battle_id, score_id, league_id in rows:
+            if battle_id not in seen:
+                seen.add(battle_id)
+                groups.setdefault((score_id, league_id), []).append(battle_id)
+
+        with transaction.atomic(using=database):
+            for (score_id, league_id), battle_ids in groups.items():
+                Battle.objects.using(database).filter(pk__in=battle_ids).update(
+                    score_id=score_id,
+                    league_id=league_id
+                )
+
+
+class Migration(migrations.Migration):
+    # Cada lote é confirmado em sua própria transação
+    atomic = False
+
+    dependencies = [
+        ('abp', '0009_battle_league_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_battles, migrations.RunPython.noop),
+    ]
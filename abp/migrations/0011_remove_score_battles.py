@@ -0,0 +1,27 @@
+# Generated by Django 2.1.10 on 2026-10-18 18:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abp', '0010_backfill_battle_league_score'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='score',
+            name='battles',
+        ),
+        migrations.AlterField(
+            model_name='battle',
+            name='score',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='battles', to='abp.Score'),
+        ),
+        migrations.AddIndex(
+            model_name='battle',
+            index=models.Index(fields=['league', 'battle_datetime', 'id'], name='abp_battle_league__c891d1_idx'),
+        ),
+    ]
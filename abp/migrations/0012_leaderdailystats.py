@@ -0,0 +1,69 @@
+# Generated by Django 2.1.10 on 2026-10-18 18:37
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def populate_leader_stats(apps, schema_editor):
+    """
+    Agrega as batalhas já registradas nos agregados diários dos líderes.
+    """
+    Battle = apps.get_model('abp', 'Battle')
+    LeaderDailyStats = apps.get_model('abp', 'LeaderDailyStats')
+    database = schema_editor.connection.alias
+
+    leader_won = Case(
+        When(winner_name=F('leader__discord_id'), then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField()
+    )
+    rows = Battle.objects.using(database).filter(
+        league__isnull=False,
+        leader__isnull=False
+    ).annotate(
+        day=TruncDate('battle_datetime')
+    ).values('league_id', 'leader_id', 'day').annotate(
+        battles=Count('pk'),
+        wins=Sum(leader_won)
+    ).order_by()
+
+    LeaderDailyStats.objects.using(database).bulk_create([
+        LeaderDailyStats(
+            league_id=row['league_id'],
+            leader_id=row['leader_id'],
+            day=row['day'],
+            battles=row['battles'],
+            wins=row['wins'],
+            losses=row['battles'] - row['wins']
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abp', '0011_remove_score_battles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('battles', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('leader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='abp.Leader')),
+                ('league', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leader_stats', to='abp.League')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='leaderdailystats',
+            unique_together={('league', 'leader', 'day')},
+        ),
+        migrations.RunPython(populate_leader_stats, migrations.RunPython.noop),
+    ]
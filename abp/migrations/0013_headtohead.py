@@ -0,0 +1,79 @@
+# Generated by Django 2.1.10 on 2026-10-18 18:40
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, IntegerField, Max, Sum, Value, When
+import django.db.models.deletion
+
+
+def populate_head_to_heads(apps, schema_editor):
+    """
+    Agrega as batalhas já registradas nos retrospectos dos treinadores
+    contra os líderes.
+    """
+    Battle = apps.get_model('abp', 'Battle')
+    HeadToHead = apps.get_model('abp', 'HeadToHead')
+    database = schema_editor.connection.alias
+
+    trainer_won = Case(
+        When(winner_name=F('trainer__discord_id'), then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField()
+    )
+    rows = Battle.objects.using(database).filter(
+        league__isnull=False,
+        trainer__isnull=False,
+        leader__isnull=False
+    ).values('trainer_id', 'leader_id', 'league_id').annotate(
+        battles=Count('pk'),
+        wins=Sum(trainer_won),
+        last_battle_at=Max('battle_datetime')
+    ).order_by()
+
+    HeadToHead.objects.using(database).bulk_create([
+        HeadToHead(
+            trainer_id=row['trainer_id'],
+            leader_id=row['leader_id'],
+            league_id=row['league_id'],
+            battles=row['battles'],
+            wins=row['wins'],
+            losses=row['battles'] - row['wins'],
+            last_battle_at=row['last_battle_at']
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abp', '0012_leaderdailystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeadToHead',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('battles', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('last_battle_at', models.DateTimeField()),
+                ('leader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='head_to_heads', to='abp.Leader')),
+                ('league', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='head_to_heads', to='abp.League')),
+                ('trainer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='head_to_heads', to='abp.Trainer')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='headtohead',
+            index=models.Index(fields=['trainer', 'battles', 'id'], name='abp_headtoh_trainer_af7e1a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='headtohead',
+            index=models.Index(fields=['trainer', 'last_battle_at', 'id'], name='abp_headtoh_trainer_780aa3_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='headtohead',
+            unique_together={('trainer', 'leader', 'league')},
+        ),
+        migrations.RunPython(populate_head_to_heads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.1.10 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abp', '0013_headtohead'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leader',
+            name='rating',
+            field=models.FloatField(default=1500),
+        ),
+        migrations.AddField(
+            model_name='trainer',
+            name='rating',
+            field=models.FloatField(default=1500),
+        ),
+        migrations.AddIndex(
+            model_name='leader',
+            index=models.Index(fields=['rating', 'id'], name='abp_leader_rating_5d3014_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trainer',
+            index=models.Index(fields=['rating', 'id'], name='abp_trainer_rating_13deb2_idx'),
+        ),
+    ]
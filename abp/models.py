@@ -74,6 +74,13 @@ class Trainer(models.Model):
     sd_id = models.CharField(max_length=50, blank=True, null=True, unique=True)
     # usuario discord
     discord_id = models.CharField(max_length=80, blank=True, null=True, unique=True)
+    # rating Elo, ver abp.ratings
+    rating = models.FloatField(default=1500)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['rating', 'id']),
+        ]
 
 
 class Leader(models.Model):
@@ -117,6 +124,13 @@ class Leader(models.Model):
     sd_id = models.CharField(max_length=50, blank=True, null=True, unique=True)
     # usuario discord
     discord_id = models.CharField(max_length=80, blank=True, null=True, unique=True)
+    # rating Elo, ver abp.ratings
+    rating = models.FloatField(default=1500)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['rating', 'id']),
+        ]
 
 
 class Score(models.Model):
@@ -136,8 +150,14 @@ class Score(models.Model):
         on_delete=models.CASCADE,
         null=True
     )
-    battles = models.ManyToManyField('abp.Battle')
     badges = models.ManyToManyField('abp.Badge')
+    # dados da última batalha, mantidos pelo registro de batalhas para que o
+    # standby possa ser calculado e filtrado direto no banco de dados
+    last_battle_at = models.DateTimeField(blank=True, null=True)
+    last_battle_lost = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('trainer', 'league')
 
 
 class Battle(models.Model):
@@ -159,6 +179,30 @@ class Battle(models.Model):
         null=True,
         related_name='battling_leader'
     )
+    # liga e score do treinador; as batalhas são mantidas se a liga ou o
+    # score forem removidos
+    league = models.ForeignKey(
+        League,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='battles'
+    )
+    score = models.ForeignKey(
+        Score,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='battles'
+    )
+
+    class Meta:
+        # O histórico de um treinador ou líder é ordenado por data, com o ID
+        # como desempate (ver KeysetConnectionField)
+        indexes = [
+            models.Index(fields=['battle_datetime', 'id']),
+            models.Index(fields=['trainer', 'battle_datetime', 'id']),
+            models.Index(fields=['leader', 'battle_datetime', 'id']),
+            models.Index(fields=['league', 'battle_datetime', 'id']),
+        ]
 
 
 class Badge(models.Model):
@@ -167,3 +211,119 @@ class Badge(models.Model):
     Gym Leader.
     """
     reference = models.CharField(max_length=100, unique=True)
+
+
+class Standing(models.Model):
+    """
+    Defines the position of a trainer on a league ranking.
+    The trainers are ranked by wins, losses and badges; the standings are
+    updated incrementally as battles and badges are registered.
+    """
+    league = models.ForeignKey(
+        League,
+        on_delete=models.CASCADE,
+        related_name='standings'
+    )
+    trainer = models.ForeignKey(
+        Trainer,
+        on_delete=models.CASCADE,
+        related_name='standings'
+    )
+    score = models.OneToOneField(
+        Score,
+        on_delete=models.CASCADE,
+        related_name='standing'
+    )
+    rank = models.IntegerField(default=1)
+    wins = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    badge_count = models.IntegerField(default=0)
+    win_ratio = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['league', 'rank']),
+            models.Index(fields=['league', 'trainer']),
+            models.Index(fields=['league', '-wins', 'losses', '-badge_count']),
+        ]
+
+
+class LeaderDailyStats(models.Model):
+    """
+    Defines the battles of a leader on a league in a day, rolled up from the
+    battles as they are registered. The wins and losses are the leader's.
+    """
+    league = models.ForeignKey(
+        League,
+        on_delete=models.CASCADE,
+        related_name='leader_stats'
+    )
+    leader = models.ForeignKey(
+        Leader,
+        on_delete=models.CASCADE,
+        related_name='daily_stats'
+    )
+    day = models.DateField()
+    battles = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('league', 'leader', 'day')
+
+
+class HeadToHead(models.Model):
+    """
+    Defines the record of a trainer against a leader on a league, kept up to
+    date as the battles are registered. The wins and losses are the
+    trainer's.
+    """
+    trainer = models.ForeignKey(
+        Trainer,
+        on_delete=models.CASCADE,
+        related_name='head_to_heads'
+    )
+    leader = models.ForeignKey(
+        Leader,
+        on_delete=models.CASCADE,
+        related_name='head_to_heads'
+    )
+    league = models.ForeignKey(
+        League,
+        on_delete=models.CASCADE,
+        related_name='head_to_heads'
+    )
+    battles = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    last_battle_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('trainer', 'leader', 'league')
+        # Os rivais de um treinador são paginados por keyset (ver
+        # KeysetConnectionField)
+        indexes = [
+            models.Index(fields=['trainer', 'battles', 'id']),
+            models.Index(fields=['trainer', 'last_battle_at', 'id']),
+        ]
+
+
+class PersistedQuery(models.Model):
+    """
+    Defines a GraphQL query registered on the persisted queries whitelist.
+    The clients can send only the sha256 of a registered query.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    query = models.TextField()
+    name = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class InvalidationEvent(models.Model):
+    """
+    Defines a cache invalidation broadcast by a worker after a committed
+    write. The other workers poll the events to invalidate their caches.
+    """
+    origin = models.CharField(max_length=100)
+    tags = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -0,0 +1,198 @@
+"""
+Módulo contendo o planejador das consultas das conexões raiz.
+A partir dos campos selecionados na query GraphQL, o queryset da conexão
+carrega apenas as colunas usadas pelos campos pedidos (`only`), as
+ForeignKeys selecionadas na mesma consulta (`select_related`) e os
+relacionamentos ManyToMany e reversos não paginados em uma consulta por
+relacionamento (`prefetch_related`).
+Os resolvers dos relacionamentos usam os objetos já carregados pelo plano
+(ver cached_related e prefetched) e, fora dele, os loaders.
+"""
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import ast
+from abp.connections import PAGINATION_ARGS
+from abp.models import Battle, Score, Trainer
+
+
+# Campos GraphQL resolvidos a partir de outras colunas do model
+COLUMNS = {
+    (Battle, 'winner'): ('winner_name',),
+    (Score, 'standby'): ('last_battle_lost', 'last_battle_at'),
+}
+
+# Colunas dos objetos relacionados usadas por campos que retornam escalares
+# (ex: `badges` retorna as referências das insígnias)
+RELATED_COLUMNS = {
+    (Score, 'badges'): ('reference',),
+}
+
+# Campos GraphQL de relacionamentos com outro nome no model
+RELATIONS = {
+    (Trainer, 'leagues'): 'league_competitors',
+    (Trainer, 'scores'): 'score_set',
+}
+
+
+def collect_fields(info, selection_set, fields=None):
+    """
+    Agrupa os campos de um selection set pelo nome (aliases do mesmo campo
+    são unidos), expandindo os fragmentos.
+    return : <dict> nome -> <list> de <ast.Field>
+    """
+    fields = {} if fields is None else fields
+    if selection_set is None:
+        return fields
+
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            fields.setdefault(selection.name.value, []).append(selection)
+        elif isinstance(selection, ast.FragmentSpread):
+            fragment = info.fragments[selection.name.value]
+            collect_fields(info, fragment.selection_set, fields)
+        elif isinstance(selection, ast.InlineFragment):
+            collect_fields(info, selection.selection_set, fields)
+
+    return fields
+
+
+def object_fields(info, field_asts):
+    """
+    Campos selecionados em um campo de objeto (ex: `trainer { name }`).
+    """
+    fields = {}
+    for field_ast in field_asts:
+        collect_fields(info, field_ast.selection_set, fields)
+    return fields
+
+
+def node_fields(info, field_asts):
+    """
+    Campos selecionados nos nodes de um campo de conexão
+    (ex: `trainers { edges { node { name } } }`).
+    """
+    fields = {}
+    for field_ast in field_asts:
+        for edges in collect_fields(info, field_ast.selection_set).get('edges', []):
+            for node in collect_fields(info, edges.selection_set).get('node', []):
+                collect_fields(info, node.selection_set, fields)
+    return fields
+
+
+def is_paginated_ast(field_ast):
+    return any(
+        argument.name.value in PAGINATION_ARGS
+        for argument in field_ast.arguments or []
+    )
+
+
+def get_relation(model, name):
+    """
+    Retorna o campo ou relacionamento reverso do model acessado pelo
+    atributo fornecido (ex: `score_set`), ou None.
+    """
+    for field in model._meta.get_fields():
+        reverse = field.auto_created and not field.concrete
+        if (field.get_accessor_name() if reverse else field.name) == name:
+            return field
+    return None
+
+
+def plan_model(info, model, fields, prefix=''):
+    """
+    Calcula o plano de consulta de um model para os campos selecionados.
+    return : <tuple> (colunas, select_related, prefetch_related)
+    """
+    columns = {f'{prefix}id'}
+    select_related, prefetch_related = [], []
+
+    for name, field_asts in fields.items():
+        attribute = to_snake_case(name)
+        if (model, attribute) in COLUMNS:
+            columns.update(prefix + column for column in COLUMNS[model, attribute])
+            continue
+
+        attribute = RELATIONS.get((model, attribute), attribute)
+        field = get_relation(model, attribute)
+        if field is None:
+            continue
+
+        if field.many_to_one:
+            columns.add(prefix + attribute)
+            select_related.append(prefix + attribute)
+            related = plan_model(
+                info,
+                field.related_model,
+                object_fields(info, field_asts),
+                f'{prefix}{attribute}__'
+            )
+            columns |= related[0]
+            select_related += related[1]
+            prefetch_related += related[2]
+
+        elif field.many_to_many or field.one_to_many:
+            # Páginas são consultadas pelo próprio resolver
+            if any(is_paginated_ast(field_ast) for field_ast in field_asts):
+                continue
+
+            related_fields = node_fields(info, field_asts)
+            if not related_fields:
+                related_fields = object_fields(info, field_asts)
+            # A ForeignKey dos relacionamentos reversos associa os objetos
+            extra = RELATED_COLUMNS.get((model, attribute), ())
+            if field.one_to_many:
+                extra += (field.field.name,)
+            queryset = plan_queryset(
+                info,
+                field.related_model.objects.order_by('pk'),
+                related_fields,
+                *extra
+            )
+            prefetch_related.append(Prefetch(prefix + attribute, queryset=queryset))
+
+        elif field.concrete:
+            columns.add(prefix + attribute)
+
+    return columns, select_related, prefetch_related
+
+
+def plan_queryset(info, queryset, fields, *columns):
+    planned, select_related, prefetch_related = plan_model(
+        info,
+        queryset.model,
+        fields
+    )
+    queryset = queryset.only(*planned, *columns)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+def plan(info, queryset, *columns):
+    """
+    Aplica ao queryset de uma conexão raiz o plano de consulta dos campos
+    selecionados nos nodes.
+    param : columns : colunas adicionais, ex: as colunas de ordenação usadas
+                      nos cursores
+    return : <QuerySet>
+    """
+    return plan_queryset(info, queryset, node_fields(info, info.field_asts), *columns)
+
+
+def cached_related(instance, name):
+    """
+    Retorna o objeto de uma ForeignKey já carregado (select_related), ou None.
+    """
+    return instance._meta.get_field(name).get_cached_value(instance, None)
+
+
+def prefetched(instance, name, loader):
+    """
+    Retorna os objetos de um relacionamento já carregados (prefetch_related)
+    ou, se o relacionamento não foi carregado, a promise do loader.
+    """
+    if name not in getattr(instance, '_prefetched_objects_cache', {}):
+        return loader.load(instance.pk)
+    return list(getattr(instance, name).all())
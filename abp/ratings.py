@@ -0,0 +1,188 @@
+"""
+Módulo contendo o rating Elo dos treinadores e líderes.
+Cada batalha transfere do perdedor para o vencedor K * (resultado -
+resultado esperado) pontos, onde o resultado esperado do treinador é
+1 / (1 + 10 ^ ((rating do líder - rating do treinador) / 400)). O registro
+de batalhas atualiza os ratings dos dois jogadores já travados na
+transação da batalha (ver rate_battle), sem consultas adicionais.
+O replay (ver replay) recalcula todos os ratings a partir do histórico de
+batalhas em ordem cronológica, com K e o rating inicial fornecidos, para
+que os parâmetros possam ser ajustados sem alterar os jogadores. As
+batalhas são agrupadas em níveis: o nível de uma batalha é o nível seguinte
+ao das batalhas anteriores dos dois jogadores, e as batalhas de um mesmo
+nível não compartilham jogadores. Cada nível é calculado com operações
+vetorizadas, com o mesmo resultado do cálculo batalha a batalha.
+Os ratings incrementais seguem a ordem de commit das batalhas; o replay
+segue a ordem cronológica (data e ID).
+"""
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, FloatField, Value, When
+from abp.models import Battle, Leader, Trainer
+from abp.rollups import won_by
+
+
+INITIAL_RATING = 1500
+
+# Diferença de rating na qual o favorito tem 10 vezes mais chances de vencer
+SCALE = 400
+
+# Jogadores atualizados por UPDATE na gravação do replay
+CHUNK_SIZE = 500
+
+
+def k_factor():
+    return getattr(settings, 'ABP_RATING_K', 32)
+
+
+def expected_score(rating, opponent_rating):
+    """
+    Probabilidade de vitória do jogador contra o oponente.
+    Aceita números ou arrays.
+    """
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / SCALE))
+
+
+def rate_battle(trainer, leader, trainer_won, k=None):
+    """
+    Atualiza os ratings do treinador e do líder com o resultado da batalha.
+    Os jogadores devem estar travados na transação da batalha; os ratings
+    são gravados junto com os demais campos dos jogadores.
+    param : trainer : <Trainer>
+    param : leader : <Leader>
+    param : trainer_won : <bool>
+    """
+    k = k_factor() if k is None else k
+    delta = k * (int(trainer_won) - expected_score(trainer.rating, leader.rating))
+    trainer.rating += delta
+    leader.rating -= delta
+
+
+def battle_history():
+    """
+    Lê o histórico de batalhas em ordem cronológica.
+    return : <tuple> arrays (trainer_ids, leader_ids, trainer_won)
+    """
+    rows = Battle.objects.filter(
+        trainer__isnull=False,
+        leader__isnull=False
+    ).annotate(won=won_by('trainer')).order_by('battle_datetime', 'pk').values_list(
+        'trainer_id', 'leader_id', 'won'
+    )
+    history = np.array(list(rows.iterator(chunk_size=10000)), dtype=np.int64)
+    history = history.reshape(-1, 3)
+    return history[:, 0], history[:, 1], history[:, 2].astype(bool)
+
+
+def battle_levels(trainers, leaders):
+    """
+    Calcula o nível de cada batalha: o nível seguinte ao das batalhas
+    anteriores dos dois jogadores.
+    param : trainers, leaders : <np.ndarray> índices densos dos jogadores
+    return : <np.ndarray>
+    """
+    trainer_levels = [0] * (int(trainers.max()) + 1 if len(trainers) else 0)
+    leader_levels = [0] * (int(leaders.max()) + 1 if len(leaders) else 0)
+    levels = []
+    for trainer, leader in zip(trainers.tolist(), leaders.tolist()):
+        level = max(trainer_levels[trainer], leader_levels[leader])
+        levels.append(level)
+        trainer_levels[trainer] = leader_levels[leader] = level + 1
+    return np.array(levels, dtype=np.int64)
+
+
+class Replay:
+    """
+    Resultado de um replay: os ratings finais por ID de jogador e a
+    log loss média das previsões (o resultado esperado de cada batalha
+    antes dela), usada para comparar os parâmetros.
+    """
+    def __init__(self, trainer_ids, trainer_ratings, leader_ids,
+                 leader_ratings, log_loss, battles):
+        self.trainer_ratings = dict(zip(trainer_ids.tolist(), trainer_ratings.tolist()))
+        self.leader_ratings = dict(zip(leader_ids.tolist(), leader_ratings.tolist()))
+        self.log_loss = log_loss
+        self.battles = battles
+
+
+def replay(trainers, leaders, trainer_won, k=None, initial=INITIAL_RATING):
+    """
+    Recalcula os ratings a partir das batalhas fornecidas, em ordem.
+    param : trainers, leaders : <np.ndarray> IDs dos jogadores de cada batalha
+    param : trainer_won : <np.ndarray> de bool
+    return : <Replay>
+    """
+    k = k_factor() if k is None else k
+    trainer_ids, trainer_index = np.unique(trainers, return_inverse=True)
+    leader_ids, leader_index = np.unique(leaders, return_inverse=True)
+    trainer_ratings = np.full(len(trainer_ids), initial, dtype=np.float64)
+    leader_ratings = np.full(len(leader_ids), initial, dtype=np.float64)
+    outcomes = np.asarray(trainer_won, dtype=np.float64)
+
+    levels = battle_levels(trainer_index, leader_index)
+    order = np.argsort(levels, kind='stable')
+    bounds = np.cumsum(np.bincount(levels)) if len(levels) else []
+
+    loss = 0.0
+    start = 0
+    for end in bounds:
+        battles = order[start:end]
+        start = end
+        trainer = trainer_index[battles]
+        leader = leader_index[battles]
+        outcome = outcomes[battles]
+
+        expected = expected_score(trainer_ratings[trainer], leader_ratings[leader])
+        loss -= np.log(np.where(outcome > 0, expected, 1 - expected)).sum()
+        delta = k * (outcome - expected)
+        # Um jogador aparece no máximo uma vez por nível
+        trainer_ratings[trainer] += delta
+        leader_ratings[leader] -= delta
+
+    return Replay(
+        trainer_ids,
+        trainer_ratings,
+        leader_ids,
+        leader_ratings,
+        loss / len(levels) if len(levels) else 0.0,
+        len(levels)
+    )
+
+
+def write_ratings(model, ratings, initial):
+    """
+    Grava os ratings do replay; os jogadores sem batalhas recebem o rating
+    inicial.
+    """
+    model.objects.exclude(pk__in=list(ratings)).update(rating=initial)
+    pks = list(ratings)
+    for start in range(0, len(pks), CHUNK_SIZE):
+        chunk = pks[start:start + CHUNK_SIZE]
+        model.objects.filter(pk__in=chunk).update(rating=Case(
+            *[When(pk=pk, then=Value(ratings[pk])) for pk in chunk],
+            output_field=FloatField()
+        ))
+
+
+def recompute_ratings(k=None, initial=INITIAL_RATING, write=True):
+    """
+    Recalcula os ratings de todos os jogadores a partir do histórico de
+    batalhas e, se `write` for verdadeiro, grava os ratings. Os jogadores
+    ficam travados até a gravação: as batalhas registradas durante o
+    replay aguardam o fim do recálculo.
+    return : <Replay>
+    """
+    with transaction.atomic():
+        if write and connection.features.has_select_for_update:
+            for model in (Trainer, Leader):
+                list(model.objects.select_for_update().order_by('pk').values_list(
+                    'pk', flat=True
+                ))
+
+        result = replay(*battle_history(), k=k, initial=initial)
+        if write:
+            write_ratings(Trainer, result.trainer_ratings, initial)
+            write_ratings(Leader, result.leader_ratings, initial)
+
+    return result
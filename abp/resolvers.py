@@ -1,15 +1,37 @@
 """
 Módulo contendo os métodos de resolução de objetos para as consultas GraphQL.
 """
-from datetime import datetime
-from abp.models import (Battle, League, Trainer, Score, Leader, Badge)
+from datetime import timedelta
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+from abp.models import (Battle, League, Trainer, Score, Leader, Badge,
+                        Standing, HeadToHead)
 from abp.utils import validate_global_id
 
+# Quantidade de dias que um jogador fica de molho após perder uma batalha
+STANDBY_DAYS = 3
+
+# Argumentos de paginação e ordenação das conexões relay, aplicados pela
+# própria conexão
+CONNECTION_ARGS = ('before', 'after', 'first', 'last', 'order_by')
+
+
+def pop_connection_args(kwargs):
+    """
+    Remove dos argumentos da consulta os argumentos aplicados pela conexão,
+    deixando apenas os filtros.
+    """
+    for arg in CONNECTION_ARGS:
+        kwargs.pop(arg, None)
+
+    return kwargs
+
 
 def resolve_leagues(**kwargs):
     """
     Resolve a consulta de ligas.
     """
+    pop_connection_args(kwargs)
     league_global_id = kwargs.get('id')
     if league_global_id:
         if 'id' in kwargs.keys():
@@ -23,6 +45,7 @@ def resolve_trainers(**kwargs):
     """
     Resolve a consulta de treinadores.
     """
+    pop_connection_args(kwargs)
     if 'id' in kwargs.keys():
         trainer_id = validate_global_id(kwargs.pop('id'), 'TrainerType')
         kwargs['id'] = trainer_id
@@ -34,6 +57,7 @@ def resolve_leaders(**kwargs):
     """
     Resolve a consulta de líderes.
     """
+    pop_connection_args(kwargs)
     if 'id' in kwargs.keys():
         leader_id = validate_global_id(kwargs.pop('id'), 'LeaderType')
         kwargs['id'] = leader_id
@@ -45,6 +69,7 @@ def resolve_scores(**kwargs):
     """
     Resolve a consulta de scores.
     """
+    pop_connection_args(kwargs)
     if 'league__id__in' in kwargs.keys():
         global_ids = kwargs.pop('league__id__in')
         league_ids = [validate_global_id(i, 'LeagueType') for i in global_ids]
@@ -55,13 +80,21 @@ def resolve_scores(**kwargs):
         trainer_ids = [validate_global_id(i, 'TrainerType') for i in global_ids]
         kwargs['trainer__id__in'] = trainer_ids
 
-    return Score.objects.filter(**kwargs)
+    standby = kwargs.pop('standby', None)
+    scores = Score.objects.filter(**kwargs)
+
+    if standby is None:
+        return scores
+    if standby:
+        return scores.filter(standby_filter())
+    return scores.exclude(standby_filter())
 
 
 def resolve_battles(**kwargs):
     """
     Resolve a consulta de battles.
     """
+    pop_connection_args(kwargs)
     if 'leader__id__in' in kwargs.keys():
         global_ids = kwargs.pop('leader__id__in')
         leader_ids = [validate_global_id(i, 'LeaderType') for i in global_ids]
@@ -72,23 +105,78 @@ def resolve_battles(**kwargs):
         trainer_ids = [validate_global_id(i, 'TrainerType') for i in global_ids]
         kwargs['trainer__id__in'] = trainer_ids
 
+    if 'league' in kwargs.keys():
+        kwargs['league_id'] = validate_global_id(kwargs.pop('league'), 'LeagueType')
+
     return Battle.objects.filter(**kwargs)
 
 
+def resolve_league_standings(**kwargs):
+    """
+    Resolve a consulta do ranking de uma liga, ordenado pela posição.
+    """
+    pop_connection_args(kwargs)
+    kwargs['league_id'] = validate_global_id(kwargs.pop('league'), 'LeagueType')
+
+    return Standing.objects.filter(**kwargs).order_by('rank', 'pk')
+
+
+def resolve_head_to_head(**kwargs):
+    """
+    Resolve o retrospecto de um treinador contra um líder em uma liga ou,
+    sem a liga, somado em todas as ligas.
+    return : <HeadToHead> ou None, se eles nunca batalharam
+    """
+    trainer_id = validate_global_id(kwargs['trainer'], 'TrainerType')
+    leader_id = validate_global_id(kwargs['leader'], 'LeaderType')
+    records = HeadToHead.objects.filter(trainer_id=trainer_id, leader_id=leader_id)
+    if kwargs.get('league'):
+        league_id = validate_global_id(kwargs['league'], 'LeagueType')
+        return records.filter(league_id=league_id).first()
+
+    totals = records.aggregate(
+        battles=Sum('battles'),
+        wins=Sum('wins'),
+        losses=Sum('losses'),
+        last_battle_at=Max('last_battle_at')
+    )
+    if not totals['battles']:
+        return None
+    return HeadToHead(trainer_id=trainer_id, leader_id=leader_id, **totals)
+
+
+def resolve_rivals(**kwargs):
+    """
+    Resolve os retrospectos de um treinador contra cada líder enfrentado.
+    """
+    pop_connection_args(kwargs)
+    records = HeadToHead.objects.filter(
+        trainer_id=validate_global_id(kwargs['trainer'], 'TrainerType')
+    )
+    if kwargs.get('league'):
+        records = records.filter(
+            league_id=validate_global_id(kwargs['league'], 'LeagueType')
+        )
+    return records
+
+
+def standby_filter():
+    """
+    Retorna o filtro de scores em standby, calculado no banco de dados a
+    partir dos dados da última batalha de cada score.
+    """
+    cutoff = timezone.now() - timedelta(days=STANDBY_DAYS)
+    return Q(last_battle_lost=True, last_battle_at__gt=cutoff)
+
+
 def resolve_standby(score_instance):
     """
     Um jogador ficará em standby (de molho) por 3 dias se tiver perdido a
     última batalha.
     """
-    last_battle = score_instance.battles.last()
     # Se não houver uma última batalha é porque o jogador ainda não batalhou
-    if not last_battle:
-        return False
-    if last_battle.winner_name != last_battle.trainer.discord_id:
-        now = datetime.now()
-        time_passed = now - last_battle.battle_datetime.replace(tzinfo=None)
-        if time_passed.days < 3:
-            return True
+    if not score_instance.last_battle_lost or not score_instance.last_battle_at:
         return False
 
-    return False
\ No newline at end of file
+    time_passed = timezone.now() - score_instance.last_battle_at
+    return time_passed < timedelta(days=STANDBY_DAYS)
@@ -0,0 +1,262 @@
+"""
+Módulo contendo os agregados (rollups) das batalhas, mantidos pelo registro
+de batalhas na mesma transação das batalhas (ver record_battles):
+    LeaderDailyStats: batalhas, vitórias e derrotas de um líder em uma liga
+                      em um dia (UTC), somadas pelas estatísticas por líder
+                      e por tipo de pokémon (ver leader_stats e
+                      type_matchup_stats) sem consultar as batalhas;
+    HeadToHead: retrospecto de um treinador contra um líder em uma liga.
+As batalhas removidas depois de registradas não são descontadas dos
+agregados; rebuild_leader_stats e rebuild_head_to_heads recalculam os
+agregados a partir das batalhas com uma única consulta de agregação.
+"""
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Sum, Value, When
+from django.db.models.functions import TruncDate
+from abp.models import Battle, HeadToHead, Leader, LeaderDailyStats
+
+
+# Contadores dos agregados, somados a cada registro de batalhas
+COUNTERS = ('battles', 'wins', 'losses')
+
+# Campos dos agregados, na ordem das colunas das consultas de agregação
+LEADER_STATS_FIELDS = ('league_id', 'leader_id', 'day', *COUNTERS)
+HEAD_TO_HEAD_FIELDS = ('trainer_id', 'leader_id', 'league_id', *COUNTERS,
+                       'last_battle_at')
+
+
+def save_rollups(model, key_fields, rows):
+    """
+    Soma os contadores das linhas aos agregados existentes e cria os
+    agregados novos; os demais campos substituem os valores existentes. Os
+    agregados com os mesmos valores são atualizados em um único UPDATE.
+    param : key_fields : <tuple> campos da chave única do model
+    param : rows : <dict> chave (valores de key_fields) -> <dict> de valores
+    """
+    if not rows:
+        return
+
+    existing = {
+        tuple(values[1:]): values[0]
+        for values in model.objects.filter(**{
+            f'{field}__in': {key[index] for key in rows}
+            for index, field in enumerate(key_fields)
+        }).values_list('pk', *key_fields)
+    }
+
+    updates = defaultdict(list)
+    created = []
+    for key, values in rows.items():
+        if key in existing:
+            updates[tuple(sorted(values.items()))].append(existing[key])
+        else:
+            created.append(model(**dict(zip(key_fields, key)), **values))
+
+    for values, pks in updates.items():
+        model.objects.filter(pk__in=pks).update(**{
+            field: F(field) + value if field in COUNTERS else value
+            for field, value in values
+        })
+    model.objects.bulk_create(created)
+
+
+def record_battles(battles):
+    """
+    Soma as batalhas aos agregados. Deve ser executado na transação do
+    registro das batalhas, com os líderes travados: os registros
+    concorrentes de um mesmo líder são serializados pela trava.
+    param : battles : <list> de (league_id, trainer_id, leader_id,
+                      battle_datetime, trainer_won)
+    """
+    leader_days = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    head_to_heads = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for league_id, trainer_id, leader_id, battle_datetime, trainer_won in battles:
+        if None in (league_id, trainer_id, leader_id):
+            continue
+
+        leader_day = leader_days[league_id, leader_id, battle_datetime.date()]
+        leader_day['battles'] += 1
+        leader_day['losses' if trainer_won else 'wins'] += 1
+
+        head_to_head = head_to_heads[trainer_id, leader_id, league_id]
+        head_to_head['battles'] += 1
+        head_to_head['wins' if trainer_won else 'losses'] += 1
+        head_to_head['last_battle_at'] = max(
+            head_to_head.get('last_battle_at') or battle_datetime,
+            battle_datetime
+        )
+
+    save_rollups(LeaderDailyStats, ('league_id', 'leader_id', 'day'), leader_days)
+    save_rollups(HeadToHead, ('trainer_id', 'leader_id', 'league_id'), head_to_heads)
+
+
+def won_by(player):
+    """
+    1 para as batalhas vencidas pelo jogador (trainer ou leader), senão 0.
+    """
+    return Case(
+        When(winner_name=F(f'{player}__discord_id'), then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField()
+    )
+
+
+def leader_stats_queryset(battles):
+    """
+    Consulta de agregação dos agregados diários dos líderes, com as colunas
+    na ordem de LEADER_STATS_FIELDS.
+    """
+    return battles.filter(
+        league__isnull=False,
+        leader__isnull=False
+    ).annotate(
+        day=TruncDate('battle_datetime')
+    ).values('league_id', 'leader_id', 'day').annotate(
+        battles=Count('pk'),
+        wins=Sum(won_by('leader')),
+        losses=Count('pk') - Sum(won_by('leader'))
+    ).order_by()
+
+
+def head_to_head_queryset(battles):
+    """
+    Consulta de agregação dos retrospectos, com as colunas na ordem de
+    HEAD_TO_HEAD_FIELDS.
+    """
+    return battles.filter(
+        league__isnull=False,
+        trainer__isnull=False,
+        leader__isnull=False
+    ).values('trainer_id', 'leader_id', 'league_id').annotate(
+        battles=Count('pk'),
+        wins=Sum(won_by('trainer')),
+        losses=Count('pk') - Sum(won_by('trainer')),
+        last_battle_at=Max('battle_datetime')
+    ).order_by()
+
+
+def rebuild(model, fields, aggregation, league_ids=None):
+    """
+    Recria do zero os agregados do model das ligas fornecidas (ou de todas
+    as ligas) com um INSERT ... SELECT agregando as batalhas no banco de
+    dados.
+    return : <int> quantidade de agregados
+    """
+    battles = Battle.objects.all()
+    existing = model.objects.all()
+    if league_ids is not None:
+        battles = battles.filter(league_id__in=league_ids)
+        existing = existing.filter(league_id__in=league_ids)
+
+    select, params = aggregation(battles).query.sql_with_params()
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(
+        connection.ops.quote_name(model._meta.get_field(
+            field.replace('_id', '')
+        ).column)
+        for field in fields
+    )
+
+    with transaction.atomic():
+        # O registro de batalhas trava os líderes antes de atualizar os
+        # agregados: os registros concorrentes aguardam a recriação
+        if connection.features.has_select_for_update:
+            list(Leader.objects.select_for_update().order_by('pk').values_list(
+                'pk', flat=True
+            ))
+        existing.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {table} ({columns}) {select}', params)
+            return cursor.rowcount
+
+
+def rebuild_leader_stats(league_ids=None):
+    """
+    Recria os agregados diários dos líderes, ver rebuild.
+    param : league_ids : <list> IDs numéricos das ligas
+    """
+    return rebuild(
+        LeaderDailyStats,
+        LEADER_STATS_FIELDS,
+        leader_stats_queryset,
+        league_ids
+    )
+
+
+def rebuild_head_to_heads(league_ids=None):
+    """
+    Recria os retrospectos dos treinadores contra os líderes, ver rebuild.
+    param : league_ids : <list> IDs numéricos das ligas
+    """
+    return rebuild(
+        HeadToHead,
+        HEAD_TO_HEAD_FIELDS,
+        head_to_head_queryset,
+        league_ids
+    )
+
+
+def hold_rate(wins, battles):
+    """
+    Razão das batalhas vencidas pelos líderes.
+    """
+    return wins / battles if battles else 0
+
+
+def filter_rollups(league=None, pokemon_type=None, role=None):
+    rollups = LeaderDailyStats.objects.all()
+    if league is not None:
+        rollups = rollups.filter(league_id=league)
+    if pokemon_type is not None:
+        rollups = rollups.filter(leader__pokemon_type=pokemon_type)
+    if role is not None:
+        rollups = rollups.filter(leader__role=role)
+    return rollups
+
+
+def leader_stats(league=None, pokemon_type=None, role=None):
+    """
+    Estatísticas dos líderes, somadas dos agregados diários.
+    param : league : <int> ID numérico da liga
+    return : <list> de <dict> com as chaves leader_id, battles, wins, losses
+             e hold_rate, ordenada pela hold_rate (desc) e pelas batalhas
+             (desc)
+    """
+    rows = filter_rollups(league, pokemon_type, role).values(
+        'leader_id'
+    ).annotate(
+        battles=Sum('battles'),
+        wins=Sum('wins'),
+        losses=Sum('losses')
+    ).order_by('leader_id')
+
+    stats = [
+        {**row, 'hold_rate': hold_rate(row['wins'], row['battles'])}
+        for row in rows
+    ]
+    stats.sort(key=lambda row: (-row['hold_rate'], -row['battles'], row['leader_id']))
+    return stats
+
+
+def type_matchup_stats(league=None):
+    """
+    Estatísticas das batalhas contra os líderes de cada tipo de pokémon.
+    return : <list> de <dict> com as chaves pokemon_type, leaders, battles,
+             wins, losses e hold_rate, ordenada pela hold_rate (desc)
+    """
+    rows = filter_rollups(league).values(
+        pokemon_type=F('leader__pokemon_type')
+    ).annotate(
+        leaders=Count('leader_id', distinct=True),
+        battles=Sum('battles'),
+        wins=Sum('wins'),
+        losses=Sum('losses')
+    ).order_by('pokemon_type')
+
+    stats = [
+        {**row, 'hold_rate': hold_rate(row['wins'], row['battles'])}
+        for row in rows
+    ]
+    stats.sort(key=lambda row: (-row['hold_rate'], row['pokemon_type']))
+    return stats
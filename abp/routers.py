@@ -0,0 +1,95 @@
+"""
+Módulo contendo o roteamento das leituras para as réplicas do banco de dados.
+O ABPGraphQLView executa as queries GraphQL lendo de uma das réplicas
+definidas em ABP_READ_REPLICAS (ver reading_from); as mutações, as escritas
+e as leituras feitas dentro de transações usam sempre o banco principal.
+Após uma mutação, o cliente recebe um cookie que mantém as suas leituras no
+banco principal por ABP_REPLICA_STICKY_SECONDS segundos, para que ele leia
+as próprias escritas mesmo com o atraso da replicação.
+"""
+import random
+import threading
+from contextlib import contextmanager
+from math import ceil
+from time import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+STICKY_COOKIE = 'abp_primary_until'
+
+local = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'ABP_READ_REPLICAS', [])
+
+
+def sticky_seconds():
+    return getattr(settings, 'ABP_REPLICA_STICKY_SECONDS', 5)
+
+
+def choose_replica():
+    """
+    Retorna o alias de uma das réplicas, ou None se não houver réplicas.
+    """
+    aliases = replicas()
+    return random.choice(aliases) if aliases else None
+
+
+@contextmanager
+def reading_from(alias):
+    """
+    Direciona as leituras da thread atual para o alias fornecido (ou para o
+    banco principal, se None) até o fim do bloco.
+    """
+    previous = getattr(local, 'alias', None)
+    local.alias = alias
+    try:
+        yield
+    finally:
+        local.alias = previous
+
+
+class ReplicaRouter:
+    """
+    Router das leituras para a réplica escolhida pela requisição.
+    """
+    def db_for_read(self, model, **hints):
+        alias = getattr(local, 'alias', None)
+        # Uma transação do banco principal lê os próprios dados
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # As réplicas contêm os mesmos dados do banco principal
+        return True
+
+
+def is_sticky(request):
+    """
+    Verifica se as leituras do cliente devem usar o banco principal.
+    """
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time()
+    except ValueError:
+        return False
+
+
+def stick_to_primary(response):
+    """
+    Mantém as leituras do cliente no banco principal pelos próximos
+    ABP_REPLICA_STICKY_SECONDS segundos.
+    """
+    seconds = sticky_seconds()
+    response.set_cookie(
+        STICKY_COOKIE,
+        str(time() + seconds),
+        max_age=ceil(seconds),
+        httponly=True
+    )
+    return response
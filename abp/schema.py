@@ -1,10 +1,21 @@
-from math import ceil
 import graphene
-from abp.models import (Battle, League, Trainer, Score, Leader, Badge)
+from graphene.utils.thenables import maybe_thenable
+from abp.models import (Battle, League, Trainer, Score, Leader, Badge, Standing)
 from graphql_relay import from_global_id
 from abp.resolvers import (resolve_leagues, resolve_trainers, resolve_leaders,
-                           resolve_scores, resolve_battles, resolve_standby)
-from abp.utils import get_exp, lv_update
+                           resolve_scores, resolve_battles, resolve_standby,
+                           resolve_league_standings, resolve_head_to_head,
+                           resolve_rivals)
+from abp.loaders import get_loaders
+from abp.battles import register_battle, register_battles
+from abp.cache import invalidate
+from abp.connections import (QuerySetConnectionField, KeysetConnectionField,
+                             CountableConnection, is_paginated)
+from abp.planner import plan, cached_related, prefetched
+from abp.rollups import leader_stats, type_matchup_stats
+from abp.search import search_players
+from abp.standings import create_standing, update_standing, delete_trainer
+from abp.utils import validate_global_id
 from bill.settings.common import __version__
 
 
@@ -47,6 +58,39 @@ class Role(graphene.Enum):
     CHAMPION = 'Champion'
 
 
+class IdOrdering(graphene.Enum):
+    """
+    Ordering by creation (ID).
+    """
+    ID_ASC = 'id'
+    ID_DESC = '-id'
+
+
+class BattleOrdering(graphene.Enum):
+    """
+    Battles ordering by date. Battles at the same date are ordered by ID.
+    """
+    DATETIME_ASC = 'battle_datetime'
+    DATETIME_DESC = '-battle_datetime'
+
+
+class RivalOrdering(graphene.Enum):
+    """
+    Rivals ordering by number of battles or by the last battle. Ties are
+    ordered by ID.
+    """
+    BATTLES_DESC = '-battles'
+    LAST_BATTLE_DESC = '-last_battle_at'
+
+
+class RatingOrdering(graphene.Enum):
+    """
+    Leaderboard ordering by rating. Ties are ordered by ID.
+    """
+    RATING_DESC = '-rating'
+    RATING_ASC = 'rating'
+
+
 #######################################################
 #                  GraphQL Types
 #######################################################
@@ -59,26 +103,44 @@ class LeagueType(graphene.ObjectType):
     start_date = graphene.Date()
     end_date = graphene.Date()
     description = graphene.String()
-    gym_leaders = graphene.relay.ConnectionField('abp.schema.LeaderConnection')
-    elite_four = graphene.relay.ConnectionField('abp.schema.LeaderConnection')
+    gym_leaders = QuerySetConnectionField('abp.schema.LeaderConnection')
+    elite_four = QuerySetConnectionField('abp.schema.LeaderConnection')
     champion = graphene.Field('abp.schema.LeaderType')
-    competitors = graphene.relay.ConnectionField('abp.schema.TrainerConnection')
+    competitors = QuerySetConnectionField('abp.schema.TrainerConnection')
     winner = graphene.Field('abp.schema.TrainerType')
 
+    # Páginas são consultadas diretamente no banco; sem paginação, os
+    # relacionamentos de todas as ligas são carregados juntos pelos loaders
     def resolve_gym_leaders(self, info, **kwargs):
-        return [leader for leader in self.gym_leaders.all()]
+        if is_paginated(kwargs):
+            return self.gym_leaders.order_by('pk')
+        return prefetched(self, 'gym_leaders', get_loaders(info).league_gym_leaders)
 
     def resolve_elite_four(self, info, **kwargs):
-        return [elite for elite in self.elite_four.all()]
+        if is_paginated(kwargs):
+            return self.elite_four.order_by('pk')
+        return prefetched(self, 'elite_four', get_loaders(info).league_elite_four)
 
     def resolve_champion(self, info, **kwargs):
-        return self.champion
+        if self.champion_id is None:
+            return None
+        return (
+            cached_related(self, 'champion') or
+            get_loaders(info).leader.load(self.champion_id)
+        )
 
     def resolve_competitors(self, info, **kwargs):
-        return [trainer for trainer in self.competitors.all()]
+        if is_paginated(kwargs):
+            return self.competitors.order_by('pk')
+        return prefetched(self, 'competitors', get_loaders(info).league_competitors)
 
     def resolve_winner(self, info, **kwargs):
-        return self.winner
+        if self.winner_id is None:
+            return None
+        return (
+            cached_related(self, 'winner') or
+            get_loaders(info).trainer.load(self.winner_id)
+        )
 
     class Meta:
         interfaces = (graphene.relay.Node,)
@@ -102,6 +164,7 @@ class LeaderType(graphene.ObjectType):
     sd_id = graphene.String()
     exp = graphene.Int()
     discord_id = graphene.String()
+    rating = graphene.Float()
 
     class Meta:
         interfaces = (graphene.relay.Node,)
@@ -118,20 +181,25 @@ class TrainerType(graphene.ObjectType):
     leagues_counter = graphene.Int()
     win_percentage = graphene.Float()
     loose_percentage = graphene.Float()
-    leagues = graphene.relay.ConnectionField('abp.schema.LeagueConnection')
-    scores = graphene.relay.ConnectionField('abp.schema.ScoreConnection')
+    leagues = QuerySetConnectionField('abp.schema.LeagueConnection')
+    scores = QuerySetConnectionField('abp.schema.ScoreConnection')
     lv = graphene.Int()
     next_lv = graphene.Int()
     fc = graphene.String()
     sd_id = graphene.String()
     exp = graphene.Int()
     discord_id = graphene.String()
+    rating = graphene.Float()
 
     def resolve_scores(self, info, **kwargs):
-        return [score for score in self.score_set.all()]
+        if is_paginated(kwargs):
+            return self.score_set.order_by('pk')
+        return prefetched(self, 'score_set', get_loaders(info).trainer_scores)
 
     def resolve_leagues(self, info, **kwargs):
-        return [league for league in self.league_competitors.all()]
+        if is_paginated(kwargs):
+            return self.league_competitors.order_by('pk')
+        return prefetched(self, 'league_competitors', get_loaders(info).trainer_leagues)
 
     class Meta:
         interfaces = (graphene.relay.Node,)
@@ -150,16 +218,29 @@ class ScoreType(graphene.ObjectType):
     standby = graphene.Boolean()
 
     def resolve_league(self, info, **kwargs):
-        return self.league
+        if self.league_id is None:
+            return None
+        return (
+            cached_related(self, 'league') or
+            get_loaders(info).league.load(self.league_id)
+        )
 
     def resolve_trainer(self, info, **kwargs):
-        return self.trainer
+        if self.trainer_id is None:
+            return None
+        return (
+            cached_related(self, 'trainer') or
+            get_loaders(info).trainer.load(self.trainer_id)
+        )
 
     def resolve_battles(self, info, **kwargs):
-        return self.battles.all()
+        return prefetched(self, 'battles', get_loaders(info).score_battles)
 
     def resolve_badges(self, info, **kwargs):
-        return [badge.reference for badge in self.badges.all()]
+        return maybe_thenable(
+            prefetched(self, 'badges', get_loaders(info).score_badges),
+            lambda badges: [badge.reference for badge in badges]
+        )
 
     def resolve_standby(self, info, **kwargs):
         return resolve_standby(self)
@@ -181,43 +262,171 @@ class BattleType(graphene.ObjectType):
         return self.winner_name
 
     def resolve_trainer(self, info, **kwargs):
-        return self.trainer
+        if self.trainer_id is None:
+            return None
+        return (
+            cached_related(self, 'trainer') or
+            get_loaders(info).trainer.load(self.trainer_id)
+        )
 
     def resolve_leader(self, info, **kwargs):
-        return self.leader
+        if self.leader_id is None:
+            return None
+        return (
+            cached_related(self, 'leader') or
+            get_loaders(info).leader.load(self.leader_id)
+        )
 
     class Meta:
         interfaces = (graphene.relay.Node,)
 
 
+class PlayerType(graphene.Union):
+    """
+    A trainer or a leader.
+    """
+    class Meta:
+        types = (TrainerType, LeaderType)
+
+    @classmethod
+    def resolve_type(cls, instance, info):
+        if isinstance(instance, Trainer):
+            return TrainerType
+        return LeaderType
+
+
+class PlayerSearchResult(graphene.ObjectType):
+    """
+    Defines a player found by the search, with the similarity between its
+    name or discord id and the searched text.
+    """
+    player = graphene.Field(PlayerType)
+    similarity = graphene.Float()
+
+
+class StandingType(graphene.ObjectType):
+    """
+    Defines a GraphQL serializer object for the league standings.
+    """
+    rank = graphene.Int()
+    league = graphene.Field(LeagueType)
+    trainer = graphene.Field(TrainerType)
+    wins = graphene.Int()
+    losses = graphene.Int()
+    badge_count = graphene.Int()
+    win_ratio = graphene.Float()
+
+    def resolve_league(self, info, **kwargs):
+        return get_loaders(info).league.load(self.league_id)
+
+    def resolve_trainer(self, info, **kwargs):
+        return get_loaders(info).trainer.load(self.trainer_id)
+
+    class Meta:
+        interfaces = (graphene.relay.Node,)
+
+
+class LeaderStatsType(graphene.ObjectType):
+    """
+    Defines the battles of a leader, summed from the daily leader stats.
+    The hold rate is the ratio of the battles won by the leader.
+    """
+    leader = graphene.Field(LeaderType)
+    battles = graphene.Int()
+    wins = graphene.Int()
+    losses = graphene.Int()
+    hold_rate = graphene.Float()
+
+    def resolve_leader(self, info, **kwargs):
+        return get_loaders(info).leader.load(self['leader_id'])
+
+
+class TypeMatchupStatsType(graphene.ObjectType):
+    """
+    Defines the battles against the leaders of a pokemon type, summed from
+    the daily leader stats.
+    """
+    pokemon_type = PokemonTypes()
+    leaders = graphene.Int(description='Leaders of the type that battled.')
+    battles = graphene.Int()
+    wins = graphene.Int(description='Battles won by the leaders.')
+    losses = graphene.Int(description='Battles lost by the leaders.')
+    hold_rate = graphene.Float()
+
+
+class HeadToHeadType(graphene.ObjectType):
+    """
+    Defines the record of a trainer against a leader. The wins and losses
+    are the trainer's. The league is null on the records summed over all
+    leagues.
+    """
+    trainer = graphene.Field(TrainerType)
+    leader = graphene.Field(LeaderType)
+    league = graphene.Field(LeagueType)
+    battles = graphene.Int()
+    wins = graphene.Int()
+    losses = graphene.Int()
+    last_battle_at = graphene.DateTime()
+
+    def resolve_trainer(self, info, **kwargs):
+        return (
+            cached_related(self, 'trainer') or
+            get_loaders(info).trainer.load(self.trainer_id)
+        )
+
+    def resolve_leader(self, info, **kwargs):
+        return (
+            cached_related(self, 'leader') or
+            get_loaders(info).leader.load(self.leader_id)
+        )
+
+    def resolve_league(self, info, **kwargs):
+        if self.league_id is None:
+            return None
+        return (
+            cached_related(self, 'league') or
+            get_loaders(info).league.load(self.league_id)
+        )
+
+
 #######################################################
 #                  Relay Connections
 #######################################################
-class LeagueConnection(graphene.relay.Connection):
+class LeagueConnection(CountableConnection):
     class Meta:
         node = LeagueType
 
 
-class TrainerConnection(graphene.relay.Connection):
+class TrainerConnection(CountableConnection):
     class Meta:
         node = TrainerType
 
 
-class LeaderConnection(graphene.relay.Connection):
+class LeaderConnection(CountableConnection):
     class Meta:
         node = LeaderType
 
 
-class ScoreConnection(graphene.relay.Connection):
+class ScoreConnection(CountableConnection):
     class Meta:
         node = ScoreType
 
 
-class BattleConnection(graphene.relay.Connection):
+class BattleConnection(CountableConnection):
     class Meta:
         node = BattleType
 
 
+class HeadToHeadConnection(CountableConnection):
+    class Meta:
+        node = HeadToHeadType
+
+
+class StandingConnection(CountableConnection):
+    class Meta:
+        node = StandingType
+
+
 #######################################################
 #                  GraphQL Query
 #######################################################
@@ -240,13 +449,14 @@ class Query(object):
         ),
     )
     def resolve_leagues(self, info, **kwargs):
-        return resolve_leagues(**kwargs)
+        return plan(info, resolve_leagues(**kwargs))
 
     ###################################################
     #                       Trainers
     ###################################################
-    trainers = graphene.relay.ConnectionField(
+    trainers = KeysetConnectionField(
         TrainerConnection,
+        order_by=IdOrdering(default_value='id'),
         id=graphene.ID(description='Filters by trainer ID.'),
         name__icontains=graphene.String(
             description='Filters by trainer name containing the given string.'
@@ -286,13 +496,14 @@ class Query(object):
         ),
     )
     def resolve_trainers(self, info, **kwargs):
-        return resolve_trainers(**kwargs)
+        return plan(info, resolve_trainers(**kwargs), kwargs['order_by'].lstrip('-'))
 
     ###################################################
     #                       Leaders
     ###################################################
-    leaders = graphene.relay.ConnectionField(
+    leaders = KeysetConnectionField(
         LeaderConnection,
+        order_by=IdOrdering(default_value='id'),
         id=graphene.ID(description='Filters by leader ID.'),
         name__icontains=graphene.String(
             description='Filters by leader name containing the given string.'
@@ -320,7 +531,7 @@ class Query(object):
         ),
     )
     def resolve_leaders(self, info, **kwargs):
-        return resolve_leaders(**kwargs)
+        return plan(info, resolve_leaders(**kwargs), kwargs['order_by'].lstrip('-'))
 
     ###################################################
     #                       Scores
@@ -337,16 +548,20 @@ class Query(object):
         ),
         trainer__discord_id=graphene.String(
             description='Filter scores by trainer discord id'
+        ),
+        standby=graphene.Boolean(
+            description='Filter scores by its trainer standby status'
         )
     )
     def resolve_scores(self, info, **kwargs):
-        return resolve_scores(**kwargs)
+        return plan(info, resolve_scores(**kwargs))
 
     ###################################################
     #                       Battles
     ###################################################
-    battles = graphene.relay.ConnectionField(
+    battles = KeysetConnectionField(
         BattleConnection,
+        order_by=BattleOrdering(default_value='battle_datetime'),
         trainer__id__in=graphene.List(
             graphene.ID,
             description='Battles from given trainer'
@@ -354,10 +569,117 @@ class Query(object):
         leader__id__in=graphene.List(
             graphene.ID,
             description='Battles from given leader'
-        )
+        ),
+        league=graphene.ID(description='Battles from the given league.')
     )
     def resolve_battles(self, info, **kwargs):
-        return resolve_battles(**kwargs)
+        return plan(info, resolve_battles(**kwargs), kwargs['order_by'].lstrip('-'))
+
+    ###################################################
+    #                       Standings
+    ###################################################
+    league_standings = QuerySetConnectionField(
+        StandingConnection,
+        league=graphene.ID(
+            required=True,
+            description='League of the standings.'
+        ),
+        trainer__discord_id=graphene.String(
+            description='Returns only the standing of the given trainer.'
+        ),
+    )
+    def resolve_league_standings(self, info, **kwargs):
+        return resolve_league_standings(**kwargs)
+
+    ###################################################
+    #                       Head to head
+    ###################################################
+    head_to_head = graphene.Field(
+        HeadToHeadType,
+        trainer=graphene.ID(required=True),
+        leader=graphene.ID(required=True),
+        league=graphene.ID(
+            description='Record on the league. Defaults to all leagues.'
+        ),
+        description='Record of a trainer against a leader, null if they never battled.'
+    )
+    def resolve_head_to_head(self, info, **kwargs):
+        return resolve_head_to_head(**kwargs)
+
+    rivals = KeysetConnectionField(
+        HeadToHeadConnection,
+        order_by=RivalOrdering(default_value='-battles'),
+        trainer=graphene.ID(required=True),
+        league=graphene.ID(description='Records on the given league.'),
+        description='Records of a trainer against each leader they battled, by league.'
+    )
+    def resolve_rivals(self, info, **kwargs):
+        return plan(info, resolve_rivals(**kwargs), kwargs['order_by'].lstrip('-'))
+
+    ###################################################
+    #                       Leaderboards
+    ###################################################
+    trainer_leaderboard = KeysetConnectionField(
+        TrainerConnection,
+        order_by=RatingOrdering(default_value='-rating'),
+        description='Trainers ordered by rating.'
+    )
+    def resolve_trainer_leaderboard(self, info, **kwargs):
+        return plan(info, Trainer.objects.all(), kwargs['order_by'].lstrip('-'))
+
+    leader_leaderboard = KeysetConnectionField(
+        LeaderConnection,
+        order_by=RatingOrdering(default_value='-rating'),
+        description='Leaders ordered by rating.'
+    )
+    def resolve_leader_leaderboard(self, info, **kwargs):
+        return plan(info, Leader.objects.all(), kwargs['order_by'].lstrip('-'))
+
+    ###################################################
+    #                       Leader stats
+    ###################################################
+    leader_stats = graphene.List(
+        LeaderStatsType,
+        league=graphene.ID(description='Counts only the battles of the league.'),
+        pokemon_type=PokemonTypes(),
+        role=Role(),
+        description='Leaders ordered by hold rate and battles.'
+    )
+    def resolve_leader_stats(self, info, **kwargs):
+        if 'league' in kwargs:
+            kwargs['league'] = validate_global_id(kwargs['league'], 'LeagueType')
+        return leader_stats(**kwargs)
+
+    type_matchup_stats = graphene.List(
+        TypeMatchupStatsType,
+        league=graphene.ID(description='Counts only the battles of the league.'),
+        description='Leader pokemon types ordered by hold rate.'
+    )
+    def resolve_type_matchup_stats(self, info, **kwargs):
+        if 'league' in kwargs:
+            kwargs['league'] = validate_global_id(kwargs['league'], 'LeagueType')
+        return type_matchup_stats(**kwargs)
+
+    ###################################################
+    #                       Search
+    ###################################################
+    search_players = graphene.List(
+        PlayerSearchResult,
+        text=graphene.String(
+            required=True,
+            description='Text searched in the players name and discord id.'
+        ),
+        first=graphene.Int(
+            default_value=10,
+            description='Maximum number of players returned.'
+        ),
+        description='Trainers and leaders ordered by similarity to the text.'
+    )
+    def resolve_search_players(self, info, **kwargs):
+        return [
+            PlayerSearchResult(player=player, similarity=similarity)
+            for player, similarity in search_players(kwargs['text'], kwargs['first'])
+        ]
 
     ###################################################
     #                       Badges
@@ -408,6 +730,7 @@ class CreateLeague(graphene.relay.ClientIDMutation):
             raise Exception(ex)
 
         league.save()
+        invalidate('league')
         return CreateLeague(league)
 
 
@@ -433,6 +756,7 @@ class CreateTrainer(graphene.relay.ClientIDMutation):
             raise Exception(ex)
 
         trainer.save()
+        invalidate('trainer')
         return CreateTrainer(trainer)
 
 
@@ -464,6 +788,7 @@ class CreateLeader(graphene.relay.ClientIDMutation):
             raise Exception(ex)
 
         leader.save()
+        invalidate('leader')
         return CreateLeader(leader)
 
 
@@ -516,6 +841,7 @@ class UpdateLeague(graphene.relay.ClientIDMutation):
         if description:
             league.description = description
         league.save()
+        invalidate('league')
 
         return UpdateLeague(league)
 
@@ -559,6 +885,7 @@ class UpdateTrainer(graphene.relay.ClientIDMutation):
             trainer.sd_id = sd_id
 
         trainer.save()
+        invalidate('trainer')
         return UpdateTrainer(trainer)
 
 
@@ -612,6 +939,7 @@ class UpdateLeader(graphene.relay.ClientIDMutation):
             leader.clauses = clauses
 
         leader.save()
+        invalidate('leader')
         return UpdateLeader(leader)
 
 
@@ -649,6 +977,8 @@ class DeleteLeague(graphene.relay.ClientIDMutation):
             )
 
         league.delete()
+        # Os scores e standings da liga são removidos em cascata
+        invalidate('league', 'score', 'standing')
 
         return DeleteLeague(league)
 
@@ -683,7 +1013,11 @@ class DeleteTrainer(graphene.relay.ClientIDMutation):
                 'Sorry, the given trainer does not exist!'
             )
 
-        trainer.delete()
+        # Os standings atrás do treinador sobem uma posição
+        delete_trainer(trainer)
+        # Remove em cascata os scores, batalhas e ligas vencidas pelo treinador
+        invalidate('trainer', 'league', 'score', 'battle', 'standing')
+
         return DeleteTrainer(trainer)
 
 
@@ -711,6 +1045,8 @@ class DeleteLeader(graphene.relay.ClientIDMutation):
             raise Exception('Sorry, this leader does not exist.')
 
         leader.delete()
+        # Remove em cascata as batalhas e ligas em que o líder é o campeão
+        invalidate('leader', 'league', 'battle')
         return DeleteLeader(leader)
 
 
@@ -776,6 +1112,8 @@ class LeagueRegistration(graphene.relay.ClientIDMutation):
                 league=league
             )
             score.save()
+            create_standing(score)
+            invalidate('league', 'trainer', 'score', 'standing')
 
         else:
             # Verifica se o lider existe no banco de dados
@@ -815,6 +1153,7 @@ class LeagueRegistration(graphene.relay.ClientIDMutation):
                     'This leader has no role yet. Please give him a role before' \
                     'registering at this league!'
                 )
+            invalidate('league')
 
         return LeagueRegistration(
             f'registration at {league.reference} complete!'
@@ -874,67 +1213,57 @@ class BattleRegister(graphene.relay.ClientIDMutation):
         if not winner == trainer.discord_id and not winner == leader.discord_id:
             raise Exception('The winner must be the given leader or trainer.')
 
-        # Verifica se o treinador está de molho
-        if resolve_standby(trainer_score):
-            raise Exception(
-                'This trainer is in standby in this league and cant battle.'
-            )
-
-        # Registra a batalha
-        battle = Battle.objects.create(
-            leader=leader,
-            trainer=trainer,
-            winner_name=winner
+        # Registra a batalha e atualiza os stats dos lutadores e do score
+        battle = register_battle(trainer_score, trainer, leader, winner)
+        invalidate(
+            'battle', 'score', 'trainer', 'leader', 'standing',
+            'leaderdailystats', 'headtohead'
         )
-        battle.save()
 
-        # Relaciona a batalha criada ao score do treinador
-        trainer_score.battles.add(battle)
+        return BattleRegister(battle)
 
-        # incrementa o contrador de batalhas dos lutadores
-        trainer.battle_counter += 1
-        leader.battle_counter += 1
 
-        # calcula o total de experência que a batalha fornecerá
-        exp = get_exp(trainer.lv, leader.lv)
+class BattleRecordInput(graphene.InputObjectType):
+    """
+    A battle between a trainer and a leader to be registered.
+    """
+    league = graphene.ID(required=True)
+    trainer = graphene.String(required=True)
+    leader = graphene.String(required=True)
+    winner = graphene.String(required=True)
 
-        # Se o vencedor for o treinador
-        if winner == trainer_discord:
-            # Atualiza os stats dos lutadores e do score
-            trainer.total_wins += 1
-            trainer_score.wins += 1
-            leader.total_losses += 1
 
-            # Adiciona experiência e recalcula o Lv
-            trainer.exp += exp
-            leader.exp += ceil(exp/4)
-            lv_update(trainer)
-            lv_update(leader)
+class BattleRegisterBatch(graphene.relay.ClientIDMutation):
+    """
+    Register, in the given order, a list of battles between trainers and
+    leaders. If any battle is invalid none of them is registered.
+    """
+    battles = graphene.List(BattleType)
 
-        # Se o vencedor for o lider
-        else:
-            # Atualiza os stats dos lutadores e do score
-            trainer.total_losses += 1
-            trainer_score.losses += 1
-            leader.total_wins += 1
-
-            # Adiciona experiência e recalcula o Lv
-            trainer.exp += ceil(exp/4)
-            leader.exp += exp
-            lv_update(trainer)
-            lv_update(leader)
-
-        # Atualiza a porcentagem de vitorias/derrotas dos lutadores
-        trainer.win_percentage = (trainer.total_wins / trainer.battle_counter) * 100
-        trainer.loose_percentage = (trainer.total_losses / trainer.battle_counter) * 100
-        leader.win_percentage = (leader.total_wins / leader.battle_counter) * 100
-        leader.loose_percentage = (leader.total_losses / leader.battle_counter) * 100
+    class Input:
+        battles = graphene.List(
+            graphene.NonNull(BattleRecordInput),
+            required=True
+        )
 
-        trainer.save()
-        leader.save()
-        trainer_score.save()
+    def mutate_and_get_payload(self, info, **_input):
+        records = [
+            (
+                validate_global_id(record.league, 'LeagueType'),
+                record.trainer,
+                record.leader,
+                record.winner
+            )
+            for record in _input.get('battles')
+        ]
 
-        return BattleRegister(battle)
+        battles = register_battles(records)
+        invalidate(
+            'battle', 'score', 'trainer', 'leader', 'standing',
+            'leaderdailystats', 'headtohead'
+        )
+
+        return BattleRegisterBatch(battles)
 
 
 class AddBadgeToTrainer(graphene.relay.ClientIDMutation):
@@ -993,6 +1322,8 @@ class AddBadgeToTrainer(graphene.relay.ClientIDMutation):
 
         trainer_score.save()
         trainer.save()
+        update_standing(trainer_score, badges=1)
+        invalidate('score', 'trainer', 'standing')
 
         return AddBadgeToTrainer(
             f'{discord_id} received {badge_reference} badge!'
@@ -1020,6 +1351,7 @@ class AutoCreateBadges(graphene.relay.ClientIDMutation):
             except:
                 pass
 
+        invalidate('badge')
         return AutoCreateBadges(badges_created)
 
 
@@ -1045,5 +1377,6 @@ class Mutation:
     # Other
     league_registration = LeagueRegistration.Field()
     battle_register = BattleRegister.Field()
+    battle_register_batch = BattleRegisterBatch.Field()
     add_badge_to_trainer = AddBadgeToTrainer.Field()
     auto_create_badges = AutoCreateBadges.Field()
@@ -0,0 +1,272 @@
+"""
+Módulo contendo a busca de jogadores (treinadores e líderes) por nome e
+discord id, ordenada pela similaridade de trigramas com o texto buscado.
+No PostgreSQL a busca usa a extensão pg_trgm e os índices GIN de trigramas
+(ver a migração 0008), que atendem o operador de similaridade e o ILIKE
+sobre as colunas (ver TrigramContains). Nos demais bancos de dados a busca usa um índice de
+trigramas mantido no processo: o índice é carregado na primeira busca e
+atualizado pelos signals dos models após o commit; as alterações dos nomes
+e discord ids feitas por outros workers (a tag PLAYER_NAMES, ver abp.bus)
+descartam o índice, que é recarregado na busca seguinte. As demais escritas
+dos jogadores (ex: contadores e exp das batalhas) não alteram o índice.
+Os trigramas seguem a pg_trgm: cada palavra (letras e números) é
+convertida para minúsculas e completada com dois espaços no início e um no
+fim, e a similaridade é a razão entre os trigramas em comum e o total de
+trigramas dos dois textos.
+"""
+import re
+import threading
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import CharField, Lookup, Q
+from django.db.models.signals import post_save, post_delete
+from abp.bus import publish, subscribe
+from abp.models import Trainer, Leader
+
+
+# Similaridade mínima dos resultados (o padrão da pg_trgm). Jogadores que
+# contêm o texto buscado são retornados mesmo com similaridade menor.
+SIMILARITY_THRESHOLD = 0.3
+
+# Quantidade máxima de resultados de uma busca
+MAX_RESULTS = 100
+
+# Models pesquisados, com os campos de texto de cada um
+PLAYER_MODELS = {
+    'trainer': Trainer,
+    'leader': Leader,
+}
+SEARCH_FIELDS = ('name', 'discord_id')
+
+# Tag publicada no barramento quando os textos pesquisados são alterados
+PLAYER_NAMES = 'playernames'
+
+WORD = re.compile(r'[^\W_]+')
+
+
+def trigrams(text):
+    """
+    Retorna os trigramas de um texto.
+    return : <frozenset>
+    """
+    grams = set()
+    for word in WORD.findall((text or '').lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def similarity(first, second):
+    """
+    Similaridade entre dois conjuntos de trigramas, entre 0 e 1.
+    """
+    if not first or not second:
+        return 0
+    common = len(first & second)
+    return common / (len(first) + len(second) - common)
+
+
+class TrigramIndex:
+    """
+    Índice invertido de trigramas dos jogadores: trigrama -> chaves
+    (`kind`, pk) dos jogadores cujos textos contêm o trigrama.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.postings = defaultdict(set)
+        self.documents = {}
+
+    def load(self):
+        with self.lock:
+            self.clear()
+            for kind, model in PLAYER_MODELS.items():
+                for pk, *texts in model.objects.values_list('pk', *SEARCH_FIELDS):
+                    self.add((kind, pk), texts)
+            self.loaded = True
+
+    def clear(self):
+        with self.lock:
+            self.loaded = False
+            self.postings.clear()
+            self.documents.clear()
+
+    def add(self, key, texts):
+        with self.lock:
+            self.remove(key)
+            texts = [text.lower() for text in texts if text]
+            grams = [trigrams(text) for text in texts]
+            self.documents[key] = (texts, grams)
+            for gram in frozenset().union(*grams):
+                self.postings[gram].add(key)
+
+    def remove(self, key):
+        with self.lock:
+            document = self.documents.pop(key, None)
+            if document is None:
+                return
+            for gram in frozenset().union(*document[1]):
+                self.postings[gram].discard(key)
+                if not self.postings[gram]:
+                    del self.postings[gram]
+
+    def search(self, text, limit):
+        """
+        Retorna as chaves dos jogadores mais similares ao texto.
+        return : <list> de (chave, similaridade)
+        """
+        needle = text.lower()
+        query = trigrams(text)
+        with self.lock:
+            if not self.loaded:
+                self.load()
+
+            if len(needle) < 3:
+                # Textos curtos podem estar contidos em palavras sem
+                # compartilhar trigramas (ex: `s` em `ash`)
+                candidates = set(self.documents)
+            else:
+                candidates = set().union(
+                    *(self.postings.get(gram, ()) for gram in query)
+                )
+
+            results = []
+            for key in candidates:
+                texts, grams = self.documents[key]
+                score = max((similarity(query, g) for g in grams), default=0)
+                if score >= SIMILARITY_THRESHOLD or any(needle in t for t in texts):
+                    results.append((key, score))
+
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results[:limit]
+
+
+# Índice do processo
+player_index = TrigramIndex()
+
+
+def index_player(sender, instance, created=False, update_fields=None, **kwargs):
+    # Salvamentos que não alteram os textos (ex: os contadores das batalhas)
+    if not (created or update_fields is None or set(update_fields) & set(SEARCH_FIELDS)):
+        return
+
+    kind = sender._meta.model_name
+    texts = [getattr(instance, field) for field in SEARCH_FIELDS]
+
+    def update():
+        # Um índice ainda não carregado lerá o jogador do banco de dados
+        if player_index.loaded:
+            player_index.add((kind, instance.pk), texts)
+
+    transaction.on_commit(update)
+    publish(PLAYER_NAMES)
+
+
+def unindex_player(sender, instance, **kwargs):
+    key = (sender._meta.model_name, instance.pk)
+    transaction.on_commit(lambda: player_index.remove(key))
+    publish(PLAYER_NAMES)
+
+
+for model in PLAYER_MODELS.values():
+    post_save.connect(index_player, sender=model)
+    post_delete.connect(unindex_player, sender=model)
+
+
+@subscribe
+def forget_players(tags, local):
+    """
+    Descarta o índice quando outro worker altera os textos dos jogadores.
+    """
+    if not local and PLAYER_NAMES in tags:
+        player_index.clear()
+
+
+def search_index(text, first):
+    """
+    Busca no índice do processo.
+    return : <list> de (jogador, similaridade)
+    """
+    results = player_index.search(text, first)
+    players = {
+        kind: model.objects.in_bulk(
+            [pk for (result_kind, pk), _ in results if result_kind == kind]
+        )
+        for kind, model in PLAYER_MODELS.items()
+    }
+    return [
+        (players[kind][pk], score)
+        for (kind, pk), score in results
+        if pk in players[kind]
+    ]
+
+
+class TrigramContains(Lookup):
+    """
+    `coluna ILIKE '%texto%'`, sobre a coluna sem conversões: o icontains do
+    Django no PostgreSQL compara UPPER(coluna::text), expressão que os
+    índices GIN de trigramas das colunas não atendem.
+    """
+    lookup_name = 'trigram_contains'
+
+    def get_db_prep_lookup(self, value, connection):
+        return '%s', [f'%{connection.ops.prep_for_like_query(value)}%']
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', lhs_params + rhs_params
+
+
+CharField.register_lookup(TrigramContains)
+
+
+def database_condition(text):
+    """
+    Filtro dos jogadores similares ao texto ou que contêm o texto.
+    """
+    condition = Q()
+    for field in SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__trigram_similar': text})
+        condition |= Q(**{f'{field}__trigram_contains': text})
+    return condition
+
+
+def search_database(text, first):
+    """
+    Busca com a pg_trgm: o operador de similaridade e o ILIKE usam os
+    índices GIN de trigramas das colunas.
+    return : <list> de (jogador, similaridade)
+    """
+    from django.contrib.postgres.search import TrigramSimilarity
+    from django.db.models.functions import Greatest
+
+    results = []
+    condition = database_condition(text)
+    for model in PLAYER_MODELS.values():
+        players = model.objects.annotate(
+            similarity=Greatest(*[
+                TrigramSimilarity(field, text) for field in SEARCH_FIELDS
+            ])
+        ).filter(condition).order_by('-similarity', 'pk')[:first]
+        results += [(player, player.similarity or 0) for player in players]
+
+    results.sort(key=lambda result: -result[1])
+    return results[:first]
+
+
+def search_players(text, first=10):
+    """
+    Busca treinadores e líderes pelo nome ou discord id.
+    return : <list> de (jogador, similaridade), do mais similar ao menos
+    """
+    if first < 1:
+        raise Exception('The page size must be a positive number.')
+    first = min(first, MAX_RESULTS)
+    text = text.strip()
+    if not text:
+        return []
+
+    if connection.vendor == 'postgresql':
+        return search_database(text, first)
+    return search_index(text, first)
@@ -0,0 +1,231 @@
+"""
+Módulo contendo a manutenção dos rankings (standings) das ligas.
+Os treinadores são ordenados por vitórias (desc), derrotas (asc) e
+insígnias (desc); treinadores empatados dividem a mesma posição.
+O rank de cada standing é mantido incrementalmente: quando a chave de um
+treinador muda, apenas os standings entre a posição antiga e a nova são
+deslocados, com um único UPDATE.
+"""
+from itertools import groupby
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from abp.models import League, Score, Standing, Trainer
+
+
+def rank_key(wins, losses, badge_count):
+    """
+    Chave de ordenação do ranking: chaves menores estão à frente.
+    """
+    return (-wins, losses, -badge_count)
+
+
+def better_than(wins, losses, badge_count):
+    """
+    Filtro dos standings estritamente à frente da chave fornecida.
+    """
+    return (
+        Q(wins__gt=wins) |
+        Q(wins=wins, losses__lt=losses) |
+        Q(wins=wins, losses=losses, badge_count__gt=badge_count)
+    )
+
+
+def worse_than(wins, losses, badge_count):
+    """
+    Filtro dos standings estritamente atrás da chave fornecida.
+    """
+    return (
+        Q(wins__lt=wins) |
+        Q(wins=wins, losses__gt=losses) |
+        Q(wins=wins, losses=losses, badge_count__lt=badge_count)
+    )
+
+
+def win_ratio(wins, losses):
+    """
+    Retorna a razão de vitórias sobre o total de batalhas.
+    """
+    if not wins + losses:
+        return 0
+    return wins / (wins + losses)
+
+
+def lock_league(league_id):
+    """
+    Trava a liga até o fim da transação, serializando as atualizações do
+    ranking da liga.
+    """
+    leagues = League.objects.filter(pk=league_id)
+    if connection.features.has_select_for_update:
+        list(leagues.select_for_update().values_list('pk', flat=True))
+    else:
+        # No sqlite a trava é obtida com uma escrita
+        leagues.update(reference=F('reference'))
+
+
+def create_standing(score, badge_count=0):
+    """
+    Cria o standing de um score, deslocando os standings que ficam atrás dele.
+    param : score : <Score>
+    return : <Standing>
+    """
+    key = (score.wins, score.losses, badge_count)
+    with transaction.atomic():
+        lock_league(score.league_id)
+        standings = Standing.objects.filter(league_id=score.league_id)
+        standings.filter(worse_than(*key)).update(rank=F('rank') + 1)
+
+        return Standing.objects.create(
+            league_id=score.league_id,
+            trainer_id=score.trainer_id,
+            score=score,
+            wins=score.wins,
+            losses=score.losses,
+            badge_count=badge_count,
+            win_ratio=win_ratio(score.wins, score.losses),
+            rank=standings.filter(better_than(*key)).count() + 1,
+        )
+
+
+def move_standing(standing, wins, losses, badge_count):
+    """
+    Atualiza a chave de um standing e o rank dos standings afetados.
+    Deve ser executado com a liga travada (ver lock_league).
+    """
+    old_key = (standing.wins, standing.losses, standing.badge_count)
+    new_key = (wins, losses, badge_count)
+    if old_key == new_key:
+        return standing
+
+    others = Standing.objects.filter(
+        league_id=standing.league_id
+    ).exclude(pk=standing.pk)
+
+    # Os standings ultrapassados pelo treinador perdem uma posição; os que
+    # passam a ficar à frente dele ganham uma posição
+    if rank_key(*new_key) < rank_key(*old_key):
+        others.filter(worse_than(*new_key)).exclude(
+            worse_than(*old_key)
+        ).update(rank=F('rank') + 1)
+    else:
+        others.filter(worse_than(*old_key)).exclude(
+            worse_than(*new_key)
+        ).update(rank=F('rank') - 1)
+
+    standing.wins, standing.losses, standing.badge_count = new_key
+    standing.win_ratio = win_ratio(wins, losses)
+    standing.rank = others.filter(better_than(*new_key)).count() + 1
+    standing.save(update_fields=[
+        'wins', 'losses', 'badge_count', 'win_ratio', 'rank'
+    ])
+
+    return standing
+
+
+def update_standing(score, badges=0):
+    """
+    Atualiza o standing do score com as vitórias e derrotas atuais do score,
+    somando `badges` novas insígnias.
+    param : score : <Score>
+    param : badges : <int>
+    return : <Standing>
+    """
+    with transaction.atomic():
+        lock_league(score.league_id)
+        try:
+            standing = Standing.objects.get(score=score)
+        except Standing.DoesNotExist:
+            return create_standing(score, score.badges.count())
+
+        return move_standing(
+            standing,
+            score.wins,
+            score.losses,
+            standing.badge_count + badges
+        )
+
+
+def remove_standing(standing):
+    """
+    Desloca os standings que estavam atrás de um standing já removido.
+    """
+    Standing.objects.filter(league_id=standing.league_id).filter(
+        worse_than(standing.wins, standing.losses, standing.badge_count)
+    ).update(rank=F('rank') - 1)
+
+
+def delete_trainer(trainer):
+    """
+    Remove o treinador e desloca os standings que estavam atrás dos dele.
+    As linhas são travadas na ordem do registro de batalhas (os scores, o
+    treinador e então as ligas, por ordem de pk), e os standings são lidos
+    após as travas das ligas.
+    param : trainer : <Trainer>
+    """
+    with transaction.atomic():
+        if connection.features.has_select_for_update:
+            for model, rows in ((Score, Score.objects.filter(trainer=trainer)),
+                                (Trainer, Trainer.objects.filter(pk=trainer.pk))):
+                list(rows.select_for_update().order_by('pk').values_list(
+                    'pk', flat=True
+                ))
+
+        league_ids = Standing.objects.filter(trainer=trainer).values_list(
+            'league_id', flat=True
+        )
+        for league_id in sorted(set(league_ids)):
+            lock_league(league_id)
+
+        standings = list(Standing.objects.filter(trainer=trainer))
+        trainer.delete()
+        for standing in standings:
+            remove_standing(standing)
+
+
+def rebuild_standings(league_ids=None):
+    """
+    Recria do zero os standings das ligas fornecidas (ou de todas as ligas)
+    a partir dos scores.
+    param : league_ids : <list> IDs numéricos das ligas
+    return : <int> quantidade de standings
+    """
+    scores = Score.objects.filter(
+        league__isnull=False,
+        trainer__isnull=False
+    ).annotate(badge_total=Count('badges'))
+    existing = Standing.objects.all()
+    if league_ids is not None:
+        scores = scores.filter(league_id__in=league_ids)
+        existing = existing.filter(league_id__in=league_ids)
+
+    with transaction.atomic():
+        standings = [
+            Standing(
+                league_id=score.league_id,
+                trainer_id=score.trainer_id,
+                score=score,
+                wins=score.wins,
+                losses=score.losses,
+                badge_count=score.badge_total,
+                win_ratio=win_ratio(score.wins, score.losses),
+            )
+            for score in scores.order_by('league_id', 'pk')
+        ]
+
+        # Ranking por liga, com posições compartilhadas entre empatados
+        for _, league_standings in groupby(standings, lambda s: s.league_id):
+            ordered = sorted(
+                league_standings,
+                key=lambda s: rank_key(s.wins, s.losses, s.badge_count)
+            )
+            previous_key = None
+            for position, standing in enumerate(ordered, start=1):
+                key = rank_key(standing.wins, standing.losses, standing.badge_count)
+                if key != previous_key:
+                    rank, previous_key = position, key
+                standing.rank = rank
+
+        existing.delete()
+        Standing.objects.bulk_create(standings)
+
+    return len(standings)
@@ -1,3 +1,2142 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import random
+import os
+import tempfile
+import numpy as np
+from io import StringIO
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql.execution import execute
+from graphql.utils.introspection_query import introspection_query
+from graphql.validation import validate
+from graphql_relay import to_global_id
+from graphql_relay.connection.arrayconnection import offset_to_cursor
+from graphql_relay.utils import base64
+from prometheus_client import REGISTRY
+from bill.schema import schema
+from abp.battles import BattleRecord, register_battle, register_battles
+from abp.utils import next_lv, level_for_exp
+from abp.standings import lock_league, rebuild_standings
+from abp.rollups import rebuild_head_to_heads, rebuild_leader_stats
+from abp import bus, routers
+from abp.instrumentation import OperationStats, QueryRecorder, operation_stats
+from abp.metrics import operation_labels
+from abp.analytics import Snapshot, snapshot_battles
+from abp.exports import Export
+from abp.ratings import battle_history, expected_score, replay
+from abp.search import (PLAYER_NAMES, database_condition, player_index,
+                        similarity, trigrams)
+from abp.documents import document_backend, query_hash, registered_queries
+from abp.models import (League, Trainer, Leader, Score, Battle, Badge, Standing,
+                        InvalidationEvent, LeaderDailyStats, HeadToHead)
 
-# Create your tests here.
+
+def create_leagues(total):
+    """
+    Creates `total` leagues, each one with its own leaders and competitors.
+    """
+    for i in range(total):
+        league = League.objects.create(reference=f'league {i}')
+        league.gym_leaders.add(
+            Leader.objects.create(discord_id=f'gym {i}', role='Gym Leader'),
+        )
+        league.elite_four.add(
+            Leader.objects.create(discord_id=f'elite {i}', role='Elite Four'),
+        )
+        league.competitors.add(
+            Trainer.objects.create(discord_id=f'trainer {i}'),
+            Trainer.objects.create(discord_id=f'rookie {i}'),
+        )
+        league.champion = Leader.objects.create(
+            discord_id=f'champion {i}',
+            role='Champion'
+        )
+        league.winner = Trainer.objects.create(discord_id=f'winner {i}')
+        league.save()
+
+
+def run_commit_hooks():
+    """
+    Runs the on_commit callbacks: TestCase never commits its transactions.
+    """
+    hooks, connection.run_on_commit = connection.run_on_commit, []
+    for hook in hooks:
+        hook[1]()
+
+
+class GraphQLTestCase(TestCase):
+    """
+    Base test case posting operations to the GraphQL endpoint.
+    """
+    def execute(self, query, variables=None):
+        response = self.client.post(
+            '/graphql/',
+            json.dumps({'query': query, 'variables': variables}),
+            content_type='application/json'
+        )
+        result = response.json()
+        self.assertNotIn('errors', result, result.get('errors'))
+        return result['data']
+
+
+class LeagueLoadersTest(GraphQLTestCase):
+    query = '''
+        query {
+            leagues {
+                edges {
+                    node {
+                        reference
+                        gymLeaders { edges { node { discordId } } }
+                        eliteFour { edges { node { discordId } } }
+                        competitors { edges { node { discordId } } }
+                        champion { discordId }
+                        winner { discordId }
+                    }
+                }
+            }
+        }
+    '''
+
+    def test_league_relations_are_batched(self):
+        # ligas com champion e winner, gymLeaders, eliteFour e competitors
+        create_leagues(2)
+        with self.assertNumQueries(4):
+            self.execute(self.query)
+
+        for i in range(5):
+            League.objects.create(reference=f'extra {i}')
+        with self.assertNumQueries(4):
+            data = self.execute(self.query)
+
+        leagues = {
+            edge['node']['reference']: edge['node']
+            for edge in data['leagues']['edges']
+        }
+        league = leagues['league 1']
+        self.assertEqual(league['champion'], {'discordId': 'champion 1'})
+        self.assertEqual(league['winner'], {'discordId': 'winner 1'})
+        self.assertEqual(
+            [e['node']['discordId'] for e in league['competitors']['edges']],
+            ['trainer 1', 'rookie 1']
+        )
+        self.assertEqual(
+            [e['node']['discordId'] for e in league['gymLeaders']['edges']],
+            ['gym 1']
+        )
+        self.assertIsNone(leagues['extra 0']['champion'])
+        self.assertEqual(leagues['extra 0']['competitors']['edges'], [])
+
+
+class ScoreLoadersTest(GraphQLTestCase):
+    query = '''
+        query {
+            scores {
+                edges {
+                    node {
+                        league { reference }
+                        trainer { discordId }
+                        badges
+                        battles {
+                            edges {
+                                node {
+                                    winner
+                                    trainer { discordId }
+                                    leader { discordId }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    '''
+
+    def create_scores(self, total):
+        league = League.objects.create(reference=f'season {total}')
+        leader = Leader.objects.create(
+            discord_id=f'leader {total}',
+            role='Gym Leader'
+        )
+        badge = Badge.objects.create(reference=f'Badge {total}')
+        for i in range(total):
+            trainer = Trainer.objects.create(discord_id=f'trainer {total}-{i}')
+            score = Score.objects.create(league=league, trainer=trainer)
+            score.badges.add(badge)
+            Battle.objects.create(
+                trainer=trainer,
+                leader=leader,
+                league=league,
+                score=score,
+                winner_name=trainer.discord_id
+            )
+
+    def test_scoreboard_is_batched(self):
+        # scores com league e trainer, badges e battles com trainer e leader
+        self.create_scores(2)
+        with self.assertNumQueries(3):
+            self.execute(self.query)
+
+        self.create_scores(10)
+        with self.assertNumQueries(3):
+            data = self.execute(self.query)
+
+        node = data['scores']['edges'][-1]['node']
+        self.assertEqual(node['league'], {'reference': 'season 10'})
+        self.assertEqual(node['trainer'], {'discordId': 'trainer 10-9'})
+        self.assertEqual(node['badges'], ['Badge 10'])
+        battle = node['battles']['edges'][0]['node']
+        self.assertEqual(battle['winner'], 'trainer 10-9')
+        self.assertEqual(battle['leader'], {'discordId': 'leader 10'})
+
+
+class StandbyTest(GraphQLTestCase):
+    register = '''
+        mutation($league: ID!, $trainer: String!, $leader: String!, $winner: String!) {
+            battleRegister(input: {
+                league: $league, trainer: $trainer, leader: $leader, winner: $winner
+            }) {
+                battle { winner }
+            }
+        }
+    '''
+    scores = '''
+        query($standby: Boolean) {
+            scores(standby: $standby) {
+                edges { node { trainer { discordId } standby } }
+            }
+        }
+    '''
+
+    def setUp(self):
+        self.league = League.objects.create(reference='standby league')
+        self.leader = Leader.objects.create(discord_id='brock', role='Gym Leader')
+        for discord_id in ('ash', 'misty'):
+            Score.objects.create(
+                league=self.league,
+                trainer=Trainer.objects.create(discord_id=discord_id)
+            )
+
+    def battle(self, trainer, winner):
+        return self.execute(self.register, {
+            'league': to_global_id('LeagueType', self.league.id),
+            'trainer': trainer,
+            'leader': 'brock',
+            'winner': winner,
+        })
+
+    def standby_trainers(self, standby):
+        data = self.execute(self.scores, {'standby': standby})
+        return [
+            edge['node']['trainer']['discordId']
+            for edge in data['scores']['edges']
+        ]
+
+    def test_trainer_who_lost_is_in_standby(self):
+        self.battle('ash', 'ash')
+        self.battle('misty', 'brock')
+
+        self.assertEqual(self.standby_trainers(True), ['misty'])
+        self.assertEqual(self.standby_trainers(False), ['ash'])
+
+        response = self.client.post(
+            '/graphql/',
+            json.dumps({'query': self.register, 'variables': {
+                'league': to_global_id('LeagueType', self.league.id),
+                'trainer': 'misty',
+                'leader': 'brock',
+                'winner': 'misty',
+            }}),
+            content_type='application/json'
+        )
+        self.assertIn('standby', response.json()['errors'][0]['message'])
+
+    def test_standby_expires(self):
+        self.battle('misty', 'brock')
+        Score.objects.filter(trainer__discord_id='misty').update(
+            last_battle_at=timezone.now() - timedelta(days=3, seconds=1)
+        )
+        self.assertEqual(self.standby_trainers(True), [])
+
+        with self.assertNumQueries(1):
+            data = self.execute(self.scores, {'standby': None})
+        self.assertFalse(any(
+            edge['node']['standby'] for edge in data['scores']['edges']
+        ))
+
+
+class ConcurrentBattleRegisterTest(TransactionTestCase):
+    register = StandbyTest.register
+    trainers = 20
+    battles_per_trainer = 10
+
+    def setUp(self):
+        self.league = League.objects.create(reference='concurrent league')
+        Leader.objects.create(discord_id='brock', role='Gym Leader')
+        for i in range(self.trainers):
+            Score.objects.create(
+                league=self.league,
+                trainer=Trainer.objects.create(discord_id=f'trainer {i}')
+            )
+
+    def report(self, discord_id):
+        try:
+            return schema.execute(self.register, variables={
+                'league': to_global_id('LeagueType', self.league.id),
+                'trainer': discord_id,
+                'leader': 'brock',
+                'winner': discord_id,
+            })
+        finally:
+            connection.close()
+
+    def test_concurrent_reports_keep_exact_counters(self):
+        reports = [
+            f'trainer {i}'
+            for _ in range(self.battles_per_trainer)
+            for i in range(self.trainers)
+        ]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(self.report, reports))
+
+        self.assertEqual([r.errors for r in results if r.errors], [])
+        total = len(reports)
+        self.assertEqual(Battle.objects.count(), total)
+
+        leader = Leader.objects.get(discord_id='brock')
+        self.assertEqual(leader.battle_counter, total)
+        self.assertEqual(leader.total_losses, total)
+        self.assertEqual(leader.total_wins, 0)
+        self.assertEqual(leader.loose_percentage, 100)
+        self.assertGreater(leader.exp, 0)
+        self.assertLess(leader.exp, leader.next_lv)
+
+        for score in Score.objects.select_related('trainer'):
+            self.assertEqual(score.wins, self.battles_per_trainer)
+            self.assertEqual(score.battles.count(), self.battles_per_trainer)
+            trainer = score.trainer
+            self.assertEqual(trainer.battle_counter, self.battles_per_trainer)
+            self.assertEqual(trainer.total_wins, self.battles_per_trainer)
+            self.assertEqual(trainer.win_percentage, 100)
+            self.assertLess(trainer.exp, trainer.next_lv)
+
+
+class BattleRegisterBatchTest(GraphQLTestCase):
+    batch = '''
+        mutation($battles: [BattleRecordInput!]!) {
+            battleRegisterBatch(input: {battles: $battles}) {
+                battles { winner trainer { discordId } }
+            }
+        }
+    '''
+
+    def setUp(self):
+        self.league = League.objects.create(reference='batch league')
+        self.global_id = to_global_id('LeagueType', self.league.id)
+        for discord_id in ('brock', 'misty'):
+            Leader.objects.create(discord_id=discord_id, role='Gym Leader')
+        for discord_id in ('ash', 'gary', 'may'):
+            Score.objects.create(
+                league=self.league,
+                trainer=Trainer.objects.create(discord_id=discord_id)
+            )
+
+    def record(self, trainer, leader, winner):
+        return {
+            'league': self.global_id,
+            'trainer': trainer,
+            'leader': leader,
+            'winner': winner,
+        }
+
+    def players(self):
+        fields = (
+            'discord_id', 'lv', 'exp', 'next_lv', 'battle_counter',
+            'total_wins', 'total_losses', 'win_percentage', 'loose_percentage'
+        )
+        return (
+            list(Trainer.objects.order_by('pk').values_list(*fields)),
+            list(Leader.objects.order_by('pk').values_list(*fields)),
+            list(Score.objects.order_by('pk').values_list(
+                'wins', 'losses', 'last_battle_lost'
+            )),
+        )
+
+    def test_batch_matches_sequential_registration(self):
+        records = [
+            ('ash', 'brock', 'ash'),
+            ('gary', 'brock', 'gary'),
+            ('ash', 'misty', 'ash'),
+            ('may', 'misty', 'misty'),
+            ('ash', 'brock', 'ash'),
+            ('gary', 'misty', 'misty'),
+        ]
+        for trainer, leader, winner in records:
+            register_battle(
+                Score.objects.get(trainer__discord_id=trainer),
+                Trainer.objects.get(discord_id=trainer),
+                Leader.objects.get(discord_id=leader),
+                winner
+            )
+        expected = self.players()
+
+        Battle.objects.all().delete()
+        Trainer.objects.update(
+            lv=1, exp=0, next_lv=5, battle_counter=0, total_wins=0,
+            total_losses=0, win_percentage=0, loose_percentage=0
+        )
+        Leader.objects.update(
+            lv=1, exp=0, next_lv=5, battle_counter=0, total_wins=0,
+            total_losses=0, win_percentage=0, loose_percentage=0
+        )
+        Score.objects.update(
+            wins=0, losses=0, last_battle_at=None, last_battle_lost=False
+        )
+
+        data = self.execute(self.batch, {
+            'battles': [self.record(*record) for record in records]
+        })
+
+        self.assertEqual(self.players(), expected)
+        self.assertEqual(
+            [b['winner'] for b in data['battleRegisterBatch']['battles']],
+            [winner for _, _, winner in records]
+        )
+        ash = Score.objects.get(trainer__discord_id='ash')
+        self.assertEqual(
+            list(ash.battles.values_list('leader__discord_id', flat=True)),
+            ['brock', 'misty', 'brock']
+        )
+        self.assertEqual(
+            ash.last_battle_at,
+            ash.battles.order_by('pk').last().battle_datetime
+        )
+
+    def test_battle_ids_are_read_back_without_returning_inserts(self):
+        register_battle(
+            Score.objects.get(trainer__discord_id='ash'),
+            Trainer.objects.get(discord_id='ash'),
+            Leader.objects.get(discord_id='brock'),
+            'ash'
+        )
+        with mock.patch.object(connection.features, 'can_return_ids_from_bulk_insert', False), \
+                mock.patch.object(connection, 'vendor', 'mysql'):
+            battles = register_battles([
+                (self.league.id, 'gary', 'misty', 'gary'),
+                (self.league.id, 'ash', 'misty', 'ash'),
+                (self.league.id, 'may', 'brock', 'may'),
+            ])
+
+        self.assertEqual(
+            [(b.trainer.discord_id, b.leader.discord_id) for b in battles],
+            [
+                Battle.objects.filter(pk=b.pk).values_list(
+                    'trainer__discord_id', 'leader__discord_id'
+                ).get()
+                for b in battles
+            ]
+        )
+        self.assertEqual(len({b.pk for b in battles}), 3)
+
+    def test_standby_is_honoured_in_battle_order(self):
+        with self.assertRaisesMessage(Exception, 'battle 2: This trainer is in standby'):
+            register_battles([
+                (self.league.id, 'ash', 'brock', 'ash'),
+                (self.league.id, 'ash', 'misty', 'misty'),
+                (self.league.id, 'ash', 'brock', 'ash'),
+            ])
+
+        self.assertEqual(Battle.objects.count(), 0)
+        self.assertEqual(Trainer.objects.get(discord_id='ash').battle_counter, 0)
+
+    def test_invalid_records_register_nothing(self):
+        with self.assertRaisesMessage(Exception, 'battle 1: The winner must be'):
+            register_battles([
+                (self.league.id, 'ash', 'brock', 'ash'),
+                (self.league.id, 'gary', 'brock', 'may'),
+            ])
+        self.assertEqual(Battle.objects.count(), 0)
+
+    def test_import_battles_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as csv_file:
+            csv_file.write('league,trainer,leader,winner\n')
+            for trainer in ('ash', 'gary', 'may'):
+                csv_file.write(f'{self.global_id},{trainer},brock,{trainer}\n')
+            csv_file.flush()
+            call_command(
+                'import_battles', csv_file.name, batch_size=2, stdout=StringIO()
+            )
+
+        self.assertEqual(Leader.objects.get(discord_id='brock').total_losses, 3)
+        self.assertEqual(Score.objects.filter(wins=1).count(), 3)
+
+
+class LevelTest(TestCase):
+    def legacy_lv(self, exp):
+        lv, lv_exp = 1, 5
+        while exp >= lv_exp:
+            lv += 1
+            lv_exp = next_lv(lv)
+        return lv
+
+    def test_level_for_exp_matches_level_loop(self):
+        for exp in list(range(0, 3000)) + [10 ** 6, 10 ** 9, 2 ** 31 - 1]:
+            self.assertEqual(level_for_exp(exp), self.legacy_lv(exp), exp)
+
+    def test_recompute_levels_command(self):
+        Trainer.objects.create(discord_id='ash', exp=4, lv=3, next_lv=22)
+        Trainer.objects.create(discord_id='gary', exp=5000)
+        Leader.objects.create(discord_id='brock', role='Gym Leader', exp=7)
+
+        call_command('recompute_levels', stdout=StringIO())
+
+        for player in (*Trainer.objects.all(), *Leader.objects.all()):
+            self.assertEqual(player.lv, self.legacy_lv(player.exp))
+            self.assertEqual(
+                player.next_lv,
+                5 if player.lv == 1 else next_lv(player.lv)
+            )
+
+
+class StandingsTest(GraphQLTestCase):
+    registration = '''
+        mutation($discordId: ID!, $league: ID!) {
+            leagueRegistration(input: {
+                discordId: $discordId, league: $league, isTrainer: true
+            }) {
+                registration
+            }
+        }
+    '''
+    add_badge = '''
+        mutation($discordId: String!, $badge: String!, $league: ID!) {
+            addBadgeToTrainer(input: {
+                discordId: $discordId, badge: $badge, league: $league
+            }) {
+                response
+            }
+        }
+    '''
+    delete_trainer = '''
+        mutation($id: ID!) {
+            deleteTrainer(input: {id: $id}) { trainer { discordId } }
+        }
+    '''
+    standings = '''
+        query($league: ID!, $first: Int, $trainer: String) {
+            leagueStandings(
+                league: $league, first: $first, trainer_DiscordId: $trainer
+            ) {
+                edges { node { rank wins losses badgeCount trainer { discordId } } }
+            }
+        }
+    '''
+
+    def setUp(self):
+        self.league = League.objects.create(reference='ranked league')
+        self.global_id = to_global_id('LeagueType', self.league.id)
+        Leader.objects.create(discord_id='brock', role='Gym Leader')
+        for badge in ('Rock', 'Water', 'Thunder'):
+            Badge.objects.create(reference=badge)
+
+    def ranks(self):
+        return dict(
+            Standing.objects.filter(league=self.league)
+            .values_list('trainer__discord_id', 'rank')
+        )
+
+    def test_trainer_deletion_is_atomic_and_locks_the_league(self):
+        for trainer in ('ash', 'misty'):
+            Trainer.objects.create(discord_id=trainer)
+            self.execute(self.registration, {
+                'discordId': trainer,
+                'league': self.global_id,
+            })
+        ash = Trainer.objects.get(discord_id='ash')
+        register_battle(
+            Score.objects.get(trainer=ash),
+            ash,
+            Leader.objects.get(discord_id='brock'),
+            'ash'
+        )
+        variables = {'id': to_global_id('TrainerType', ash.pk)}
+
+        with mock.patch('abp.standings.remove_standing', side_effect=Exception('failed')):
+            response = self.client.post('/graphql/', json.dumps({
+                'query': self.delete_trainer,
+                'variables': variables
+            }), content_type='application/json')
+        self.assertEqual(response.json()['errors'][0]['message'], 'failed')
+        self.assertTrue(Trainer.objects.filter(pk=ash.pk).exists())
+        self.assertEqual(self.ranks(), {'ash': 1, 'misty': 2})
+
+        with mock.patch('abp.standings.lock_league', wraps=lock_league) as lock:
+            self.execute(self.delete_trainer, variables)
+        lock.assert_called_once_with(self.league.pk)
+        self.assertEqual(self.ranks(), {'misty': 1})
+
+    def test_incremental_ranks_match_a_full_rebuild(self):
+        rng = random.Random(7)
+        trainers = [f'trainer {i}' for i in range(12)]
+        for trainer in trainers:
+            Trainer.objects.create(discord_id=trainer)
+            self.execute(self.registration, {
+                'discordId': trainer,
+                'league': self.global_id,
+            })
+
+        for step in range(80):
+            trainer = rng.choice(trainers)
+            score = Score.objects.get(trainer__discord_id=trainer)
+            action = rng.random()
+            if action < 0.1:
+                badge = rng.choice(['Rock', 'Water', 'Thunder'])
+                if not score.badges.filter(reference=badge).exists():
+                    self.execute(self.add_badge, {
+                        'discordId': trainer,
+                        'badge': badge,
+                        'league': self.global_id,
+                    })
+            elif action < 0.13 and len(trainers) > 4:
+                trainers.remove(trainer)
+                self.execute(self.delete_trainer, {
+                    'id': to_global_id('TrainerType', score.trainer_id)
+                })
+            else:
+                # Evita o standby para manter o sorteio simples
+                Score.objects.filter(pk=score.pk).update(last_battle_lost=False)
+                register_battle(
+                    Score.objects.get(pk=score.pk),
+                    Trainer.objects.get(discord_id=trainer),
+                    Leader.objects.get(discord_id='brock'),
+                    rng.choice([trainer, 'brock'])
+                )
+
+            incremental = self.ranks()
+            rebuild_standings([self.league.id])
+            self.assertEqual(incremental, self.ranks(), f'step {step}')
+
+    def test_top_n_and_trainer_rank(self):
+        for i, (wins, losses) in enumerate([(3, 0), (5, 1), (3, 0), (0, 2)]):
+            score = Score.objects.create(
+                league=self.league,
+                trainer=Trainer.objects.create(discord_id=f'trainer {i}'),
+                wins=wins,
+                losses=losses
+            )
+        rebuild_standings()
+
+        with self.assertNumQueries(3):
+            data = self.execute(self.standings, {
+                'league': self.global_id,
+                'first': 3,
+            })
+        nodes = [edge['node'] for edge in data['leagueStandings']['edges']]
+        self.assertEqual(
+            [(n['rank'], n['trainer']['discordId']) for n in nodes],
+            [(1, 'trainer 1'), (2, 'trainer 0'), (2, 'trainer 2')]
+        )
+
+        data = self.execute(self.standings, {
+            'league': self.global_id,
+            'trainer': 'trainer 3',
+        })
+        node = data['leagueStandings']['edges'][0]['node']
+        self.assertEqual((node['rank'], node['losses']), (4, 2))
+
+
+class KeysetPaginationTest(GraphQLTestCase):
+    battles = '''
+        query($first: Int, $after: String, $last: Int, $before: String,
+              $orderBy: BattleOrdering) {
+            battles(first: $first, after: $after, last: $last, before: $before,
+                    orderBy: $orderBy) {
+                pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+                edges { node { winner } }
+            }
+        }
+    '''
+
+    def setUp(self):
+        self.trainer = Trainer.objects.create(discord_id='ash')
+        self.leader = Leader.objects.create(discord_id='brock', role='Gym Leader')
+        self.start = timezone.now() - timedelta(days=1)
+        for i in range(10):
+            self.create_battle(f'battle {i}', self.start + timedelta(minutes=i // 2))
+
+    def create_battle(self, name, battle_datetime):
+        battle = Battle.objects.create(
+            trainer=self.trainer,
+            leader=self.leader,
+            winner_name=name
+        )
+        Battle.objects.filter(pk=battle.pk).update(battle_datetime=battle_datetime)
+
+    def page(self, **variables):
+        data = self.execute(self.battles, variables)['battles']
+        return [edge['node']['winner'] for edge in data['edges']], data['pageInfo']
+
+    def test_forward_pages_are_stable_under_inserts(self):
+        seen = []
+        names, page_info = self.page(first=3)
+        seen += names
+        while page_info['hasNextPage']:
+            # Batalhas novas entram sempre depois das já existentes
+            self.create_battle(f'new {len(seen)}', timezone.now())
+            with self.assertNumQueries(1):
+                names, page_info = self.page(first=3, after=page_info['endCursor'])
+            seen += names
+
+        expected = [f'battle {i}' for i in range(10)]
+        self.assertEqual(seen[:10], expected)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), Battle.objects.count())
+
+    def test_descending_and_backward_pages(self):
+        names, page_info = self.page(first=4, orderBy='DATETIME_DESC')
+        self.assertEqual(names, ['battle 9', 'battle 8', 'battle 7', 'battle 6'])
+
+        names, page_info = self.page(
+            last=2,
+            before=page_info['endCursor'],
+            orderBy='DATETIME_DESC'
+        )
+        self.assertEqual(names, ['battle 8', 'battle 7'])
+        self.assertTrue(page_info['hasPreviousPage'])
+        self.assertTrue(page_info['hasNextPage'])
+
+        names, page_info = self.page(last=3)
+        self.assertEqual(names, ['battle 7', 'battle 8', 'battle 9'])
+        self.assertFalse(page_info['hasNextPage'])
+
+    def test_foreign_cursors_are_rejected(self):
+        position = json.dumps([self.start.isoformat(), 1])
+        for cursor in (offset_to_cursor(3), base64(f'offset:{position}')):
+            response = self.client.post('/graphql/', json.dumps({
+                'query': self.battles,
+                'variables': {'first': 2, 'after': cursor}
+            }), content_type='application/json')
+            self.assertEqual(response.json()['errors'][0]['message'], 'Invalid cursor.')
+
+    def test_trainers_and_leagues_accept_pagination_arguments(self):
+        for i in range(3):
+            Trainer.objects.create(discord_id=f'trainer {i}')
+            League.objects.create(reference=f'league {i}')
+
+        data = self.execute('''
+            query {
+                trainers(first: 2, orderBy: ID_DESC) { edges { node { discordId } } }
+                leagues(first: 2) { edges { node { reference } } }
+            }
+        ''')
+        self.assertEqual(
+            [e['node']['discordId'] for e in data['trainers']['edges']],
+            ['trainer 2', 'trainer 1']
+        )
+        self.assertEqual(len(data['leagues']['edges']), 2)
+
+
+class NestedConnectionTest(GraphQLTestCase):
+    def setUp(self):
+        self.league = League.objects.create(reference='big league')
+        self.trainers = [
+            Trainer.objects.create(discord_id=f'trainer {i}') for i in range(30)
+        ]
+        self.league.competitors.add(*self.trainers)
+        for i in range(3):
+            league = League.objects.create(reference=f'league {i}')
+            league.competitors.add(self.trainers[0])
+            Score.objects.create(league=league, trainer=self.trainers[0])
+
+    def test_competitors_page_is_sliced_in_the_database(self):
+        query = '''
+            query($id: ID, $after: String) {
+                leagues(id: $id) {
+                    edges {
+                        node {
+                            competitors(first: 5, after: $after) {
+                                totalCount
+                                pageInfo { hasNextPage endCursor }
+                                edges { node { discordId } }
+                            }
+                        }
+                    }
+                }
+            }
+        '''
+        variables = {'id': to_global_id('LeagueType', self.league.pk)}
+        with CaptureQueriesContext(connection) as queries:
+            data = self.execute(query, variables)
+        competitors = data['leagues']['edges'][0]['node']['competitors']
+        self.assertEqual(competitors['totalCount'], 30)
+        self.assertTrue(competitors['pageInfo']['hasNextPage'])
+        self.assertEqual(
+            [e['node']['discordId'] for e in competitors['edges']],
+            [f'trainer {i}' for i in range(5)]
+        )
+        self.assertTrue(any(
+            'LIMIT 5' in query['sql'] and 'COUNT' not in query['sql']
+            for query in queries.captured_queries
+        ))
+
+        variables['after'] = competitors['pageInfo']['endCursor']
+        data = self.execute(query, variables)
+        competitors = data['leagues']['edges'][0]['node']['competitors']
+        self.assertEqual(
+            [e['node']['discordId'] for e in competitors['edges']],
+            [f'trainer {i}' for i in range(5, 10)]
+        )
+
+    def test_trainer_connections(self):
+        query = '''
+            query {
+                trainers(first: 3) {
+                    edges {
+                        node {
+                            discordId
+                            leagues { totalCount edges { node { reference } } }
+                            scores(first: 2) { totalCount edges { node { wins } } }
+                        }
+                    }
+                }
+            }
+        '''
+        data = self.execute(query)
+        first, second = [edge['node'] for edge in data['trainers']['edges'][:2]]
+        self.assertEqual(first['leagues']['totalCount'], 4)
+        self.assertEqual(
+            [e['node']['reference'] for e in first['leagues']['edges']],
+            ['big league', 'league 0', 'league 1', 'league 2']
+        )
+        self.assertEqual(first['scores']['totalCount'], 3)
+        self.assertEqual(len(first['scores']['edges']), 2)
+        self.assertEqual(second['leagues']['totalCount'], 1)
+        self.assertEqual(second['scores']['totalCount'], 0)
+
+
+class BenchmarkTest(TestCase):
+    def seed(self, *args):
+        call_command(
+            'seed_bench_data',
+            '--leagues', '2',
+            '--trainers', '20',
+            '--leaders', '15',
+            '--badges', '5',
+            '--battles', '120',
+            '--batch-size', '40',
+            *args,
+            stdout=StringIO()
+        )
+        return list(Battle.objects.order_by('pk').values_list(
+            'trainer__discord_id',
+            'leader__discord_id',
+            'winner_name'
+        ))
+
+    def test_seed_is_deterministic(self):
+        battles = self.seed('--seed', '7')
+        self.assertEqual(len(battles), 120)
+        self.assertEqual(self.seed('--seed', '7', '--clear'), battles)
+        self.assertNotEqual(self.seed('--seed', '8', '--clear'), battles)
+
+        # Os contadores e rankings são consistentes com as batalhas
+        self.assertEqual(
+            sum(Trainer.objects.values_list('battle_counter', flat=True)),
+            120
+        )
+        self.assertEqual(Standing.objects.count(), Score.objects.count())
+
+    def test_benchmark_report(self):
+        self.seed()
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            call_command(
+                'run_benchmark',
+                '--iterations', '3',
+                '--warmup', '1',
+                '--output', output.name
+            )
+            report = json.load(output)
+
+        self.assertEqual(report['dataset']['battle'], 120)
+        self.assertEqual(
+            set(report['operations']),
+            {'scoreboard', 'trainer_profile', 'league_listing', 'battle_register'}
+        )
+        for stats in report['operations'].values():
+            self.assertEqual(stats['iterations'], 3)
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+            self.assertGreater(stats['queries'], 0)
+
+        # As mutações do benchmark são desfeitas
+        self.assertEqual(Battle.objects.count(), 120)
+
+
+class SQLMetricsTest(TestCase):
+    query = '''
+        query LeaguePages {
+            leagues {
+                edges { node { competitors(first: 1) { totalCount } } }
+            }
+        }
+    '''
+
+    def setUp(self):
+        operation_stats.reset()
+        create_leagues(3)
+
+    def post(self, **headers):
+        return self.client.post(
+            '/graphql/',
+            json.dumps({'query': self.query}),
+            content_type='application/json',
+            **headers
+        ).json()
+
+    def test_metrics_are_returned_on_request(self):
+        self.assertNotIn('extensions', self.post())
+
+        with self.assertNumQueries(7):
+            result = self.post(HTTP_X_SQL_METRICS='1')
+        sql = result['extensions']['sql']
+        self.assertEqual(sql['statements'], 7)
+        self.assertGreater(sql['duration_ms'], 0)
+        # A página de competidores é consultada uma vez por liga
+        self.assertEqual(sql['duplicates'], 4)
+        self.assertEqual([d['count'] for d in sql['duplicated']], [3, 3])
+
+        with override_settings(ABP_SQL_METRICS=True):
+            self.assertIn('extensions', self.post())
+
+    def test_operation_aggregates(self):
+        for _ in range(3):
+            self.post()
+        self.client.post(
+            '/graphql/',
+            json.dumps({'query': '{ apiVersion }'}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(self.client.get('/graphql/sql-stats/').status_code, 404)
+        with override_settings(ABP_SQL_METRICS=True):
+            stats = self.client.get('/graphql/sql-stats/').json()
+        self.assertEqual(stats['LeaguePages']['requests'], 3)
+        self.assertEqual(stats['LeaguePages']['statements_max'], 7)
+        self.assertEqual(stats['LeaguePages']['duplicates_mean'], 4)
+        self.assertEqual(stats['anonymous']['statements_max'], 0)
+
+    def test_operation_names_are_bounded(self):
+        stats = OperationStats(window=10, max_operations=2)
+        for name in ('First', 'Second', 'Third', 'Fourth', 'bad name', 'First'):
+            stats.add(name, QueryRecorder(), 0.01)
+        stats.add('anonymous', QueryRecorder(), 0.01)
+
+        requests = {name: row['requests'] for name, row in stats.snapshot().items()}
+        self.assertEqual(requests, {'First': 2, 'Second': 1, 'other': 3, 'anonymous': 1})
+
+
+class ResolverMetricsTest(GraphQLTestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_root_resolvers_are_measured(self):
+        field = {'operation': 'Listing', 'field': 'Query.leagues'}
+        calls = self.sample('abp_graphql_resolver_duration_seconds_count', **field)
+        nested = self.sample(
+            'abp_graphql_resolver_duration_seconds_count',
+            operation='Listing',
+            field='LeagueType.competitors'
+        )
+        create_leagues(2)
+        self.execute('''
+            query Listing {
+                leagues { edges { node { competitors { totalCount } } } }
+                apiVersion
+            }
+        ''')
+
+        self.assertEqual(
+            self.sample('abp_graphql_resolver_duration_seconds_count', **field),
+            calls + 1
+        )
+        self.assertEqual(
+            self.sample(
+                'abp_graphql_resolver_duration_seconds_count',
+                operation='Listing',
+                field='LeagueType.competitors'
+            ),
+            nested
+        )
+        self.assertEqual(
+            self.sample(
+                'abp_graphql_request_duration_seconds_count',
+                operation='Listing'
+            ),
+            1
+        )
+
+    def test_errors_are_counted(self):
+        labels = {'operation': 'anonymous', 'field': 'Mutation.battleRegister'}
+        errors = self.sample('abp_graphql_resolver_errors_total', **labels)
+        failed = self.sample(
+            'abp_graphql_request_errors_total',
+            operation='anonymous'
+        )
+        response = self.client.post(
+            '/graphql/',
+            json.dumps({'query': '''
+                mutation {
+                    battleRegister(input: {
+                        league: "bad", trainer: "a", leader: "b", winner: "a"
+                    }) { battle { winner } }
+                }
+            '''}),
+            content_type='application/json'
+        )
+        self.assertIn('errors', response.json())
+        self.assertEqual(
+            self.sample('abp_graphql_resolver_errors_total', **labels),
+            errors + 1
+        )
+        self.assertEqual(
+            self.sample('abp_graphql_request_errors_total', operation='anonymous'),
+            failed + 1
+        )
+
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn(
+            'abp_graphql_resolver_errors_total{field="Mutation.battleRegister",'
+            'operation="anonymous"}',
+            metrics
+        )
+
+    def test_unknown_operation_names_are_not_labels(self):
+        other = self.sample('abp_graphql_request_duration_seconds_count', operation='other')
+        with mock.patch.object(operation_labels, 'limit', 0):
+            self.client.post(
+                '/graphql/',
+                json.dumps({'query': 'query Random1234 { apiVersion }'}),
+                content_type='application/json'
+            )
+        self.client.post(
+            '/graphql/',
+            json.dumps({'query': '{ apiVersion }', 'operationName': 'not a name'}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(
+            self.sample('abp_graphql_request_duration_seconds_count', operation='other'),
+            other + 2
+        )
+        self.assertNotIn('Random1234', self.client.get('/metrics').content.decode())
+
+
+class DocumentCacheTest(TestCase):
+    query = '{ leagues { edges { node { reference } } } }'
+
+    def setUp(self):
+        document_backend.clear()
+        registered_queries.clear()
+        create_leagues(1)
+
+    def post(self, query=None, sha256=None, **data):
+        if sha256:
+            data['extensions'] = {
+                'persistedQuery': {'version': 1, 'sha256Hash': sha256}
+            }
+        return self.client.post(
+            '/graphql/',
+            json.dumps({'query': query, **data}),
+            content_type='application/json'
+        )
+
+    def test_documents_are_parsed_and_validated_once(self):
+        with mock.patch('abp.documents.validate', wraps=validate) as validation:
+            for _ in range(3):
+                self.assertNotIn('errors', self.post(self.query).json())
+            invalid = self.post('{ leagues { unknownField } }')
+            self.post('{ leagues { unknownField } }')
+
+        self.assertEqual(validation.call_count, 2)
+        self.assertEqual((document_backend.hits, document_backend.misses), (3, 2))
+        self.assertEqual(invalid.status_code, 400)
+
+        with override_settings(ABP_DOCUMENT_CACHE_SIZE=1):
+            self.post('{ apiVersion }')
+        self.assertEqual(len(document_backend.documents), 1)
+
+    def test_automatic_persisted_queries(self):
+        sha256 = query_hash(self.query)
+        result = self.post(sha256=sha256).json()
+        self.assertEqual(result['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        self.assertEqual(self.post(self.query, sha256).status_code, 200)
+        result = self.post(sha256=sha256).json()
+        self.assertEqual(
+            result['data']['leagues']['edges'][0]['node']['reference'],
+            'league 0'
+        )
+        self.assertEqual(self.post('{ apiVersion }', sha256).status_code, 400)
+
+    def test_whitelist(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.graphql') as query_file:
+            query_file.write(self.query)
+            query_file.flush()
+            out = StringIO()
+            call_command('register_queries', query_file.name, stdout=out)
+        sha256 = query_hash(self.query)
+        self.assertTrue(out.getvalue().startswith(sha256))
+
+        registered_queries.clear()
+        with override_settings(ABP_PERSISTED_QUERIES='whitelist'):
+            self.assertEqual(self.post('{ apiVersion }').status_code, 400)
+            self.assertNotIn('errors', self.post(sha256=sha256).json())
+            self.assertNotIn('errors', self.post(self.query).json())
+
+        with override_settings(ABP_PERSISTED_QUERIES='off'):
+            result = self.post(sha256=sha256).json()
+            self.assertEqual(
+                result['errors'][0]['message'],
+                'PersistedQueryNotSupported'
+            )
+
+    def test_introspection_result_is_cached(self):
+        with mock.patch('abp.documents.execute', wraps=execute) as execution:
+            first = self.post(introspection_query).json()
+            second = self.post(introspection_query).json()
+
+        self.assertEqual(execution.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertIn('__schema', first['data'])
+
+        # Cada operação do documento tem o próprio resultado
+        query = 'query A { __typename } query B { __schema { queryType { name } } }'
+        self.assertEqual(self.post(query, operationName='A').json()['data'], {'__typename': 'Query'})
+        self.assertEqual(
+            self.post(query, operationName='B').json()['data'],
+            {'__schema': {'queryType': {'name': 'Query'}}}
+        )
+        self.assertEqual(self.post(query, operationName='A').json()['data'], {'__typename': 'Query'})
+
+    def test_counters_are_thread_safe(self):
+        queries = [f'{{ q{index}: apiVersion }}' for index in range(20)]
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(
+                lambda query: document_backend.document_from_string(schema, query),
+                queries * 50
+            ))
+        self.assertEqual(document_backend.misses + document_backend.hits, 1000)
+
+
+@override_settings(ABP_RESPONSE_CACHE='default')
+class ResponseCacheTest(GraphQLTestCase):
+    trainers = '{ trainers { edges { node { discordId } } } }'
+    scores = '{ scores { edges { node { wins losses badges } } } }'
+
+    def setUp(self):
+        caches['default'].clear()
+        create_leagues(1)
+        self.league_id = to_global_id('LeagueType', League.objects.get().pk)
+        Score.objects.create(
+            league=League.objects.get(),
+            trainer=Trainer.objects.get(discord_id='trainer 0')
+        )
+
+    def discord_ids(self):
+        data = self.execute(self.trainers)
+        return [edge['node']['discordId'] for edge in data['trainers']['edges']]
+
+    def test_queries_are_cached_until_a_mutation_changes_their_models(self):
+        trainers = self.discord_ids()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.discord_ids(), trainers)
+
+        # Mutações de outros models não invalidam a resposta
+        self.execute('''
+            mutation {
+                createLeader(input: {
+                    discordId: "brock", pokemonType: ROCK, role: GYM_LEADER
+                }) { leader { discordId } }
+            }
+        ''')
+        with self.assertNumQueries(0):
+            self.discord_ids()
+
+        self.execute('''
+            mutation {
+                createTrainer(input: {discordId: "ash"}) {
+                    trainer { discordId }
+                }
+            }
+        ''')
+        self.assertEqual(self.discord_ids(), trainers + ['ash'])
+
+    def test_battles_and_badges_invalidate_scores(self):
+        self.execute(self.scores)
+        with self.assertNumQueries(0):
+            self.execute(self.scores)
+
+        self.execute(StandbyTest.register, {
+            'league': self.league_id,
+            'trainer': 'trainer 0',
+            'leader': 'gym 0',
+            'winner': 'trainer 0',
+        })
+        score = self.execute(self.scores)['scores']['edges'][0]['node']
+        self.assertEqual((score['wins'], score['losses']), (1, 0))
+
+        Badge.objects.create(reference='Boulder')
+        self.execute('''
+            mutation($league: ID!) {
+                addBadgeToTrainer(input: {
+                    discordId: "trainer 0", badge: "boulder", league: $league
+                }) { response }
+            }
+        ''', {'league': self.league_id})
+        score = self.execute(self.scores)['scores']['edges'][0]['node']
+        self.assertEqual(score['badges'], ['Boulder'])
+
+    def test_maintenance_commands_invalidate_the_responses(self):
+        query = '{ trainers(first: 1) { edges { node { lv } } } }'
+        self.assertEqual(self.execute(query)['trainers']['edges'][0]['node']['lv'], 1)
+        # Escritas em massa não disparam os signals dos models
+        Trainer.objects.update(exp=100)
+        self.assertEqual(self.execute(query)['trainers']['edges'][0]['node']['lv'], 1)
+
+        call_command('recompute_levels', stdout=StringIO())
+        self.assertGreater(self.execute(query)['trainers']['edges'][0]['node']['lv'], 1)
+
+    def test_variables_and_normalized_documents(self):
+        query = '''
+            query($discordId: String) {
+                scores(trainer_DiscordId: $discordId) { edges { node { wins } } }
+            }
+        '''
+        self.execute(query, {'discordId': 'trainer 0'})
+        with self.assertNumQueries(0):
+            # Mesmo documento, com outra formatação
+            self.execute(' '.join(query.split()), {'discordId': 'trainer 0'})
+        with self.assertNumQueries(1):
+            data = self.execute(query, {'discordId': 'nobody'})
+        self.assertEqual(data['scores']['edges'], [])
+
+        # Respostas com erros não são armazenadas
+        with self.assertNumQueries(0):
+            self.client.post(
+                '/graphql/',
+                json.dumps({'query': '{ trainers { unknown } }'}),
+                content_type='application/json'
+            )
+
+
+class InvalidationBusTest(TestCase):
+    def test_writes_are_published_once_after_commit(self):
+        with mock.patch('abp.bus.send') as send:
+            league = League.objects.create(reference='bus')
+            league.competitors.add(Trainer.objects.create(discord_id='ash'))
+            send.assert_not_called()
+            run_commit_hooks()
+
+        send.assert_called_once_with(frozenset({'league', 'trainer', PLAYER_NAMES}))
+
+    def test_rolled_back_writes_are_not_published(self):
+        with mock.patch('abp.bus.send') as send:
+            try:
+                with transaction.atomic():
+                    League.objects.create(reference='bus')
+                    raise ValueError
+            except ValueError:
+                pass
+            Leader.objects.create(discord_id='brock')
+            run_commit_hooks()
+
+        send.assert_called_once_with(frozenset({'leader', PLAYER_NAMES}))
+
+    @override_settings(ABP_RESPONSE_CACHE='default', ABP_INVALIDATION_BUS='table')
+    def test_events_of_other_workers_invalidate_local_caches(self):
+        subscriber = bus.get_transport()
+        self.assertEqual(subscriber.poll(), [])
+
+        registered_queries['sha'] = '{ leagues { totalCount } }'
+        cache = caches['default']
+        cache.set('abp:tag:league', 'v1')
+        with mock.patch('abp.bus.origin', return_value='other worker'):
+            bus.get_transport().publish({'league', 'persistedquery'})
+        bus.get_transport().publish({'league'})
+
+        events = subscriber.poll()
+        self.assertEqual(events, [frozenset({'league', 'persistedquery'})])
+        self.assertEqual(InvalidationEvent.objects.count(), 2)
+        for tags in events:
+            bus.dispatch(tags, False)
+        self.assertNotEqual(cache.get('abp:tag:league'), 'v1')
+        self.assertEqual(registered_queries, {})
+        self.assertEqual(subscriber.poll(), [])
+
+
+@override_settings(ABP_INVALIDATION_BUS='table')
+class InvalidationEventTest(TransactionTestCase):
+    def create_trainer(self, discord_id):
+        self.client.post('/graphql/', json.dumps({'query': '''
+            mutation($discordId: String!) {
+                createTrainer(input: {discordId: $discordId}) { trainer { id } }
+            }
+        ''', 'variables': {'discordId': discord_id}}), content_type='application/json')
+
+    def test_only_the_workers_with_a_subscriber_publish_events(self):
+        self.create_trainer('ash')
+        self.assertFalse(InvalidationEvent.objects.exists())
+
+        with mock.patch.object(bus, 'publisher', bus.get_transport()):
+            self.create_trainer('misty')
+        # As escritas e a invalidação da mutação geram um único evento
+        self.assertEqual(
+            list(InvalidationEvent.objects.values_list('tags', flat=True)),
+            [f'{PLAYER_NAMES},trainer']
+        )
+
+
+class QueryPlannerTest(GraphQLTestCase):
+    def setUp(self):
+        league = League.objects.create(reference='planned league')
+        leader = Leader.objects.create(discord_id='brock', name='Brock')
+        league.gym_leaders.add(leader)
+        for i in range(3):
+            trainer = Trainer.objects.create(discord_id=f'trainer {i}')
+            league.competitors.add(trainer)
+            score = Score.objects.create(league=league, trainer=trainer)
+            Battle.objects.create(trainer=trainer, leader=leader, winner_name='brock')
+
+    def test_foreign_keys_are_joined_and_columns_projected(self):
+        query = '''
+            {
+                battles(first: 2) {
+                    edges { node { trainer { discordId } leader { name } } }
+                }
+            }
+        '''
+        with CaptureQueriesContext(connection) as captured:
+            data = self.execute(query)
+
+        self.assertEqual(len(captured), 1)
+        sql = captured[0]['sql']
+        self.assertIn('"abp_trainer"."discord_id"', sql)
+        self.assertIn('"abp_leader"."name"', sql)
+        self.assertNotIn('winner_name', sql)
+        self.assertNotIn('"abp_trainer"."exp"', sql)
+        node = data['battles']['edges'][0]['node']
+        self.assertEqual(node, {'trainer': {'discordId': 'trainer 0'}, 'leader': {'name': 'Brock'}})
+
+    def test_relations_are_prefetched_through_fragments(self):
+        query = '''
+            fragment trainerFields on TrainerType {
+                discordId
+                scores { edges { node { league { reference } standby } } }
+            }
+            {
+                trainers(first: 10) { edges { node { ...trainerFields } } }
+            }
+        '''
+        # treinadores e seus scores com a liga
+        with self.assertNumQueries(2):
+            data = self.execute(query)
+
+        scores = data['trainers']['edges'][2]['node']['scores']['edges']
+        self.assertEqual(scores, [
+            {'node': {'league': {'reference': 'planned league'}, 'standby': False}}
+        ])
+
+    def test_paginated_relations_are_not_prefetched(self):
+        query = '''
+            {
+                leagues {
+                    edges {
+                        node {
+                            gymLeaders { edges { node { discordId } } }
+                            competitors(first: 2) { totalCount }
+                        }
+                    }
+                }
+            }
+        '''
+        # ligas, líderes e a página de competidores (COUNT e página)
+        with self.assertNumQueries(4):
+            data = self.execute(query)
+
+        node = data['leagues']['edges'][0]['node']
+        self.assertEqual(node['competitors'], {'totalCount': 3})
+        self.assertEqual(node['gymLeaders']['edges'], [{'node': {'discordId': 'brock'}}])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'The query plans are SQLite specific.')
+class QueryPlanTest(TestCase):
+    def assertUsesIndex(self, queryset, index, lookup):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index} ({lookup})', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def index_name(self, model, *fields):
+        return next(
+            index.name for index in model._meta.indexes
+            if tuple(index.fields) == fields
+        )
+
+    def test_battle_history_uses_the_composite_indexes(self):
+        for field in ('trainer', 'leader'):
+            index = self.index_name(Battle, field, 'battle_datetime', 'id')
+            battles = Battle.objects.filter(**{f'{field}_id': 1})
+            self.assertUsesIndex(
+                battles.order_by('-battle_datetime', '-id')[:10],
+                index,
+                f'{field}_id=?'
+            )
+            self.assertUsesIndex(
+                battles.filter(battle_datetime__gte=timezone.now()).order_by(
+                    'battle_datetime', 'id'
+                ),
+                index,
+                f'{field}_id=? AND battle_datetime>?'
+            )
+
+    def test_trainer_score_lookup_uses_the_unique_index(self):
+        plan = Score.objects.filter(trainer_id=1, league_id=1).explain()
+        self.assertRegex(plan, r'USING INDEX \w+_uniq \(trainer_id=\? AND league_id=\?\)')
+
+        league = League.objects.create(reference='unique league')
+        trainer = Trainer.objects.create(discord_id='ash')
+        Score.objects.create(league=league, trainer=trainer)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Score.objects.create(league=league, trainer=trainer)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The trigram indexes exist only on PostgreSQL.')
+class TrigramPlanTest(TestCase):
+    def test_search_uses_the_trigram_indexes(self):
+        with connection.cursor() as cursor:
+            # As tabelas vazias seriam lidas sequencialmente de qualquer forma
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        for model in (Trainer, Leader):
+            plan = model.objects.filter(database_condition('ash')).explain()
+            self.assertNotIn('Seq Scan', plan)
+            for field in ('name', 'discord_id'):
+                self.assertIn(f'{model._meta.db_table}_{field}_trgm', plan)
+
+
+class SearchPlayersTest(GraphQLTestCase):
+    query = '''
+        query($text: String!, $first: Int) {
+            searchPlayers(text: $text, first: $first) {
+                similarity
+                player {
+                    __typename
+                    ... on TrainerType { discordId }
+                    ... on LeaderType { discordId }
+                }
+            }
+        }
+    '''
+
+    def setUp(self):
+        player_index.clear()
+        for discord_id in ('ash', 'ashley', 'misty'):
+            Trainer.objects.create(discord_id=discord_id)
+        Leader.objects.create(discord_id='brock', name='Ash Ketchum')
+
+    def search(self, text, first=10):
+        return [
+            (result['player']['__typename'], result['player']['discordId'])
+            for result in self.execute(self.query, {'text': text, 'first': first})['searchPlayers']
+        ]
+
+    def test_trigrams_match_pg_trgm(self):
+        self.assertEqual(trigrams('Ash!'), {'  a', ' as', 'ash', 'sh '})
+        self.assertAlmostEqual(similarity(trigrams('word'), trigrams('two words')), 4 / 11)
+
+    def test_contains_lookup_compares_the_raw_column(self):
+        sql = str(Trainer.objects.filter(name__trigram_contains='a_b').query)
+        self.assertIn('"abp_trainer"."name" ILIKE %a\\_b%', sql)
+        self.assertNotIn('UPPER', sql)
+
+    def test_results_are_ranked_by_similarity(self):
+        self.assertEqual(self.search('ash'), [
+            ('TrainerType', 'ash'),
+            ('TrainerType', 'ashley'),
+            ('LeaderType', 'brock'),
+        ])
+        self.assertEqual(self.search('ash', first=1), [('TrainerType', 'ash')])
+        # Textos contidos nos nomes são encontrados com baixa similaridade
+        self.assertEqual(self.search('st'), [('TrainerType', 'misty')])
+
+    def test_index_follows_committed_writes(self):
+        self.assertEqual(self.search('pikachu'), [])
+        trainer = Trainer.objects.create(discord_id='pikachu')
+        self.assertEqual(self.search('pikachu'), [])
+        run_commit_hooks()
+        self.assertEqual(self.search('pikachu'), [('TrainerType', 'pikachu')])
+
+        trainer.delete()
+        run_commit_hooks()
+        self.assertEqual(self.search('pikachu'), [])
+
+        # Apenas as alterações dos nomes feitas por outros workers descartam
+        # o índice
+        with mock.patch('abp.search.publish') as published:
+            Trainer.objects.get(discord_id='ash').save(update_fields=['exp'])
+        published.assert_not_called()
+        bus.dispatch(frozenset({'trainer', 'leader'}), False)
+        self.assertTrue(player_index.loaded)
+        Trainer.objects.filter(discord_id='misty').update(discord_id='pikachu')
+        bus.dispatch(frozenset({'trainer', PLAYER_NAMES}), False)
+        self.assertFalse(player_index.loaded)
+        self.assertEqual(self.search('pikachu'), [('TrainerType', 'pikachu')])
+
+
+@override_settings(ABP_READ_REPLICAS=['replica'], ABP_REPLICA_STICKY_SECONDS=60)
+class ReadReplicaTest(TransactionTestCase):
+    trainers = '{ trainers { edges { node { discordId } } } }'
+
+    @classmethod
+    def setUpClass(cls):
+        # Um segundo arquivo sqlite, sem replicação, faz o papel da réplica
+        handle, cls.replica_file = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        connections.databases['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': cls.replica_file,
+        }
+        connections.ensure_defaults('replica')
+        call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections.databases['replica']
+        os.remove(cls.replica_file)
+
+    def setUp(self):
+        Trainer.objects.create(discord_id='on primary')
+        Trainer.objects.using('replica').create(discord_id='on replica')
+
+    def tearDown(self):
+        Trainer.objects.using('replica').all().delete()
+
+    def discord_ids(self, client=None):
+        response = (client or self.client).post(
+            '/graphql/',
+            json.dumps({'query': self.trainers}),
+            content_type='application/json'
+        )
+        return [
+            edge['node']['discordId']
+            for edge in response.json()['data']['trainers']['edges']
+        ]
+
+    def test_queries_read_from_the_replica(self):
+        self.assertEqual(self.discord_ids(), ['on replica'])
+        self.assertEqual(Trainer.objects.get().discord_id, 'on primary')
+        with override_settings(ABP_READ_REPLICAS=[]):
+            self.assertEqual(self.discord_ids(), ['on primary'])
+
+    def test_clients_read_their_writes_after_a_mutation(self):
+        response = self.client.post('/graphql/', json.dumps({'query': '''
+            mutation {
+                createTrainer(input: {discordId: "ash"}) { trainer { discordId } }
+            }
+        '''}), content_type='application/json')
+
+        self.assertEqual(
+            response.json()['data']['createTrainer']['trainer'],
+            {'discordId': 'ash'}
+        )
+        self.assertIn(routers.STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.discord_ids(), ['on primary', 'ash'])
+
+        # Outros clientes, e o mesmo cliente após a janela, leem da réplica
+        self.client.cookies.clear()
+        self.assertEqual(self.discord_ids(), ['on replica'])
+
+    @override_settings(ABP_RESPONSE_CACHE='default')
+    def test_cached_responses_do_not_hide_the_clients_writes(self):
+        caches['default'].clear()
+        other = Client()
+        self.assertEqual(self.discord_ids(other), ['on replica'])
+
+        self.client.post('/graphql/', json.dumps({'query': '''
+            mutation { createTrainer(input: {discordId: "ash"}) { trainer { id } } }
+        '''}), content_type='application/json')
+
+        # A réplica ainda não recebeu a escrita: a resposta não é armazenada
+        self.assertEqual(self.discord_ids(other), ['on replica'])
+        self.assertEqual(self.discord_ids(), ['on primary', 'ash'])
+
+        Trainer.objects.using('replica').create(discord_id='ash')
+        self.assertEqual(self.discord_ids(other), ['on replica', 'ash'])
+
+
+class BattleLeagueTest(GraphQLTestCase):
+    battles = '''
+        query($league: ID) {
+            battles(league: $league) { edges { node { winner } } }
+        }
+    '''
+
+    def setUp(self):
+        create_leagues(2)
+        for league in League.objects.all():
+            trainer = league.competitors.order_by('pk').first()
+            score = Score.objects.create(league=league, trainer=trainer)
+            register_battle(score, trainer, league.gym_leaders.get(), trainer.discord_id)
+
+    def test_battles_are_registered_with_their_league_and_score(self):
+        league = League.objects.get(reference='league 1')
+        battle = Battle.objects.get(league=league)
+        self.assertEqual(battle.score, Score.objects.get(league=league))
+        self.assertEqual(list(battle.score.battles.all()), [battle])
+
+        data = self.execute(self.battles, {
+            'league': to_global_id('LeagueType', league.pk)
+        })
+        self.assertEqual(data['battles']['edges'], [{'node': {'winner': 'trainer 1'}}])
+        self.assertEqual(len(self.execute(self.battles)['battles']['edges']), 2)
+
+    def test_batch_registered_battles_have_their_league(self):
+        league = League.objects.get(reference='league 0')
+        Score.objects.create(
+            league=league,
+            trainer=Trainer.objects.get(discord_id='rookie 0')
+        )
+        battles = register_battles([
+            BattleRecord(league.pk, 'rookie 0', 'gym 0', 'gym 0'),
+        ])
+        self.assertEqual(battles[0].league_id, league.pk)
+        self.assertEqual(
+            Battle.objects.get(pk=battles[0].pk).score.trainer.discord_id,
+            'rookie 0'
+        )
+
+
+@override_settings(ABP_EXPORT_TOKEN='secret')
+class ExportTest(TestCase):
+    def setUp(self):
+        create_leagues(2)
+        for league in League.objects.all():
+            trainer = league.competitors.order_by('pk').first()
+            score = Score.objects.create(league=league, trainer=trainer)
+            register_battle(score, trainer, league.gym_leaders.get(), trainer.discord_id)
+        self.league = League.objects.get(reference='league 1')
+
+    def get(self, name, **params):
+        return self.client.get(
+            f'/exports/{name}/',
+            params,
+            HTTP_AUTHORIZATION='Bearer secret'
+        )
+
+    def test_streams_ndjson_and_gzipped_csv(self):
+        response = self.get('battles', league=to_global_id('LeagueType', self.league.pk))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+        battle = Battle.objects.get(league=self.league)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['id'], battle.pk)
+        self.assertEqual(rows[0]['score_id'], battle.score_id)
+        self.assertEqual(rows[0]['battle_datetime'], battle.battle_datetime.isoformat())
+
+        response = self.get('leaders', format='csv', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('leaders.csv.gz', response['Content-Disposition'])
+        content = gzip.decompress(b''.join(response.streaming_content))
+        rows = list(csv.DictReader(content.decode('utf-8').splitlines()))
+        self.assertEqual(len(rows), Leader.objects.count())
+        self.assertEqual(rows[0]['discord_id'], 'gym 0')
+
+    def test_filters(self):
+        league = to_global_id('LeagueType', self.league.pk)
+        content = b''.join(self.get('leaders', league=league).streaming_content)
+        self.assertEqual(
+            sorted(json.loads(line)['discord_id'] for line in content.splitlines()),
+            ['champion 1', 'elite 1', 'gym 1']
+        )
+
+        tomorrow = (timezone.now() + timedelta(days=1)).date().isoformat()
+        self.assertEqual(b''.join(self.get('trainers', since=tomorrow).streaming_content), b'')
+        content = b''.join(self.get('trainers', until=tomorrow).streaming_content)
+        self.assertEqual(len(content.splitlines()), Trainer.objects.count())
+
+        self.assertEqual(self.get('battles', since='yesterday').status_code, 400)
+        self.assertEqual(self.get('badges').status_code, 400)
+
+    def test_reads_in_keyset_chunks(self):
+        export = Export('trainers', format='csv', chunk_size=2)
+        with CaptureQueriesContext(connection) as captured:
+            content = b''.join(export).decode('utf-8')
+
+        ids = list(Trainer.objects.order_by('pk').values_list('pk', flat=True))
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual([int(row['id']) for row in rows], ids)
+        self.assertEqual(export.rows, len(ids))
+        self.assertEqual(len(captured), len(ids) // 2 + 1)
+        self.assertTrue(all('LIMIT 2' in query['sql'] for query in captured))
+
+    def test_authorization(self):
+        self.assertEqual(self.client.get('/exports/battles/').status_code, 403)
+        with override_settings(ABP_EXPORT_TOKEN=None):
+            self.assertEqual(self.get('battles').status_code, 404)
+
+    def test_export_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'scores.ndjson.gz')
+            err = StringIO()
+            call_command(
+                'export_scores',
+                output=path,
+                gzip=True,
+                chunk_size=1,
+                stderr=err
+            )
+            with gzip.open(path, 'rt') as export_file:
+                rows = [json.loads(line) for line in export_file]
+
+        self.assertEqual(
+            [row['id'] for row in rows],
+            list(Score.objects.order_by('pk').values_list('pk', flat=True))
+        )
+        self.assertIn('2 scores exported.', err.getvalue())
+
+
+class BattleSnapshotTest(TestCase):
+    def setUp(self):
+        create_leagues(2)
+        Leader.objects.filter(discord_id='gym 0').update(pokemon_type='Fire')
+        Leader.objects.filter(discord_id='gym 1').update(pokemon_type='Water')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def battle(self, league, discord_id, trainer_won):
+        league = League.objects.get(reference=league)
+        trainer = Trainer.objects.get(discord_id=discord_id)
+        score, _ = Score.objects.get_or_create(league=league, trainer=trainer)
+        leader = league.gym_leaders.get()
+        return register_battle(
+            score,
+            trainer,
+            leader,
+            trainer.discord_id if trainer_won else leader.discord_id
+        )
+
+    def test_incremental_snapshots_append_new_battles(self):
+        self.battle('league 0', 'trainer 0', True)
+        self.battle('league 0', 'rookie 0', False)
+        self.assertEqual(snapshot_battles(self.directory.name, settle=0), 2)
+        # As batalhas recentes ficam para o snapshot seguinte
+        self.battle('league 1', 'trainer 1', False)
+        self.assertEqual(snapshot_battles(self.directory.name), 0)
+        self.assertEqual(snapshot_battles(self.directory.name, settle=0), 1)
+
+        snapshot = Snapshot(self.directory.name)
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(
+            list(snapshot['id']),
+            list(Battle.objects.order_by('pk').values_list('pk', flat=True))
+        )
+        self.assertEqual(snapshot.watermark, Battle.objects.latest('pk').pk)
+        self.assertIsInstance(snapshot['id'], np.memmap)
+
+        self.assertEqual(snapshot.win_rates('pokemon_type'), [
+            {'key': 'Fire', 'battles': 2, 'trainer_wins': 1, 'leader_wins': 1,
+             'leader_win_rate': 0.5},
+            {'key': 'Water', 'battles': 1, 'trainer_wins': 0, 'leader_wins': 1,
+             'leader_win_rate': 1.0},
+        ])
+        league = League.objects.get(reference='league 1').pk
+        self.assertEqual(
+            [(r['key'], r['battles']) for r in snapshot.win_rates('league', league=league)],
+            [(league, 1)]
+        )
+        month = timezone.now().strftime('%Y-%m')
+        self.assertEqual(snapshot.win_rates('month')[0]['key'], month)
+        self.assertEqual(
+            snapshot.win_rates('role', since=timezone.now() + timedelta(days=1)),
+            []
+        )
+
+    def test_full_snapshot_replaces_the_previous_one(self):
+        self.battle('league 0', 'trainer 0', True)
+        snapshot_battles(self.directory.name, settle=0)
+        previous = Snapshot(self.directory.name)
+        Battle.objects.all().delete()
+
+        self.assertEqual(snapshot_battles(self.directory.name, full=True, settle=0), 0)
+        self.assertEqual(len(Snapshot(self.directory.name)), 0)
+        self.assertEqual(Snapshot(self.directory.name).win_rates('leader'), [])
+        # Um leitor do snapshot anterior continua com os arquivos mapeados
+        self.assertEqual(len(previous['id']), 1)
+
+
+class LeaderStatsTest(GraphQLTestCase):
+    leader_stats = '''
+        query($league: ID, $type: PokemonTypes, $role: Role) {
+            leaderStats(league: $league, pokemonType: $type, role: $role) {
+                leader { discordId }
+                battles
+                wins
+                losses
+                holdRate
+            }
+        }
+    '''
+    type_matchups = '''
+        query($league: ID) {
+            typeMatchupStats(league: $league) {
+                pokemonType
+                leaders
+                battles
+                wins
+                holdRate
+            }
+        }
+    '''
+
+    def setUp(self):
+        create_leagues(2)
+        Leader.objects.filter(discord_id__in=['gym 0', 'elite 0']).update(pokemon_type='Fire')
+        Leader.objects.filter(discord_id='gym 1').update(pokemon_type='Water')
+        for league in League.objects.all():
+            for trainer in (*league.competitors.all(), league.winner):
+                Score.objects.create(league=league, trainer=trainer)
+
+        league = League.objects.get(reference='league 0')
+        register_battle(
+            Score.objects.get(league=league, trainer__discord_id='trainer 0'),
+            Trainer.objects.get(discord_id='trainer 0'),
+            Leader.objects.get(discord_id='gym 0'),
+            'gym 0'
+        )
+        register_battles([
+            BattleRecord(league.pk, 'rookie 0', 'gym 0', 'rookie 0'),
+            BattleRecord(league.pk, 'rookie 0', 'elite 0', 'elite 0'),
+            BattleRecord(league.pk, 'winner 0', 'gym 0', 'gym 0'),
+        ])
+        league = League.objects.get(reference='league 1')
+        register_battles([
+            BattleRecord(league.pk, 'trainer 1', 'gym 1', 'trainer 1'),
+        ])
+
+    def rollups(self):
+        return sorted(LeaderDailyStats.objects.values_list(
+            'league_id', 'leader_id', 'day', 'battles', 'wins', 'losses'
+        ))
+
+    def test_battle_register_updates_the_rollups(self):
+        gym = Leader.objects.get(discord_id='gym 0')
+        rollup = LeaderDailyStats.objects.get(leader=gym)
+        self.assertEqual((rollup.battles, rollup.wins, rollup.losses), (3, 2, 1))
+        self.assertEqual(rollup.day, timezone.now().date())
+
+        incremental = self.rollups()
+        self.assertEqual(rebuild_leader_stats(), 3)
+        self.assertEqual(self.rollups(), incremental)
+
+        league = League.objects.get(reference='league 1')
+        LeaderDailyStats.objects.update(battles=0)
+        out = StringIO()
+        call_command('rebuild_leader_stats', league=[league.pk], stdout=out)
+        self.assertIn('1 leader stats rebuilt.', out.getvalue())
+        self.assertEqual(
+            LeaderDailyStats.objects.get(league=league).battles,
+            1
+        )
+        self.assertEqual(LeaderDailyStats.objects.get(leader=gym).battles, 0)
+
+    def test_leader_stats(self):
+        stats = self.execute(self.leader_stats)['leaderStats']
+        self.assertEqual(stats, [
+            {'leader': {'discordId': 'elite 0'}, 'battles': 1, 'wins': 1,
+             'losses': 0, 'holdRate': 1.0},
+            {'leader': {'discordId': 'gym 0'}, 'battles': 3, 'wins': 2,
+             'losses': 1, 'holdRate': 2 / 3},
+            {'leader': {'discordId': 'gym 1'}, 'battles': 1, 'wins': 0,
+             'losses': 1, 'holdRate': 0.0},
+        ])
+
+        stats = self.execute(self.leader_stats, {
+            'league': to_global_id('LeagueType', League.objects.get(reference='league 0').pk),
+            'type': 'FIRE',
+            'role': 'GYM_LEADER',
+        })['leaderStats']
+        self.assertEqual([s['leader']['discordId'] for s in stats], ['gym 0'])
+
+    def test_type_matchup_stats(self):
+        self.assertEqual(self.execute(self.type_matchups)['typeMatchupStats'], [
+            {'pokemonType': 'FIRE', 'leaders': 2, 'battles': 4, 'wins': 3,
+             'holdRate': 0.75},
+            {'pokemonType': 'WATER', 'leaders': 1, 'battles': 1, 'wins': 0,
+             'holdRate': 0.0},
+        ])
+        league = to_global_id('LeagueType', League.objects.get(reference='league 1').pk)
+        stats = self.execute(self.type_matchups, {'league': league})['typeMatchupStats']
+        self.assertEqual([s['pokemonType'] for s in stats], ['WATER'])
+
+
+class HeadToHeadTest(GraphQLTestCase):
+    head_to_head = '''
+        query($trainer: ID!, $leader: ID!, $league: ID) {
+            headToHead(trainer: $trainer, leader: $leader, league: $league) {
+                league { reference }
+                battles
+                wins
+                losses
+                lastBattleAt
+            }
+        }
+    '''
+    rivals = '''
+        query($trainer: ID!, $orderBy: RivalOrdering, $after: String) {
+            rivals(trainer: $trainer, orderBy: $orderBy, first: 1, after: $after) {
+                edges {
+                    cursor
+                    node { leader { discordId } league { reference } battles wins }
+                }
+                pageInfo { hasNextPage }
+            }
+        }
+    '''
+
+    def setUp(self):
+        create_leagues(2)
+        self.trainer = Trainer.objects.create(discord_id='ash')
+        for league in League.objects.all():
+            league.competitors.add(self.trainer)
+            Score.objects.create(league=league, trainer=self.trainer)
+        first, second = League.objects.order_by('pk')
+
+        register_battles([
+            BattleRecord(first.pk, 'ash', 'gym 0', 'ash'),
+            BattleRecord(first.pk, 'ash', 'gym 0', 'ash'),
+            BattleRecord(first.pk, 'ash', 'elite 0', 'ash'),
+        ])
+        score = Score.objects.get(league=second, trainer=self.trainer)
+        register_battle(score, self.trainer, Leader.objects.get(discord_id='gym 0'), 'gym 0')
+
+    def variables(self, **kwargs):
+        return {
+            'trainer': to_global_id('TrainerType', self.trainer.pk),
+            **{
+                key: to_global_id(f'{key.capitalize()}Type', value.pk)
+                for key, value in kwargs.items()
+            }
+        }
+
+    def test_battle_register_updates_the_records(self):
+        gym = Leader.objects.get(discord_id='gym 0')
+        record = HeadToHead.objects.get(
+            trainer=self.trainer,
+            leader=gym,
+            league__reference='league 0'
+        )
+        self.assertEqual((record.battles, record.wins, record.losses), (2, 2, 0))
+        last = Battle.objects.filter(leader=gym, league__reference='league 0').latest('pk')
+        self.assertEqual(record.last_battle_at, last.battle_datetime)
+
+        records = sorted(HeadToHead.objects.values_list(
+            'trainer_id', 'leader_id', 'league_id', 'battles', 'wins', 'losses',
+            'last_battle_at'
+        ))
+        self.assertEqual(rebuild_head_to_heads(), 3)
+        self.assertEqual(sorted(HeadToHead.objects.values_list(
+            'trainer_id', 'leader_id', 'league_id', 'battles', 'wins', 'losses',
+            'last_battle_at'
+        )), records)
+
+    def test_head_to_head(self):
+        gym = Leader.objects.get(discord_id='gym 0')
+        league = League.objects.get(reference='league 1')
+        with self.assertNumQueries(2):
+            data = self.execute(self.head_to_head, self.variables(leader=gym, league=league))
+        self.assertEqual(data['headToHead']['league'], {'reference': 'league 1'})
+        self.assertEqual(
+            (data['headToHead']['battles'], data['headToHead']['wins']),
+            (1, 0)
+        )
+
+        with self.assertNumQueries(1):
+            data = self.execute(self.head_to_head, {
+                **self.variables(leader=gym),
+                'league': None
+            })
+        record = data['headToHead']
+        self.assertEqual(
+            (record['league'], record['battles'], record['wins'], record['losses']),
+            (None, 3, 2, 1)
+        )
+        self.assertEqual(
+            record['lastBattleAt'],
+            Battle.objects.filter(leader=gym).latest('pk').battle_datetime.isoformat()
+        )
+
+        champion = Leader.objects.get(discord_id='champion 0')
+        data = self.execute(self.head_to_head, self.variables(leader=champion))
+        self.assertIsNone(data['headToHead'])
+
+    def test_rivals(self):
+        with self.assertNumQueries(1):
+            data = self.execute(self.rivals, self.variables())
+        rivals = data['rivals']
+        self.assertEqual(rivals['edges'][0]['node'], {
+            'leader': {'discordId': 'gym 0'},
+            'league': {'reference': 'league 0'},
+            'battles': 2,
+            'wins': 2,
+        })
+        self.assertTrue(rivals['pageInfo']['hasNextPage'])
+
+        nodes = []
+        after = None
+        while True:
+            rivals = self.execute(self.rivals, {
+                **self.variables(),
+                'orderBy': 'LAST_BATTLE_DESC',
+                'after': after
+            })['rivals']
+            nodes += [edge['node'] for edge in rivals['edges']]
+            if not rivals['pageInfo']['hasNextPage']:
+                break
+            after = rivals['edges'][-1]['cursor']
+        self.assertEqual(
+            [(node['leader']['discordId'], node['league']['reference']) for node in nodes],
+            [('gym 0', 'league 1'), ('elite 0', 'league 0'), ('gym 0', 'league 0')]
+        )
+
+
+class RatingTest(GraphQLTestCase):
+    leaderboard = '''
+        query($orderBy: RatingOrdering, $after: String) {
+            trainerLeaderboard(orderBy: $orderBy, first: 1, after: $after) {
+                edges { cursor node { discordId rating } }
+                pageInfo { hasNextPage }
+            }
+        }
+    '''
+
+    def setUp(self):
+        create_leagues(1)
+        league = League.objects.get()
+        self.trainer = Trainer.objects.create(discord_id='ash')
+        league.competitors.add(self.trainer)
+        score = Score.objects.create(league=league, trainer=self.trainer)
+        Score.objects.create(
+            league=league,
+            trainer=Trainer.objects.get(discord_id='rookie 0')
+        )
+
+        register_battle(score, self.trainer, Leader.objects.get(discord_id='gym 0'), 'ash')
+        register_battles([
+            BattleRecord(league.pk, 'ash', 'elite 0', 'ash'),
+            BattleRecord(league.pk, 'rookie 0', 'gym 0', 'gym 0'),
+            BattleRecord(league.pk, 'ash', 'champion 0', 'champion 0'),
+        ])
+
+    def ratings(self):
+        return (
+            dict(Trainer.objects.values_list('pk', 'rating')),
+            dict(Leader.objects.values_list('pk', 'rating')),
+        )
+
+    def test_battle_register_updates_the_ratings(self):
+        self.trainer.refresh_from_db()
+        gym = Leader.objects.get(discord_id='gym 0')
+        rookie = Trainer.objects.get(discord_id='rookie 0')
+        # gym 0: perde a 1500 (-16), vence o rookie 0 a 1484
+        expected = 32 * (1 - expected_score(1484, 1500))
+        self.assertAlmostEqual(gym.rating, 1484 + expected)
+        self.assertAlmostEqual(rookie.rating, 1500 - expected)
+        self.assertGreater(self.trainer.rating, 1500)
+
+        trainers, leaders = self.ratings()
+        self.assertAlmostEqual(sum(trainers.values()) + sum(leaders.values()),
+                               1500 * (len(trainers) + len(leaders)))
+
+    def test_replay_matches_the_sequential_ratings(self):
+        trainers, leaders = self.ratings()
+        result = replay(*battle_history())
+        self.assertEqual(result.battles, 4)
+        for pk, rating in result.trainer_ratings.items():
+            self.assertAlmostEqual(rating, trainers[pk])
+        for pk, rating in result.leader_ratings.items():
+            self.assertAlmostEqual(rating, leaders[pk])
+
+        random_state = np.random.RandomState(0)
+        trainer_ids = random_state.randint(0, 30, 2000)
+        leader_ids = random_state.randint(0, 10, 2000)
+        won = random_state.rand(2000) < 0.4
+        ratings = {('t', pk): 1500.0 for pk in trainer_ids.tolist()}
+        ratings.update({('l', pk): 1500.0 for pk in leader_ids.tolist()})
+        for trainer, leader, trainer_won in zip(trainer_ids, leader_ids, won):
+            delta = 20 * (trainer_won - expected_score(
+                ratings['t', trainer], ratings['l', leader]
+            ))
+            ratings['t', trainer] += delta
+            ratings['l', leader] -= delta
+
+        result = replay(trainer_ids, leader_ids, won, k=20)
+        for pk, rating in result.trainer_ratings.items():
+            self.assertAlmostEqual(rating, ratings['t', pk])
+        for pk, rating in result.leader_ratings.items():
+            self.assertAlmostEqual(rating, ratings['l', pk])
+
+    def test_recompute_command(self):
+        trainers, leaders = self.ratings()
+        Trainer.objects.update(rating=1000)
+        Leader.objects.update(rating=2000)
+
+        out = StringIO()
+        call_command('recompute_ratings', '--dry-run', stdout=out)
+        self.assertIn('4 battles replayed', out.getvalue())
+        self.assertEqual(set(Trainer.objects.values_list('rating', flat=True)), {1000})
+
+        call_command('recompute_ratings', stdout=StringIO())
+        recomputed_trainers, recomputed_leaders = self.ratings()
+        for pk, rating in trainers.items():
+            self.assertAlmostEqual(recomputed_trainers[pk], rating)
+        for pk, rating in leaders.items():
+            self.assertAlmostEqual(recomputed_leaders[pk], rating)
+
+        call_command('recompute_ratings', '--k', '0', stdout=StringIO())
+        self.assertEqual(set(Leader.objects.values_list('rating', flat=True)), {1500})
+
+    def test_leaderboard(self):
+        expected = list(Trainer.objects.order_by('-rating', '-id').values_list(
+            'discord_id', 'rating'
+        ))
+        with self.assertNumQueries(1):
+            data = self.execute(self.leaderboard)
+        self.assertEqual(data['trainerLeaderboard']['edges'][0]['node']['discordId'], 'ash')
+
+        nodes = []
+        after = None
+        while True:
+            leaderboard = self.execute(self.leaderboard, {'after': after})['trainerLeaderboard']
+            nodes += [edge['node'] for edge in leaderboard['edges']]
+            if not leaderboard['pageInfo']['hasNextPage']:
+                break
+            after = leaderboard['edges'][-1]['cursor']
+        self.assertEqual([(node['discordId'], node['rating']) for node in nodes], expected)
+
+        data = self.execute(self.leaderboard, {'orderBy': 'RATING_ASC'})
+        self.assertEqual(
+            data['trainerLeaderboard']['edges'][0]['node']['discordId'],
+            'rookie 0'
+        )
@@ -1,7 +1,9 @@
 """
 Módulo para ferramentas utili†arias.
 """
+from bisect import bisect_right
 from math import ceil
+import numpy as np
 from graphql_relay import from_global_id
 
 
@@ -36,10 +38,55 @@ def get_exp(trainer_lv, leader_lv):
     return ceil((2 * leader_lv * (trainer_lv * 1.5)))
 
 
+# Exp necessária para deixar o lv 1 (valor padrão de next_lv nos models)
+FIRST_LV_EXP = 5
+
+# Lv máximo da tabela de exp; a exp é um inteiro de 32 bits e
+# next_lv(MAX_LV) já ultrapassa este limite
+MAX_LV = 2000
+
+
+def lv_thresholds(max_lv=MAX_LV):
+    """
+    Retorna a tabela com a exp necessária para deixar cada lv, onde o índice
+    i corresponde ao lv i + 1.
+    """
+    return [FIRST_LV_EXP] + [next_lv(lv) for lv in range(2, max_lv + 1)]
+
+
+LV_THRESHOLDS = lv_thresholds()
+LV_THRESHOLDS_ARRAY = np.array(LV_THRESHOLDS, dtype=np.int64)
+
+
+def level_for_exp(exp):
+    """
+    Retorna o lv correspondente à exp fornecida.
+    O lv é estimado invertendo a curva cúbica de next_lv e confirmado com uma
+    busca binária na tabela de exp, que mantém o resultado exato apesar do
+    arredondamento de ceil.
+    param : exp : <int>
+    return : <int>
+    """
+    estimate = int((5 * max(exp, 0) / 4) ** (1 / 3))
+    low = min(max(estimate - 1, 0), len(LV_THRESHOLDS))
+    high = min(estimate + 2, len(LV_THRESHOLDS))
+    return bisect_right(LV_THRESHOLDS, exp, low, high) + 1
+
+
+def levels_for_exp(exps):
+    """
+    Versão vetorizada de level_for_exp.
+    param : exps : <array> exp de cada jogador
+    return : <tuple> arrays com o lv e o next_lv de cada jogador
+    """
+    lvs = np.searchsorted(LV_THRESHOLDS_ARRAY, exps, side='right') + 1
+    return lvs, LV_THRESHOLDS_ARRAY[lvs - 1]
+
+
 def lv_update(trainer):
     """
     Atualiza o lv e experiência do treinador/lider.
     """
-    while trainer.exp >= trainer.next_lv:
-        trainer.lv += 1
+    if trainer.exp >= trainer.next_lv:
+        trainer.lv = max(trainer.lv + 1, level_for_exp(trainer.exp))
         trainer.next_lv = next_lv(trainer.lv)
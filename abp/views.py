@@ -1,3 +1,219 @@
-from django.shortcuts import render
+import json
+from contextlib import ExitStack
+from time import perf_counter
+from django.conf import settings
+from django.db import connections
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseForbidden, JsonResponse,
+                         StreamingHttpResponse)
+from django.utils.crypto import constant_time_compare
+from graphene_django.views import GraphQLView, HttpError
+from graphql.execution import ExecutionResult
+from graphql.execution.middleware import MiddlewareManager
+from abp import bus, cache, routers
+from abp.documents import (PersistedQueryError, document_backend,
+                           resolve_persisted_query)
+from abp.exports import Export
+from abp.instrumentation import (QueryRecorder, operation_stats,
+                                 get_operation_name, metrics_requested)
+from abp.loaders import Loaders
+from abp.metrics import observe_request
 
-# Create your views here.
+
+class ABPGraphQLView(GraphQLView):
+    """
+    GraphQL view that attaches a fresh set of DataLoaders to the request
+    context, so the resolvers can batch their database lookups.
+    The SQL statements of every operation are recorded: the metrics are
+    aggregated by operation name and, when requested, returned in the
+    response `extensions`. The latency and errors of every operation are
+    exported as Prometheus metrics (see abp.metrics).
+    The parsed and validated documents are cached, and the clients can send
+    persisted queries (see abp.documents). The query responses are cached
+    until a mutation changes their models (see abp.cache).
+    The queries read from the database replicas, except for the clients that
+    sent a mutation in the last seconds (see abp.routers).
+    """
+    def get_context(self, request):
+        request.loaders = Loaders()
+        return request
+
+    def get_backend(self, request):
+        return document_backend
+
+    def get_graphql_params(self, request, data):
+        # Os parâmetros são resolvidos uma única vez por requisição
+        params = getattr(request, 'graphql_params', None)
+        if params is not None:
+            return params
+
+        query, variables, operation_name, id = super().get_graphql_params(
+            request, data
+        )
+        extensions = data.get('extensions') or request.GET.get('extensions')
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(
+                    HttpResponseBadRequest('Extensions are invalid JSON.')
+                )
+
+        try:
+            query = resolve_persisted_query(self.schema, query, extensions)
+        except PersistedQueryError as ex:
+            raise HttpError(HttpResponse(status=ex.status), str(ex))
+
+        request.graphql_params = (query, variables, operation_name, id)
+        return request.graphql_params
+
+    def get_middleware(self, request):
+        # Sem o wrap_in_promise, os campos resolvidos de forma síncrona não
+        # são convertidos em promises a cada passagem pelos middlewares
+        if not self.middleware:
+            return None
+        return MiddlewareManager(*self.middleware, wrap_in_promise=False)
+
+    def execute_graphql_request(self, request, data, query, variables,
+                                operation_name, show_graphiql=False):
+        start = perf_counter()
+        entry = None
+        # Os clientes que leem do banco principal após uma mutação não usam
+        # o cache: as respostas em cache podem ter sido lidas de uma réplica
+        if not (routers.replicas() and routers.is_sticky(request)):
+            entry = self.cache_entry(query, variables, operation_name)
+        if entry is not None and entry.data is not None:
+            result = ExecutionResult(data=entry.data)
+        else:
+            result = super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+            if (entry is not None and result is not None and not result.errors
+                    and self.can_store(request, entry)):
+                entry.store(result.data)
+
+        if result is not None:
+            observe_request(
+                get_operation_name(query, operation_name),
+                perf_counter() - start,
+                bool(result.errors)
+            )
+        return result
+
+    def can_store(self, request, entry):
+        """
+        A response read from a replica is not cached while the replication
+        may still lag behind the last invalidation of its tags.
+        """
+        if getattr(request, 'read_alias', None) is None:
+            return True
+        return not entry.invalidated_within(routers.sticky_seconds())
+
+    def cache_entry(self, query, variables, operation_name):
+        """
+        Returns the response cache entry of the operation, or None if the
+        response can't be cached.
+        """
+        if not query or cache.get_cache() is None:
+            return None
+        try:
+            document = document_backend.document_from_string(self.schema, query)
+        except Exception:
+            # O erro é retornado pela execução da query
+            return None
+        return cache.lookup(document, variables, operation_name)
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        mutation = getattr(request, 'graphql_operation', None) == 'mutation'
+        if mutation and routers.replicas():
+            routers.stick_to_primary(response)
+        return response
+
+    def read_alias(self, request, query, operation_name):
+        """
+        Returns the database alias the operation reads from: a replica for
+        queries, or None (the primary database).
+        """
+        if not routers.replicas():
+            return None
+        try:
+            document = document_backend.document_from_string(self.schema, query)
+            request.graphql_operation = document.get_operation_type(operation_name)
+        except Exception:
+            # O erro é retornado pela execução da query
+            return None
+
+        if request.graphql_operation != 'query' or routers.is_sticky(request):
+            return None
+        return routers.choose_replica()
+
+    def get_response(self, request, data, show_graphiql=False):
+        recorder = QueryRecorder()
+        request.sql_recorder = recorder
+        start = perf_counter()
+        query, _, name, _ = self.get_graphql_params(request, data)
+        alias = self.read_alias(request, query, name) if query else None
+        request.read_alias = alias
+        with ExitStack() as stack:
+            # As invalidações da requisição são publicadas em um único evento
+            stack.enter_context(bus.batch())
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            stack.enter_context(routers.reading_from(alias))
+            result = super().get_response(request, data, show_graphiql)
+
+        operation_stats.add(
+            get_operation_name(query, name),
+            recorder,
+            perf_counter() - start
+        )
+        return result
+
+    def json_encode(self, request, d, pretty=False):
+        recorder = getattr(request, 'sql_recorder', None)
+        if recorder is not None and metrics_requested(request):
+            d = {**d, 'extensions': {'sql': recorder.metrics()}}
+        return super().json_encode(request, d, pretty)
+
+
+def sql_stats(request):
+    """
+    Returns the rolling SQL metrics of each GraphQL operation handled by this
+    process. Available only with DEBUG or ABP_SQL_METRICS enabled.
+    """
+    if not (settings.DEBUG or getattr(settings, 'ABP_SQL_METRICS', False)):
+        raise Http404()
+    return JsonResponse(operation_stats.snapshot())
+
+
+def export(request, name):
+    """
+    Streams a table export (see abp.exports) as NDJSON or CSV, optionally
+    gzipped. Accepts the query parameters `format` (ndjson or csv), `gzip`,
+    `league` (a league global ID), `since` and `until` (ISO 8601 dates).
+    Available only when ABP_EXPORT_TOKEN is set; the clients must send it
+    in the `Authorization: Bearer <token>` header.
+    """
+    token = getattr(settings, 'ABP_EXPORT_TOKEN', None)
+    if not token:
+        raise Http404()
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not constant_time_compare(authorization, f'Bearer {token}'):
+        return HttpResponseForbidden()
+
+    try:
+        table = Export(
+            name,
+            league=request.GET.get('league'),
+            since=request.GET.get('since'),
+            until=request.GET.get('until'),
+            format=request.GET.get('format', 'ndjson'),
+            compress=request.GET.get('gzip') in ('1', 'true', 'True')
+        )
+    except Exception as ex:
+        return HttpResponseBadRequest(str(ex))
+
+    response = StreamingHttpResponse(table, content_type=table.content_type)
+    response['Content-Disposition'] = f'attachment; filename="{table.filename}"'
+    return response
@@ -0,0 +1,36 @@
+"""
+Configuração do gunicorn.
+As métricas Prometheus de cada worker são gravadas em arquivos no diretório
+`prometheus_multiproc_dir`, agregados pelo endpoint /metrics. O diretório é
+esvaziado ao iniciar o servidor e os arquivos de um worker encerrado são
+marcados para que seus gauges não sejam mais exportados.
+Cada worker inicia o subscriber do barramento de invalidação (ver abp.bus).
+uso: gunicorn -c bill/gunicorn.conf.py bill.wsgi:application
+"""
+import os
+import shutil
+import tempfile
+
+
+# O diretório deve ser definido antes que os workers importem o
+# prometheus_client
+os.environ.setdefault(
+    'prometheus_multiproc_dir',
+    os.path.join(tempfile.gettempdir(), 'bill_metrics')
+)
+
+
+def on_starting(server):
+    metrics_dir = os.environ['prometheus_multiproc_dir']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    from abp.bus import start
+    start()
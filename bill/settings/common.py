@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+import tempfile
 
 
 __version__ = '0.1.1'
@@ -84,10 +85,45 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Banco de testes em arquivo: o banco em memória compartilhada do
+        # sqlite não suporta os testes com escritas concorrentes
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
 
+
+def replica_databases(primary, locations):
+    """
+    Configuração das réplicas de leitura do banco de dados principal: cada
+    réplica usa as mesmas credenciais em outro host (no sqlite, outro
+    arquivo). Os testes leem do banco de testes principal.
+    """
+    location_key = 'NAME' if 'sqlite' in primary['ENGINE'] else 'HOST'
+    return {
+        f'replica_{index}': {
+            **primary,
+            location_key: location.strip(),
+            'TEST': {'MIRROR': 'default'},
+        }
+        for index, location in enumerate(locations.split(','), start=1)
+        if location.strip()
+    }
+
+
+# Réplicas de leitura (ver abp.routers): ABP_DATABASE_REPLICAS lista os hosts
+# das réplicas (no sqlite, os arquivos), separados por vírgula. As queries
+# GraphQL leem das réplicas, exceto nos ABP_REPLICA_STICKY_SECONDS segundos
+# seguintes a uma mutação do mesmo cliente.
+DATABASES.update(
+    replica_databases(DATABASES['default'], os.environ.get('ABP_DATABASE_REPLICAS', ''))
+)
+DATABASE_ROUTERS = ['abp.routers.ReplicaRouter']
+ABP_READ_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
+ABP_REPLICA_STICKY_SECONDS = float(os.environ.get('ABP_REPLICA_STICKY_SECONDS', 5))
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -128,4 +164,65 @@ STATIC_URL = '/static/'
 
 GRAPHENE = {
     'SCHEMA': 'bill.schema.schema',
-}
\ No newline at end of file
+    'MIDDLEWARE': [
+        'abp.metrics.ResolverMetricsMiddleware',
+    ],
+}
+
+# Métricas SQL das operações GraphQL: com ABP_SQL_METRICS ativo as métricas
+# são retornadas em todas as respostas, senão apenas nas requisições com o
+# cabeçalho X-SQL-Metrics. Os agregados por operação consideram as últimas
+# ABP_SQL_METRICS_WINDOW requisições de cada operação.
+ABP_SQL_METRICS = os.environ.get('ABP_SQL_METRICS', 'False') == 'True'
+ABP_SQL_METRICS_WINDOW = int(os.environ.get('ABP_SQL_METRICS_WINDOW', 1000))
+
+# Cache de documentos GraphQL analisados e validados, e modo das persisted
+# queries: automatic, whitelist ou off (ver abp/documents.py)
+ABP_DOCUMENT_CACHE_SIZE = int(os.environ.get('ABP_DOCUMENT_CACHE_SIZE', 500))
+ABP_PERSISTED_QUERIES = os.environ.get('ABP_PERSISTED_QUERIES', 'automatic')
+
+# Caches: as respostas GraphQL usam o cache definido por ABP_RESPONSE_CACHE
+# (desativado quando vazio). O cache deve ser compartilhado pelos workers do
+# gunicorn, como o cache em arquivos (padrão) ou o memcached, ex:
+# ABP_GRAPHQL_CACHE_BACKEND=django.core.cache.backends.memcached.MemcachedCache
+# ABP_GRAPHQL_CACHE_LOCATION=127.0.0.1:11211
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'graphql': {
+        'BACKEND': os.environ.get(
+            'ABP_GRAPHQL_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.environ.get(
+            'ABP_GRAPHQL_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'bill_graphql_cache')
+        ),
+    },
+}
+ABP_RESPONSE_CACHE = os.environ.get('ABP_RESPONSE_CACHE') or None
+ABP_RESPONSE_CACHE_TIMEOUT = int(os.environ.get('ABP_RESPONSE_CACHE_TIMEOUT', 300))
+
+# Barramento de invalidação dos caches dos workers (ver abp.bus): postgres,
+# table, auto (postgres no PostgreSQL, senão table) ou vazio para desativar.
+# Os eventos são publicados apenas pelos workers do gunicorn, que iniciam o
+# subscriber (ver bill/gunicorn.conf.py).
+ABP_INVALIDATION_BUS = os.environ.get('ABP_INVALIDATION_BUS', 'auto')
+ABP_INVALIDATION_POLL_INTERVAL = float(
+    os.environ.get('ABP_INVALIDATION_POLL_INTERVAL', 0.05)
+)
+
+# Token das exportações em streaming (ver abp/exports.py): o endpoint
+# /exports/<nome>/ fica desativado quando vazio.
+ABP_EXPORT_TOKEN = os.environ.get('ABP_EXPORT_TOKEN') or None
+
+# Diretório do snapshot colunar das batalhas (ver abp/analytics.py)
+ABP_SNAPSHOT_DIR = os.environ.get(
+    'ABP_SNAPSHOT_DIR',
+    os.path.join(BASE_DIR, 'snapshots')
+)
+
+# Fator K do rating Elo (ver abp/ratings.py): máximo de pontos transferidos
+# por batalha
+ABP_RATING_K = float(os.environ.get('ABP_RATING_K', 32))
@@ -15,3 +15,12 @@ DATABASES = {
         'PORT': 3306,
     }
 }
+
+# Cache de respostas GraphQL compartilhado pelos workers
+ABP_RESPONSE_CACHE = os.environ.get('ABP_RESPONSE_CACHE', 'graphql') or None
+
+# Réplicas de leitura do banco de dados (ver bill.settings.common)
+DATABASES.update(
+    replica_databases(DATABASES['default'], os.environ.get('ABP_DATABASE_REPLICAS', ''))
+)
+ABP_READ_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
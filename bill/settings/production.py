@@ -17,6 +17,9 @@ DATABASES = {
 
 DEBUG = False
 
+# Lookups da pg_trgm usados pela busca de jogadores (ver abp.search)
+INSTALLED_APPS = INSTALLED_APPS + ['django.contrib.postgres']
+
 #configs para o heroku
 cwd = os.getcwd()
 if cwd == '/app' or cwd[:4] == '/tmp':
@@ -38,6 +41,12 @@ if cwd == '/app' or cwd[:4] == '/tmp':
         os.path.join(BASE_DIR, 'static'),
     )
 
+# Réplicas de leitura do banco de dados (ver bill.settings.common)
+DATABASES.update(
+    replica_databases(DATABASES['default'], os.environ.get('ABP_DATABASE_REPLICAS', ''))
+)
+ABP_READ_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
+
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 
 STATIC_ROOT = os.path.join(PROJECT_ROOT, 'staticfiles')
@@ -51,3 +60,6 @@ MEDIA_URL = '/media/'
 dotenv_file = os.path.join(BASE_DIR, ".env")
 if os.path.isfile(dotenv_file):
     dotenv.load_dotenv(dotenv_file)
+
+# Cache de respostas GraphQL compartilhado pelos workers
+ABP_RESPONSE_CACHE = os.environ.get('ABP_RESPONSE_CACHE', 'graphql') or None
@@ -16,9 +16,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
+from abp.views import ABPGraphQLView, export, sql_stats
+from abp.metrics import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path('graphql/', csrf_exempt(ABPGraphQLView.as_view(graphiql=True))),
+    path('graphql/sql-stats/', sql_stats),
+    path('metrics', metrics),
+    path('exports/<str:name>/', export),
 ]